@@ -1,12 +1,35 @@
+import os
+import json
+from airflow.decorators import task
 from airflow.models.dag import DAG
 from airflow.operators.bash import BashOperator
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # --- IMPORTANT ---
-# This is the absolute path to the project directory on the user's machine.
-# In a real production environment, this path would be configured to point to
-# where the repository is checked out on the Airflow worker machines.
-PROJECT_HOME = '/Users/uditsharma/code/llm_fine_tune_data_gen'
+# The project directory where the repository is checked out on the Airflow worker
+# machines. Set LLM_PIPELINE_HOME on the workers; by default it is the checkout this
+# DAG file lives in. Every worker needs the same checkout and a shared data/ directory.
+PROJECT_HOME = os.environ.get('LLM_PIPELINE_HOME', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Shards requested from the planning step (default: sharding.num_shards in config.yaml).
+# The plan may hold fewer when the repository has fewer files; the mapped tasks
+# follow the plan, not this setting.
+NUM_SHARDS = os.environ.get('LLM_PIPELINE_SHARDS')
+
+# The shard count the plan actually made, for the tasks that see every shard.
+SHARD_COUNT = "{{ ti.xcom_pull(task_ids='shard_arguments') | length }}"
+
+
+def script(name, arguments=''):
+    """Returns the bash command running one of the pipeline scripts from the project directory."""
+    return f"cd {PROJECT_HOME} && python3 scripts/{name} {arguments}".strip()
+
+
+def per_shard(name):
+    """Returns a function building the command that runs `name` on one shard, for mapping over the shards."""
+    def command(arguments):
+        return script(name, arguments)
+    return command
 
 
 with DAG(
@@ -16,31 +39,73 @@ with DAG(
     schedule_interval='@weekly',  # You can use cron expressions like '0 2 * * 0'
     catchup=False,
     tags=['llm', 'data-pipeline'],
+    # A retried extraction or refinement task resumes from its checkpoint
+    # (see 'checkpoint' in config.yaml) instead of starting over.
+    default_args={'retries': 2, 'retry_delay': timedelta(minutes=5)},
 ) as dag:
 
-    # Task 1: Extract data from the raw code repository
-    task_extract = BashOperator(
+    # Each script prints its stage metrics as one JSON line last, which
+    # do_xcom_push publishes as the task's XCom (the full file is in metrics.metrics_dir).
+
+    # Task 1: Split the raw code repository into byte-balanced shards
+    task_plan = BashOperator(
+        task_id='plan_shards',
+        bash_command=script('plan_shards.py', f"--shard-count {NUM_SHARDS}" if NUM_SHARDS else ''),
+        do_xcom_push=True,
+    )
+
+    @task
+    def shard_arguments(plan_metrics):
+        """Returns the command-line arguments of each shard in the plan, one mapped task instance per shard."""
+        count = int(json.loads(plan_metrics)['counters']['shards'])
+        return [f"--shard-index {index} --shard-count {count}" for index in range(count)]
+
+    shards = shard_arguments(task_plan.output)
+
+    # Task 2: Extract data from each shard of the repository (one mapped task per shard)
+    task_extract = BashOperator.partial(
         task_id='extract_from_repo',
-        bash_command=f"python3 {PROJECT_HOME}/scripts/extract_from_repo.py"
+        do_xcom_push=True,
+    ).expand(bash_command=shards.map(per_shard('extract_from_repo.py')))
+
+    # Task 3: Drop exact and near-duplicate records across all shards before they reach the LLM
+    task_dedup = BashOperator(
+        task_id='deduplicate_pairs',
+        bash_command=script('deduplicate_pairs.py', f"--shard-count {SHARD_COUNT}"),
+        do_xcom_push=True,
     )
 
-    # Task 2: Refine the data using the simulated LLM
-    task_refine = BashOperator(
+    # Task 4: Refine each shard using the simulated LLM
+    task_refine = BashOperator.partial(
         task_id='simulate_llm_refinement',
-        bash_command=f"python3 {PROJECT_HOME}/scripts/simulate_llm_refinement.py"
-    )
+        do_xcom_push=True,
+    ).expand(bash_command=shards.map(per_shard('simulate_llm_refinement.py')))
 
-    # Task 3: Process and validate the refined data
-    task_process = BashOperator(
+    # Task 5: Process and validate each refined shard
+    task_process = BashOperator.partial(
         task_id='run_processing_pipeline',
-        bash_command=f"python3 {PROJECT_HOME}/scripts/run_pipeline.py"
-    )
+        do_xcom_push=True,
+    ).expand(bash_command=shards.map(per_shard('run_pipeline.py')))
 
-    # Task 4: Tokenize the final dataset
-    task_tokenize = BashOperator(
+    # Task 6: Tokenize each processed shard
+    task_tokenize = BashOperator.partial(
         task_id='tokenize_data',
-        bash_command=f"python3 {PROJECT_HOME}/scripts/tokenize_data.py"
+        do_xcom_push=True,
+    ).expand(bash_command=shards.map(per_shard('tokenize_data.py')))
+
+    # Task 7: Merge the shards into the final dataset, in shard (file) order
+    task_merge = BashOperator(
+        task_id='merge_shards',
+        bash_command=script('merge_shards.py', f"--shard-count {SHARD_COUNT}"),
+        do_xcom_push=True,
+    )
+
+    # Task 8: Shuffle the merged dataset into indexed Arrow shards for training
+    task_order = BashOperator(
+        task_id='order_dataset',
+        bash_command=script('order_dataset.py'),
+        do_xcom_push=True,
     )
 
     # Define the execution order (the dependency graph)
-    task_extract >> task_refine >> task_process >> task_tokenize 
\ No newline at end of file
+    task_plan >> shards >> task_extract >> task_dedup >> task_refine >> task_process >> task_tokenize >> task_merge >> task_order
@@ -0,0 +1,39 @@
+import os
+from airflow.models.dag import DAG
+from airflow.operators.bash import BashOperator
+from datetime import datetime
+
+# --- IMPORTANT ---
+# The project directory on the Airflow worker: LLM_PIPELINE_HOME, or by default
+# the checkout this DAG file lives in.
+PROJECT_HOME = os.environ.get('LLM_PIPELINE_HOME', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+with DAG(
+    dag_id='llm_data_pipeline_fused',
+    start_date=datetime(2024, 1, 1),
+    description='Runs the full LLM data preparation pipeline as streaming stages in a single process.',
+    schedule_interval='@weekly',
+    catchup=False,
+    tags=['llm', 'data-pipeline'],
+) as dag:
+
+    # A single task: extraction, refinement, processing and tokenization hand batches
+    # to each other through bounded in-memory queues instead of files on disk.
+    # Set fused_runner.write_intermediates in config.yaml to also keep stage outputs.
+    # The run's metrics are printed as one JSON line last and pushed as the XCom.
+    task_run_fused = BashOperator(
+        task_id='run_fused_pipeline',
+        bash_command=f"cd {PROJECT_HOME} && python3 scripts/run_fused_pipeline.py",
+        do_xcom_push=True,
+    )
+
+    # Shuffle the tokenized dataset into indexed Arrow shards for training. This needs
+    # the whole dataset, so it runs after the streaming stages have finished.
+    task_order = BashOperator(
+        task_id='order_dataset',
+        bash_command=f"cd {PROJECT_HOME} && python3 scripts/order_dataset.py",
+        do_xcom_push=True,
+    )
+
+    task_run_fused >> task_order
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import random
+import tempfile
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_pipeline.extraction import extract_functions_from_file
+from extract_from_repo import extract_file_context_and_functions
+
+# --- Benchmark Configuration ---
+# Number of large files to generate, functions per file and lines per function body.
+NUM_FILES = 4
+FUNCTIONS_PER_FILE = 2000
+LINES_PER_FUNCTION = 12
+# Number of imports and module-level constants in each file's context header.
+CONTEXT_LINES = 20
+REPEATS = 3
+SEED = 0
+
+def generate_large_file(path, rng):
+    """Writes a synthetic Python file with many documented functions, methods and nested defs."""
+    lines = [f"import module_{i}" for i in range(CONTEXT_LINES // 2)]
+    lines += [f"CONSTANT_{i} = {rng.randint(0, 1000)}" for i in range(CONTEXT_LINES // 2)]
+    for f in range(FUNCTIONS_PER_FILE):
+        indent = ""
+        if f % 10 == 0:
+            lines.append(f"\nclass Helper{f}:")
+            indent = "    "
+        lines.append(f"\n{indent}def function_{f}(a, b, c):")
+        lines.append(f'{indent}    """Computes value {f} from a, b and c."""')
+        for l in range(LINES_PER_FUNCTION):
+            lines.append(f"{indent}    a = (a * {rng.randint(1, 9)} + b - c) % {rng.randint(10, 99)}  # step {l}")
+        if f % 25 == 0:
+            lines.append(f"{indent}    def inner_{f}(x):")
+            lines.append(f'{indent}        """Nested helper."""')
+            lines.append(f"{indent}        return x + 1")
+        lines.append(f"{indent}    return a")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+
+def time_extractor(name, extractor, file_paths, total_bytes):
+    """Runs an extractor over all files REPEATS times and prints its best time."""
+    best = float('inf')
+    records = 0
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        records = sum(1 for path in file_paths for _ in extractor(path))
+        best = min(best, time.perf_counter() - start)
+    mb_per_sec = total_bytes / (1024 * 1024) / best
+    print(f"{name:<12} {best:8.3f}s  {records:8d} records  {records / best:10.0f} rec/s  {mb_per_sec:7.2f} MB/s")
+    return best
+
+def main():
+    """Benchmarks the single-pass extractor against the legacy two-pass extractor on large files."""
+    rng = random.Random(SEED)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_paths = []
+        for i in range(NUM_FILES):
+            path = os.path.join(tmp_dir, f"large_{i}.py")
+            generate_large_file(path, rng)
+            file_paths.append(path)
+        total_bytes = sum(os.path.getsize(path) for path in file_paths)
+        print(f"Benchmarking extraction on {NUM_FILES} files ({total_bytes / (1024 * 1024):.1f} MB, best of {REPEATS})...")
+
+        legacy = time_extractor("legacy", extract_file_context_and_functions, file_paths, total_bytes)
+        single_pass = time_extractor("single_pass", extract_functions_from_file, file_paths, total_bytes)
+        print(f"Speedup: {legacy / single_pass:.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import os
+import sys
+import argparse
+import tempfile
+import yaml
+import pandas as pd
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_pipeline.benchmark import measure_stage, find_regressions, load_baseline, save_baseline
+from data_pipeline.synthetic import generate_synthetic_repo
+from data_pipeline.extraction import extract_functions_from_file
+from data_pipeline.processing import validate_code, transform_to_alpaca_format, to_alpaca_frame
+from data_pipeline.refinement import AsyncRefiner
+from data_pipeline.triage import DocstringTriage
+from extract_from_repo import extract_file_context_and_functions, iter_python_files
+from simulate_llm_refinement import simulate_judge_verdict, simulate_generated_docstring
+
+# Synthetic-repo settings, overridable in the 'benchmark' section of config.yaml.
+SPEC_KEYS = ('num_files', 'functions_per_file', 'docstring_rate', 'oversized_functions', 'broken_file_rate', 'seed')
+
+def load_config(config_path='config.yaml'):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as file:
+        return yaml.safe_load(file)
+
+def records_bytes(records):
+    """Returns the UTF-8 size of the prompts and completions, the input volume of the later stages."""
+    return sum(len(r['prompt'].encode('utf-8')) + len(r['completion'].encode('utf-8')) for r in records)
+
+def run_refinement(records, refinement_config):
+    """Runs the refinement loop in simulation mode with instant responses, so only the loop itself is timed."""
+    async def judge(docstring, code):
+        return simulate_judge_verdict(code)
+
+    async def batch_judge(pairs):
+        return [simulate_judge_verdict(code) for _, code in pairs]
+
+    async def generator(code):
+        return simulate_generated_docstring()
+
+    triage = DocstringTriage()
+    judgements = [triage.judgement(r['prompt'], r['completion']) for r in records]
+    judge_batch_size = refinement_config.get('judge_batch_size', 1)
+    refiner = AsyncRefiner(
+        judge,
+        generator,
+        concurrency=refinement_config.get('concurrency', 8),
+        batch_judge=batch_judge if judge_batch_size > 1 else None,
+        judge_batch_size=judge_batch_size,
+    )
+    return len(refiner.run(records, judgements))
+
+def load_benchmark_tokenizer(model_name):
+    """Loads the tokenizer, or returns None (the stage is then skipped) if it is not available offline."""
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+    except Exception as e:
+        print(f"Skipping tokenization: could not load tokenizer '{model_name}' ({type(e).__name__}).")
+        return None
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+def run_benchmarks(repo_path, config):
+    """Measures every stage on the synthetic repository and returns {stage: metrics}."""
+    bench_config = config.get('benchmark', {})
+    repeats = bench_config.get('repeats', 3)
+    num_workers = bench_config.get('num_workers', 1)
+    file_paths = list(iter_python_files(repo_path))
+    repo_bytes = sum(os.path.getsize(path) for path in file_paths)
+    results = {}
+
+    def report(stage, metrics):
+        results[stage] = metrics
+        print(f"{stage:<20} {metrics['records']:8d} records  {metrics['records_per_sec']:10.0f} rec/s  "
+              f"{metrics['mb_per_sec']:8.2f} MB/s  {metrics['peak_rss_mb']:8.1f} MB peak RSS")
+
+    report("extract_legacy", measure_stage(
+        lambda: sum(1 for path in file_paths for _ in extract_file_context_and_functions(path)), repo_bytes, repeats))
+    report("extract_single_pass", measure_stage(
+        lambda: sum(1 for path in file_paths for _ in extract_functions_from_file(path)), repo_bytes, repeats))
+
+    records = [record for path in file_paths for record in extract_functions_from_file(path)]
+    df = pd.DataFrame(records)
+    input_bytes = records_bytes(records)
+    report("validate", measure_stage(lambda: len(validate_code(df, num_workers=num_workers)), input_bytes, repeats))
+
+    valid_df = validate_code(df, num_workers=num_workers)
+    valid_records = valid_df[['prompt', 'completion']].to_dict('records')
+    valid_bytes = records_bytes(valid_records)
+    report("transform", measure_stage(lambda: len(transform_to_alpaca_format(valid_df)), valid_bytes, repeats))
+    report("refine_simulation", measure_stage(
+        lambda: run_refinement(valid_records, config.get('refinement', {})), valid_bytes, repeats))
+
+    tokenization_config = config.get('tokenization', {})
+    tokenizer = load_benchmark_tokenizer(bench_config.get('tokenizer', tokenization_config.get('model_name')))
+    if tokenizer is not None:
+        from datasets import Dataset, disable_caching, disable_progress_bars
+        from data_pipeline.tokenization import tokenize_dataset
+
+        # Every repeat must actually tokenize rather than load the previous run's cache.
+        disable_caching()
+        disable_progress_bars()
+        dataset = Dataset.from_pandas(to_alpaca_frame(valid_df))
+        report("tokenize", measure_stage(
+            lambda: len(tokenize_dataset(dataset, tokenizer, max_length=tokenization_config.get('max_length', 512),
+                                         batch_size=tokenization_config.get('batch_size', 1000), num_proc=1)),
+            valid_bytes, repeats))
+    return results
+
+def main():
+    """Runs the per-stage benchmark suite on a synthetic repository and checks it against the stored baseline."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the new baseline')
+    args = parser.parse_args()
+
+    config = load_config()
+    bench_config = config.get('benchmark', {})
+    spec = {key: bench_config[key] for key in SPEC_KEYS if key in bench_config}
+    baseline_path = bench_config.get('baseline_path', 'data/benchmarks/baseline.json')
+    threshold = bench_config.get('regression_threshold', 0.3)
+
+    with tempfile.TemporaryDirectory() as repo_path:
+        counts = generate_synthetic_repo(repo_path, **spec)
+        print(f"Synthetic repository: {counts['files']} files, {counts['functions']} functions "
+              f"({counts['documented']} documented, {counts['oversized']} oversized, {counts['broken_files']} broken files), "
+              f"{counts['bytes'] / (1024 * 1024):.1f} MB.")
+        results = run_benchmarks(repo_path, config)
+
+    if args.save_baseline:
+        save_baseline(baseline_path, results, spec)
+        print(f"Saved baseline to {baseline_path}")
+        return
+
+    baseline = load_baseline(baseline_path)
+    if not baseline:
+        print(f"No baseline at {baseline_path}; run with --save-baseline to create one.")
+        return
+    if baseline.get('spec') != spec:
+        print(f"The baseline at {baseline_path} was measured on a different synthetic repository; not comparing.")
+        return
+    regressions = find_regressions(results, baseline['stages'], threshold)
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%} against {baseline_path}.")
+        return
+    for stage, metric, before, after in regressions:
+        print(f"REGRESSION {stage}: {metric} {before:.2f} -> {after:.2f} ({(after - before) / before:+.0%})")
+    sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import os
+import sys
+import math
+import argparse
+import multiprocessing
+from collections import Counter
+import numpy as np
+import yaml
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_pipeline.columnar import iter_frames, open_writer, stage_path, DEFAULT_ROWS_PER_SHARD
+from data_pipeline.dedup import Deduplicator, MinHasher
+from data_pipeline.extraction import strip_context_header
+from data_pipeline.metrics import stage_metrics
+from data_pipeline.sharding import add_shard_arguments, apply_shard_arguments, shard_config
+from data_pipeline.triage import BAD, UNCERTAIN
+from simulate_llm_refinement import build_triage
+
+def load_config(config_path='config.yaml'):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as file:
+        return yaml.safe_load(file)
+
+def build_deduplicator(dedup_config):
+    """Builds the deduplicator from the 'dedup' config section."""
+    hasher = MinHasher(
+        threshold=dedup_config.get('threshold', 0.85),
+        num_perm=dedup_config.get('num_perm', 128),
+        shingle_size=dedup_config.get('shingle_size', 5),
+        seed=dedup_config.get('seed', 1),
+    )
+    return Deduplicator(hasher, exact=dedup_config.get('exact', True),
+                        near_duplicates=dedup_config.get('near_duplicates', True))
+
+def fingerprint(texts, hasher, pool=None, num_workers=1):
+    """
+    Fingerprints a batch of completions, split across the worker pool if there is one.
+    Only the function source counts: copies of a function in files that import
+    different things get different context headers but are still duplicates.
+    """
+    texts = [strip_context_header(text) for text in texts]
+    if pool is None or len(texts) < num_workers:
+        return hasher.fingerprint(texts)
+    step = math.ceil(len(texts) / num_workers)
+    parts = pool.map(hasher.fingerprint, [texts[i:i + step] for i in range(0, len(texts), step)])
+    return np.concatenate([hashes for hashes, _ in parts]), np.concatenate([keys for _, keys in parts])
+
+def count_llm_work(records, triage):
+    """
+    Counts the LLM calls refinement would make for `records`: records the local triage
+    finds bad go straight to the generator, undecided ones go to the judge.
+    """
+    work = Counter()
+    for record in records:
+        verdict = triage.classify(record['prompt'], record['completion']) if triage is not None else UNCERTAIN
+        if verdict == BAD:
+            work['generator'] += 1
+        elif verdict == UNCERTAIN:
+            work['judge'] += 1
+    return work
+
+def estimated_llm_calls(work, judge_batch_size):
+    """
+    Returns a lower bound of the calls avoided: judge requests at the configured batch
+    size plus generator calls (judged records that would be regenerated are not counted).
+    """
+    return math.ceil(work['judge'] / max(judge_batch_size, 1)) + work['generator']
+
+def report_dedup(deduplicator, work, refinement_config, metrics):
+    """Prints and records how many duplicates were removed and the LLM calls that saves."""
+    summary = deduplicator.summary()
+    saved = estimated_llm_calls(work, refinement_config.get('judge_batch_size', 1))
+    for name in ('exact_duplicates', 'near_duplicates', 'removed', 'kept', 'index_bytes'):
+        metrics.incr(name, summary[name])
+    metrics.incr('llm_calls_saved', saved)
+    share = summary['removed'] / summary['records'] if summary['records'] else 0.0
+    print(f"Deduplication: {summary['records']} records, removed {summary['exact_duplicates']} exact and "
+          f"{summary['near_duplicates']} near duplicates ({share:.1%}), kept {summary['kept']}. "
+          f"Estimated LLM calls saved: at least {saved}. Index size: {summary['index_bytes'] / (1024 * 1024):.1f} MB.")
+
+def deduplicate(paths, dedup_config, refinement_config, output_format, rows_per_shard, metrics):
+    """
+    Streams the extracted records of each (input, output) pair in `paths` through one
+    deduplicator in batches, writing the first occurrences. Later pairs are checked
+    against everything before them, so a record is dropped if it duplicates one in an
+    earlier shard.
+    """
+    batch_size = dedup_config.get('batch_size', 50000)
+    num_workers = dedup_config.get('num_workers', 1) or os.cpu_count()
+    deduplicator = build_deduplicator(dedup_config)
+    triage = build_triage(refinement_config)
+    hasher = deduplicator.hasher
+    print(f"Deduplicating {', '.join(input_path for input_path, _ in paths)} (threshold {hasher.threshold}, "
+          f"{hasher.bands} bands of {hasher.rows} rows, workers: {num_workers})...")
+
+    work = Counter()
+    pool = multiprocessing.Pool(processes=num_workers) if num_workers > 1 else None
+    try:
+        for input_path, output_path in paths:
+            with open_writer(output_path, output_format, rows_per_shard=rows_per_shard) as writer:
+                for df in iter_frames(input_path, batch_size):
+                    keep = deduplicator.check(*fingerprint(df['completion'].tolist(), hasher, pool, num_workers))
+                    writer.write_frame(df[keep])
+                    work.update(count_llm_work(df[~keep].to_dict('records'), triage))
+                    metrics.progress(deduplicator.stats['records'])
+            print(f"Saved deduplicated data to {stage_path(output_path, output_format)}")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    report_dedup(deduplicator, work, refinement_config, metrics)
+
+def dedup_paths(config, shard_count=None):
+    """
+    Returns the (input, output) pairs to deduplicate: the configured paths, or with
+    `shard_count` those of every shard in shard order.
+    """
+    if shard_count is None:
+        return [(config['data']['extracted_path'], config['data']['deduped_path'])]
+    shards = [shard_config(config, index, shard_count)['data'] for index in range(shard_count)]
+    return [(data['extracted_path'], data['deduped_path']) for data in shards]
+
+def main():
+    """Removes exact and near-duplicate records between extraction and refinement."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    add_shard_arguments(parser)
+    args = parser.parse_args()
+    config = load_config()
+    dedup_config = config.get('dedup') or {}
+    if not dedup_config.get('enabled', False):
+        print("Deduplication is disabled (dedup.enabled); refinement reads the extracted data directly.")
+        return
+    output_format = config['data'].get('intermediate_format', 'jsonl')
+    rows_per_shard = config['data'].get('rows_per_shard', DEFAULT_ROWS_PER_SHARD)
+
+    # --shard-count alone deduplicates all shards against each other in one pass
+    # (the index is small); with --shard-index only that shard is deduplicated.
+    if args.shard_index is None and args.shard_count is not None:
+        paths = dedup_paths(config, args.shard_count)
+    else:
+        config = apply_shard_arguments(config, args)
+        paths = dedup_paths(config)
+
+    with stage_metrics("dedup", config) as metrics:
+        deduplicate(paths, dedup_config, config.get('refinement', {}), output_format, rows_per_shard, metrics)
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,49 @@
+import io
 import os
+import sys
 import ast
 import json
 import yaml
-import pandas as pd
+import argparse
+import itertools
+import multiprocessing
+from collections import deque
+from contextlib import ExitStack
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_pipeline.extraction import extract_functions_from_bytes, context_savings
+from data_pipeline.git_source import GitBlob, iter_git_blobs, resolve_sources, with_contents
+from data_pipeline.chunking import TOKEN_COUNTERS
+from data_pipeline.manifest import ExtractionManifest, read_file_state
+from data_pipeline.columnar import stage_path, DEFAULT_ROWS_PER_SHARD
+from data_pipeline.checkpoint import StageCheckpoint, open_stage_output, run_key
+from data_pipeline.metrics import current_metrics, stage_metrics, timed
+from data_pipeline.sharding import add_shard_arguments, apply_shard_arguments, build_plan, load_plan, shard_files, write_plan
+
+# Available extractor engines: 'single_pass' parses each file once and slices function
+# source straight out of the file; 'legacy' is the original two-pass, unparse-based path.
+EXTRACTION_ENGINES = ('single_pass', 'legacy')
+
+# Where the Python files come from: 'worktree' walks data.raw_repo_path, 'git' reads
+# blobs from the object databases of extraction.git.repositories at given revisions.
+EXTRACTION_SOURCES = ('worktree', 'git')
 
 def load_config(config_path='config.yaml'):
     """Loads the YAML configuration file."""
     with open(config_path, 'r') as file:
         return yaml.safe_load(file)
 
-def extract_file_context_and_functions(file_path):
+@timed("extract_file_context_and_functions")
+def extract_file_context_and_functions(file_path, content=None):
     """
     Performs a two-pass analysis on a file, with a chunking strategy for large functions.
+    The file is read unless its text is given as `content`.
     """
-    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-        content = f.read()
+    if content is None:
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            content = f.read()
 
     # --- Pass 1: Gather Context ---
     context_header = get_file_context(content)
@@ -88,37 +117,338 @@ def stream_and_parse_definitions(lines):
     if chunk_buffer:
         yield "".join(chunk_buffer)
 
+def iter_python_files(repo_path):
+    """Yields the paths of all Python files under repo_path in a stable, sorted order."""
+    for root, dirs, files in os.walk(repo_path):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith('.py'):
+                yield os.path.join(root, file)
+
+def extraction_inputs(config, stats=None):
+    """
+    Returns (source description, files to extract) for the configured extraction source:
+    the working tree's file paths, or the distinct Python blobs (GitBlob) of every
+    configured repository and revision. `stats` collects the git blob counts.
+    The description identifies the input in the checkpoint key. Shard plans split the
+    working tree, so a sharded config (see apply_shard_arguments) needs 'worktree'.
+    """
+    extraction_config = config.get('extraction', {})
+    source = extraction_config.get('source', 'worktree')
+    if source not in EXTRACTION_SOURCES:
+        raise ValueError(f"Unknown extraction source '{source}'. Expected one of {EXTRACTION_SOURCES}.")
+    if source == 'worktree':
+        repo_path = config['data']['raw_repo_path']
+        return os.path.abspath(repo_path), iter_python_files(repo_path)
+    if (config.get('sharding') or {}).get('shard_index') is not None:
+        raise ValueError("Shard plans split data.raw_repo_path; sharded runs need extraction.source 'worktree'.")
+    if extraction_config.get('engine', 'single_pass') == 'legacy':
+        raise ValueError("The legacy engine reads files from disk; extraction.source 'git' needs engine 'single_pass'.")
+    repositories = (extraction_config.get('git') or {}).get('repositories') or []
+    if not repositories:
+        raise ValueError("extraction.source 'git' needs at least one entry in extraction.git.repositories.")
+    sources = resolve_sources(repositories)
+    return [[repo, commits] for repo, commits in sources], iter_git_blobs(sources, stats)
+
+def source_key(item):
+    """Returns the manifest key of a file path or git blob."""
+    return item.key if isinstance(item, GitBlob) else item
+
+@timed("extract_file")
+def extract_file_records(file_path, engine='single_pass', options=None):
+    """
+    Runs the extractor on a single file and returns (file_path, records, error, stats, state).
+    The records are materialized so they can be sent back from a worker process,
+    where they are timed only if the worker runs in-process (num_workers: 1).
+    `options` are passed to the single_pass extractor (see extractor_options), and
+    stats holds the file's context-header and chunking counts. A GitBlob is extracted
+    from its content and returned without it. For a file path, state is the
+    FileState of the bytes the records were extracted from, so the manifest never
+    pairs records with the hash of a different version of the file.
+    """
+    stats = {}
+    try:
+        if isinstance(file_path, GitBlob):
+            records = list(extract_functions_from_bytes(file_path.content, stats=stats, **(options or {})))
+            return file_path._replace(content=None), records, None, stats, None
+        data, state = read_file_state(file_path)
+        if engine == 'legacy':
+            # Decoded as the legacy path's text-mode read would.
+            content = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', errors='ignore').read()
+            records = list(extract_file_context_and_functions(file_path, content))
+        else:
+            records = list(extract_functions_from_bytes(data, stats=stats, **(options or {})))
+        return file_path, records, None, stats, state
+    except Exception as e:
+        if isinstance(file_path, GitBlob):
+            file_path = file_path._replace(content=None)
+        return file_path, [], str(e), {}, None
+
+def _extract_file_batch(file_paths, engine, options=None):
+    """Worker entry point: extracts a batch of files in one inter-process round-trip."""
+    return [extract_file_records(file_path, engine, options) for file_path in file_paths]
+
+def _batched(iterable, size):
+    """Groups an iterable into lists of at most `size` items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iter_extracted_files(file_paths, num_workers=1, chunk_size=16, engine='single_pass', options=None):
+    """
+    Yields (file_path, records, error, stats, state) for every file, in the order of file_paths.
+
+    With num_workers > 1 the files are fanned out to a process pool in batches of
+    chunk_size. At most 2 * num_workers batches are in flight at any time, so the
+    memory held by pending results stays bounded regardless of the repository size.
+    Git blobs are read from the object database as they are sent out.
+    """
+    file_paths = with_contents(file_paths)
+    if num_workers <= 1:
+        for file_path in file_paths:
+            yield extract_file_records(file_path, engine, options)
+        return
+
+    max_in_flight = 2 * num_workers
+    with multiprocessing.Pool(processes=num_workers) as pool:
+        pending = deque()
+        for batch in _batched(file_paths, chunk_size):
+            pending.append(pool.apply_async(_extract_file_batch, (batch, engine, options)))
+            if len(pending) >= max_in_flight:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+def extractor_options(config):
+    """Builds the single_pass extractor settings from the 'extraction' section of the config."""
+    extraction_config = config.get('extraction', {})
+    chunking_config = extraction_config.get('chunking') or {}
+    token_counter = chunking_config.get('token_counter', 'estimate')
+    if token_counter not in TOKEN_COUNTERS:
+        raise ValueError(f"Unknown token counter '{token_counter}'. Expected one of {TOKEN_COUNTERS}.")
+    tokenizer_name = None
+    if token_counter == 'tokenizer':
+        tokenizer_name = chunking_config.get('tokenizer_name') or config.get('tokenization', {}).get('model_name')
+    return {
+        'prune_context': extraction_config.get('prune_context', False),
+        'token_budget': chunking_config.get('token_budget'),
+        'token_counter': token_counter,
+        'tokenizer_name': tokenizer_name,
+    }
+
+def extractor_key(engine, options):
+    """Returns the manifest key for the extractor settings, so changing them invalidates carried-forward records."""
+    return engine if engine == 'legacy' else f"{engine}:{json.dumps(options, sort_keys=True)}"
+
+def report_extraction_stats(metrics, options):
+    """Prints and records the context-header bytes and tokens pruning saved and how functions were chunked in this run."""
+    savings = context_savings(metrics.counters)
+    if options['prune_context'] and savings['records']:
+        metrics.incr("context_tokens_saved", savings['tokens_saved'])
+        share = savings['bytes_saved'] / savings['bytes_full'] if savings['bytes_full'] else 0.0
+        print(f"Context pruning: {savings['bytes_full']} -> {savings['bytes_kept']} header bytes over {savings['records']} records, "
+              f"saved {savings['bytes_saved']} bytes ({share:.0%}, ~{savings['tokens_saved']} tokens).")
+    if options['token_budget'] is not None and metrics.counters.get('chunked_functions'):
+        print(f"Token-budget chunking: {metrics.counters['chunked_functions']:.0f} functions over {options['token_budget']} tokens "
+              f"split into {metrics.counters['chunks']:.0f} chunks ({metrics.counters.get('chunks_over_budget', 0):.0f} still over budget).")
+
+def count_file(file_path, records, error, stats):
+    """Counts one extracted file in the active stage's metrics and reports progress."""
+    metrics = current_metrics()
+    if metrics is None:
+        return
+    metrics.incr("files")
+    if error is not None:
+        metrics.incr("file_errors")
+    metrics.incr("records", len(records))
+    for name, value in stats.items():
+        metrics.incr(name, value)
+    metrics.progress(int(metrics.counters["files"]), unit="files")
+
+def write_full_extraction(out, file_paths, num_workers, chunk_size, engine, options=None, start=0, on_file_done=None):
+    """
+    Extracts every file and streams its records to the writer `out`. Returns the number of records written.
+    The first `start` files are skipped (their output is already checkpointed), and
+    `on_file_done(item=...)` is called with each remaining file's source key once its
+    records are written.
+    """
+    record_count = 0
+    file_paths = itertools.islice(file_paths, start, None)
+    for file_path, records, error, stats, _ in iter_extracted_files(file_paths, num_workers, chunk_size, engine, options):
+        count_file(file_path, records, error, stats)
+        if error is not None:
+            print(f"Error processing {file_path}: {error}")
+        else:
+            out.write_records(records)
+            record_count += len(records)
+        if on_file_done is not None:
+            on_file_done(item=source_key(file_path))
+    return record_count
+
+def write_incremental_extraction(out, file_paths, manifest, num_workers, chunk_size, engine, options=None, start=0, on_file_done=None):
+    """
+    Re-extracts only new and changed files and carries the records of unchanged files
+    forward from the manifest. Output order is the same as a full extraction.
+    Returns the number of records written. `start` and `on_file_done` work as in
+    write_full_extraction; skipped files still count as present in the repository.
+    """
+    file_paths = list(file_paths)
+    # Classification only stats (and, for modified files, hashes) each file, and looks
+    # git blobs up by object id, so the plan is small even for very large repositories.
+    pending = file_paths[start:]
+    plan = [manifest.classify_blob(item.key, item.size) if isinstance(item, GitBlob) else manifest.classify(item)
+            for item in pending]
+    changed_paths = (item for item, (unchanged, _) in zip(pending, plan) if not unchanged)
+    # Changed files are extracted in plan order, so each result lines up with the next changed entry.
+    results = iter_extracted_files(changed_paths, num_workers, chunk_size, engine, options)
+
+    record_count = 0
+    for unchanged, state in plan:
+        if unchanged:
+            count, records_text = manifest.get_records(state.path)
+            out.write_jsonl(records_text)
+            record_count += count
+        else:
+            file_path, records, error, stats, extracted_state = next(results)
+            count_file(file_path, records, error, stats)
+            if error is not None:
+                print(f"Error processing {file_path}: {error}")
+                manifest.remove(state.path)
+            else:
+                # The file may have changed since it was classified; store the identity
+                # of the bytes that were actually extracted.
+                manifest.put(extracted_state or state, records)
+                out.write_records(records)
+                record_count += len(records)
+        if on_file_done is not None:
+            on_file_done(item=state.path)
+
+    manifest.prune(set(source_key(item) for item in file_paths))
+    stats = manifest.stats
+    print(f"Incremental extraction: {stats['new']} new, {stats['changed']} changed, {stats['deleted']} deleted, "
+          f"{stats['unchanged'] + stats['touched']} unchanged files carried forward.")
+    return record_count
+
+def check_resumed_listing(checkpoint, file_paths):
+    """
+    Checks that the files a checkpoint covers are still the first files of the listing.
+    Resuming skips files by position, so a file added or removed before the checkpoint's
+    position would otherwise be skipped or written twice. On a mismatch the checkpoint
+    is discarded and the extraction starts over. Returns (file_paths, start).
+    """
+    file_paths = iter(file_paths)
+    covered = list(itertools.islice(file_paths, checkpoint.position))
+    file_paths = itertools.chain(covered, file_paths)
+    if checkpoint.matches_items(source_key(item) for item in covered):
+        return file_paths, checkpoint.position
+    print(f"[WARN] The file listing changed since the checkpoint was written ({checkpoint.position} files extracted); "
+          f"discarding the checkpoint and extracting from the start.")
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.incr("checkpoint_discarded")
+    checkpoint.restart()
+    return file_paths, 0
+
+def shard_plan(config, num_shards):
+    """
+    Returns the shard plan written by scripts/plan_shards.py, or makes one if there is
+    none for this repository, shard count and file listing (every shard makes the same
+    plan). A plan whose files no longer match the repository is rebuilt, so files
+    added since are not left out of every shard.
+    """
+    repo_path = config['data']['raw_repo_path']
+    plan_path = (config.get('sharding') or {}).get('plan_path', 'data/shards/plan.json')
+    file_paths = list(iter_python_files(repo_path))
+    plan = load_plan(plan_path, repo_path, num_shards, file_paths)
+    if plan is None:
+        if load_plan(plan_path, repo_path, num_shards) is not None:
+            print(f"[WARN] The files of {repo_path} changed since the shard plan {plan_path} was made; rebuilding it. "
+                  f"Re-run every shard of this stage so they all use the new plan.")
+        plan = write_plan(plan_path, build_plan(repo_path, file_paths, num_shards))
+    return plan
+
 def main():
     """Main function to extract data from the raw code repository."""
-    config = load_config()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    add_shard_arguments(parser)
+    args = parser.parse_args()
+    config = apply_shard_arguments(load_config(), args)
     repo_path = config['data']['raw_repo_path']
     output_path = config['data']['extracted_path']
+    extraction_config = config.get('extraction', {})
+    num_workers = extraction_config.get('num_workers', 1) or os.cpu_count()
+    chunk_size = extraction_config.get('chunk_size', 16)
+    engine = extraction_config.get('engine', 'single_pass')
+    if engine not in EXTRACTION_ENGINES:
+        raise ValueError(f"Unknown extraction engine '{engine}'. Expected one of {EXTRACTION_ENGINES}.")
+    incremental = extraction_config.get('incremental', False)
+    options = extractor_options(config)
+    output_format = config['data'].get('intermediate_format', 'jsonl')
+    rows_per_shard = config['data'].get('rows_per_shard', DEFAULT_ROWS_PER_SHARD)
+    git_stats = {}
+    source, file_paths = extraction_inputs(config, git_stats)
+    from_git = extraction_config.get('source', 'worktree') == 'git'
+    if from_git:
+        repo_path = ", ".join(f"{repo} ({len(commits)} revisions)" for repo, commits in source)
 
-    print(f"Starting context-aware extraction from: {repo_path}")
-    
-    all_functions = []
-    for root, _, files in os.walk(repo_path):
-        for file in files:
-            if file.endswith('.py'):
-                file_path = os.path.join(root, file)
-                print(f"Processing {file_path} for context and functions...")
-                try:
-                    # The new context-aware generator is called here
-                    extracted_generator = extract_file_context_and_functions(file_path)
-                    all_functions.extend(list(extracted_generator))
-                except Exception as e:
-                    print(f"Error processing {file_path}: {e}")
-    
-    print(f"Extracted {len(all_functions)} functions with docstrings and context.")
-    
-    # Ensure the output directory exists
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    
-    # Use pandas to save to JSONL for better handling of newlines
-    df = pd.DataFrame(all_functions)
-    df.to_json(output_path, orient='records', lines=True)
-            
-    print(f"Saved extracted data to {output_path}")
+    shard = None
+    if args.shard_index is not None:
+        shard = (args.shard_index, args.shard_count)
+        file_paths = shard_files(shard_plan(config, args.shard_count), *shard)
+        print(f"Extracting shard {args.shard_index} of {args.shard_count}: {len(file_paths)} files.")
+
+    print(f"Starting context-aware extraction from: {repo_path} (engine: {engine}, workers: {num_workers}, chunk size: {chunk_size}, incremental: {incremental}, prune context: {options['prune_context']}, token budget: {options['token_budget']})")
+
+    # Records are streamed to the output (JSONL, or columnar shards) as each file
+    # finishes, so nothing beyond the in-flight batches and one shard is held in memory.
+    # With checkpointing they are committed in durable shards, and a re-run resumes
+    # after the last committed file.
+    key = run_key(stage="extract", repo=source, extractor=extractor_key(engine, options), incremental=incremental,
+                  shard=shard)
+    with stage_metrics("extract", config) as metrics:
+        # The manifest is opened first so it is still open when the checkpoint commits on exit.
+        with ExitStack() as stack:
+            manifest = None
+            if incremental:
+                manifest_path = extraction_config.get('manifest_path', output_path + '.manifest.sqlite')
+                manifest = stack.enter_context(ExtractionManifest(manifest_path, extractor_key=extractor_key(engine, options)))
+            out = stack.enter_context(open_stage_output(output_path, output_format, rows_per_shard, key, config.get('checkpoint')))
+            checkpoint = out if isinstance(out, StageCheckpoint) else None
+            start = checkpoint.position if checkpoint is not None else 0
+            on_file_done = checkpoint.advance if checkpoint is not None else None
+            if start:
+                file_paths, start = check_resumed_listing(checkpoint, file_paths)
+            if start:
+                print(f"Resuming from checkpoint: {start} files ({checkpoint.rows_written} records) already extracted.")
+                metrics.incr("resumed_files", start)
+            if manifest is not None:
+                if checkpoint is not None:
+                    # Carried-forward records must be as durable as the output that relies on them.
+                    checkpoint.on_commit = manifest.commit
+                record_count = write_incremental_extraction(out, file_paths, manifest, num_workers, chunk_size,
+                                                            engine, options, start, on_file_done)
+                for name, value in manifest.stats.items():
+                    metrics.incr(f"manifest.{name}", value)
+            else:
+                record_count = write_full_extraction(out, file_paths, num_workers, chunk_size, engine, options,
+                                                     start, on_file_done)
+            if checkpoint is not None:
+                record_count = checkpoint.rows_written
+        metrics.incr("records_written", record_count)
+        report_extraction_stats(metrics, options)
+        if from_git:
+            for name, value in git_stats.items():
+                metrics.incr(name, value)
+            print(f"Git source: {git_stats['blobs']} Python blobs listed, {git_stats['duplicate_blobs']} skipped as "
+                  f"duplicates of a blob already extracted (same object id).")
+
+        print(f"Extracted {record_count} functions with docstrings and context.")
+        print(f"Saved extracted data to {stage_path(output_path, output_format)}")
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
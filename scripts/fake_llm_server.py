@@ -0,0 +1,41 @@
+import os
+import sys
+import argparse
+import yaml
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_pipeline.fake_llm_server import FakeLLM, FakeLLMServer
+
+def load_config(config_path='config.yaml'):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as file:
+        return yaml.safe_load(file)
+
+def build_server(server_config, port=None):
+    """Builds the fake server from the 'fake_llm_server' config section."""
+    server_config = server_config or {}
+    return FakeLLMServer(
+        FakeLLM.from_config(server_config),
+        host=server_config.get('host', '127.0.0.1'),
+        port=server_config.get('port', 8089) if port is None else port,
+    )
+
+def main():
+    """Serves a local OpenAI-compatible chat-completions API with fake latencies, errors and answers."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--port', type=int, default=None, help="Port to listen on (default: fake_llm_server.port).")
+    args = parser.parse_args()
+
+    server = build_server(load_config().get('fake_llm_server'), args.port)
+    print(f"Fake LLM server listening on {server.url} (set refinement.api_base_url to it). Counters: {server.url[:-3]}/stats", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
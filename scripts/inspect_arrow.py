@@ -1,38 +1,97 @@
-from datasets import load_from_disk
+import os
+import sys
+import json
+import argparse
 import yaml
 
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_pipeline.dataset_stats import dataset_shards, dataset_statistics, iter_shard_batches
+
+HISTOGRAM_WIDTH = 40
+
 def load_config(config_path='config.yaml'):
     """Loads the YAML configuration file."""
     with open(config_path, 'r') as file:
         return yaml.safe_load(file)
 
-def main():
-    """Loads and inspects the final Arrow dataset."""
-    config = load_config()
-    tokenized_path = config['data']['tokenized_path']
-
-    print(f"Loading tokenized dataset from: {tokenized_path}")
-    
-    # Load the dataset from disk
-    tokenized_dataset = load_from_disk(tokenized_path)
+def print_first_record(path):
+    """Prints the schema and the first record, the only row this script ever loads."""
+    fmt, shards = dataset_shards(path)
+    first_batch = next((batch for shard in shards for batch in iter_shard_batches(shard, fmt) if batch.num_rows), None)
+    if first_batch is None:
+        print("\nThe dataset is empty.")
+        return
+    print("\n--- Schema ---")
+    print(first_batch.schema.remove_metadata())
 
-    print("\\n--- Dataset Info ---")
-    print(tokenized_dataset)
-
-    print("\\n\\n--- Inspecting the First Record ---")
-    first_record = tokenized_dataset[0]
+    print("\n--- Inspecting the First Record ---")
+    first_record = first_batch.slice(0, 1).to_pylist()[0]
     print(first_record)
-    
-    print("\\n\\n--- Breakdown of the First Record ---")
-    print(f"Instruction: {first_record['instruction']}")
+
+    print("\n--- Breakdown of the First Record ---")
+    if 'instruction' in first_record:
+        print(f"Instruction: {first_record['instruction']}")
     # The 'input_ids' are the actual numbers the model will see.
     print(f"Number of Input IDs (Tokens): {len(first_record['input_ids'])}")
     print(f"Sample Input IDs: {first_record['input_ids'][:20]}...")
 
     # The 'attention_mask' tells the model which tokens to pay attention to.
-    print(f"Number of Attention Mask Tokens: {len(first_record['attention_mask'])}")
-    print(f"Sample Attention Mask: {first_record['attention_mask'][:20]}...")
+    if 'attention_mask' in first_record:
+        print(f"Number of Attention Mask Tokens: {len(first_record['attention_mask'])}")
+        print(f"Sample Attention Mask: {first_record['attention_mask'][:20]}...")
+
+def print_report(report):
+    """Prints the statistics as a readable summary."""
+    print(f"\n--- {report['path']}: {report['rows']} rows in {len(report['shards'])} shards ---")
+    for shard in report['shards']:
+        print(f"  {shard['file']}: {shard['rows']} rows, {shard['tokens']} tokens, {shard['bytes'] / (1024 * 1024):.1f} MB")
+
+    lengths = report['lengths']
+    print(f"\n--- Token Lengths ({lengths['count']} {lengths['unit']}) ---")
+    if lengths['count']:
+        print(f"mean {lengths['mean']:.1f}, min {lengths['min']}, p50 {lengths['p50']}, "
+              f"p90 {lengths['p90']}, p99 {lengths['p99']}, max {lengths['max']}")
+        width = lengths['histogram']['bin_width']
+        counts = lengths['histogram']['counts']
+        peak = max(counts)
+        for i, count in enumerate(counts):
+            bar = '#' * round(HISTOGRAM_WIDTH * count / peak)
+            print(f"  {i * width:>6}-{(i + 1) * width - 1:<6} {count:>10}  {bar}")
+
+    print("\n--- Quality ---")
+    if report['padding_ratio'] is not None:
+        print(f"Padding ratio (attention_mask == 0): {report['padding_ratio']:.1%}")
+    if 'truncation' in report:
+        truncation = report['truncation']
+        print(f"Truncated at max_length {truncation['max_length']}: {truncation['truncated']} {lengths['unit']} ({truncation['rate']:.2%})")
+    if 'duplicates' in report:
+        print(f"Duplicate input_ids: {report['duplicates']['duplicate_rows']} rows ({report['duplicates']['rate']:.2%})")
+
+def main():
+    """Reports statistics of a tokenized Arrow dataset computed from its memory-mapped columns."""
+    config = load_config()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('path', nargs='?', default=config['data']['tokenized_path'],
+                        help="Saved `datasets` directory or columnar dataset (default: data.tokenized_path).")
+    parser.add_argument('--max-length', type=int, default=config.get('tokenization', {}).get('max_length', 512),
+                        help="Length at which examples count as truncated (default: tokenization.max_length).")
+    parser.add_argument('--bin-width', type=int, help="Token-length histogram bin width (default: max_length / 16).")
+    parser.add_argument('--no-duplicates', action='store_true', help="Skip hashing input_ids for the duplicate rate.")
+    parser.add_argument('--json', action='store_true', help="Print the statistics as one JSON object.")
+    parser.add_argument('--first-record', action='store_true', help="Also load and print the first record.")
+    args = parser.parse_args()
+
+    report = dataset_statistics(args.path, max_length=args.max_length, bin_width=args.bin_width,
+                                duplicates=not args.no_duplicates)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_report(report)
+    if args.first_record:
+        print_first_record(args.path)
 
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
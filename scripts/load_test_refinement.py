@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import multiprocessing
+import urllib.request
+import yaml
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_pipeline.columnar import read_frame
+from data_pipeline.metrics import StageMetrics, stage_metrics
+import simulate_llm_refinement as refinement
+from fake_llm_server import build_server
+
+# LLM call kinds whose latency histograms are reported.
+CALL_KINDS = ('judge', 'batch_judge', 'generator')
+
+def load_config(config_path='config.yaml'):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as file:
+        return yaml.safe_load(file)
+
+def serve(server_config, ready):
+    """Runs the fake server in a child process, so it does not share the client's interpreter lock."""
+    server = build_server(server_config, port=0)
+    ready.put(server.url)
+    server.serve_forever()
+
+def server_stats(base_url):
+    """Reads the fake server's counters."""
+    with urllib.request.urlopen(base_url.rstrip('/').rsplit('/v1', 1)[0] + '/stats') as response:
+        return json.loads(response.read())
+
+async def refine_all(refiner, records, judgements, refinement_config):
+    """Refines every record through the real client path with one connection pool open for the run."""
+    async with refinement.llm_client_session(refinement_config):
+        return [record async for record in refiner.iter_refined(records, judgements)]
+
+def run_level(records, judgements, refinement_config, concurrency, base_url):
+    """Refines the records at one concurrency level and returns the measurements and the refined records."""
+    # No cache and no pacing: every level makes the same calls and is limited only by concurrency.
+    level_config = {**refinement_config, 'concurrency': concurrency, 'api_base_url': base_url,
+                    'cache_path': None, 'requests_per_minute': None, 'tokens_per_minute': None}
+    refiner = refinement.build_refiner(level_config)
+    before = server_stats(base_url)
+    with StageMetrics(f"load_test.concurrency_{concurrency}", reset_rss=False, quiet=True) as metrics:
+        start = time.perf_counter()
+        refined = asyncio.run(refine_all(refiner, records, judgements, level_config))
+        elapsed = time.perf_counter() - start
+    after = server_stats(base_url)
+    served = {name: after.get(name, 0) - before.get(name, 0) for name in after}
+
+    result = {
+        'concurrency': concurrency,
+        'records': len(records),
+        'seconds': elapsed,
+        'records_per_second': len(records) / elapsed if elapsed else 0.0,
+        'requests_per_second': served['requests'] / elapsed if elapsed else 0.0,
+        'retries': refiner.stats['retries'],
+        'transient_errors': sum(value for name, value in metrics.counters.items() if name.endswith('.transient_errors')),
+        'connections_opened': served['connections'],
+        'requests': served['requests'],
+        'rate_limited': served['rate_limited'],
+        'server_errors': served['server_errors'],
+    }
+    for kind in CALL_KINDS:
+        histogram = metrics.histograms.get(f"llm.{kind}")
+        if histogram is not None:
+            result[f'{kind}_p50_seconds'] = histogram.percentile(0.5)
+            result[f'{kind}_p99_seconds'] = histogram.percentile(0.99)
+    return result, refined
+
+def print_report(results):
+    """Prints one line per concurrency level."""
+    print(f"{'concurrency':>11} {'records/s':>10} {'requests/s':>10} {'judge p50/p99 (s)':>18} "
+          f"{'generator p50/p99 (s)':>22} {'retries':>8} {'connections':>11}")
+    for result in results:
+        judge_kind = 'judge' if 'judge_p50_seconds' in result else 'batch_judge'
+        judge = f"{result.get(f'{judge_kind}_p50_seconds', 0):.2f}/{result.get(f'{judge_kind}_p99_seconds', 0):.2f}"
+        generator = f"{result.get('generator_p50_seconds', 0):.2f}/{result.get('generator_p99_seconds', 0):.2f}"
+        print(f"{result['concurrency']:>11} {result['records_per_second']:>10.1f} {result['requests_per_second']:>10.1f} "
+              f"{judge:>18} {generator:>22} {result['retries']:>8} {result['connections_opened']:>11}")
+
+def main():
+    """Load-tests the real refinement client path against the local fake OpenAI-compatible server."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--concurrency', default=None,
+                        help="Comma-separated concurrency levels (default: load_test.concurrency_levels).")
+    parser.add_argument('--records', type=int, default=None, help="Records refined per level (default: load_test.records).")
+    parser.add_argument('--base-url', default=None,
+                        help="Use an already running fake server (scripts/fake_llm_server.py) instead of starting one.")
+    args = parser.parse_args()
+
+    config = load_config()
+    load_test_config = config.get('load_test') or {}
+    refinement_config = config.get('refinement', {})
+    levels = [int(level) for level in args.concurrency.split(',')] if args.concurrency else \
+        load_test_config.get('concurrency_levels', [1, 4, 16, 64])
+    num_records = args.records or load_test_config.get('records', 500)
+    report_path = load_test_config.get('report_path', 'data/benchmarks/load_test.json')
+
+    input_path = refinement.refinement_input_path(config)
+    records = read_frame(input_path, columns=['prompt', 'completion']).head(num_records).to_dict('records')
+    judgements = refinement.triage_records(records, refinement.build_triage(refinement_config))
+    # The fake server does not check the key, but the client needs one.
+    refinement.enable_real_llm(api_key=os.getenv("OPENAI_API_KEY") or "fake-key")
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        ready = multiprocessing.Queue()
+        server = multiprocessing.Process(target=serve, args=(config.get('fake_llm_server'), ready), daemon=True)
+        server.start()
+        base_url = ready.get(timeout=30)
+    print(f"Load-testing refinement of {len(records)} records from {input_path} against {base_url} "
+          f"at concurrency {', '.join(map(str, levels))}...")
+
+    results = []
+    try:
+        with stage_metrics("load_test", config) as metrics:
+            baseline = None
+            for concurrency in levels:
+                result, refined = run_level(records, judgements, refinement_config, concurrency, base_url)
+                # Answers are deterministic, so every level must refine the records identically.
+                baseline = refined if baseline is None else baseline
+                result['matches_first_level'] = refined == baseline
+                results.append(result)
+                for name in ('records_per_second', 'retries', 'connections_opened'):
+                    metrics.incr(f"concurrency_{concurrency}.{name}", result[name])
+                print(f"Concurrency {concurrency}: {result['records_per_second']:.1f} records/s, "
+                      f"{result['retries']} retries, {result['connections_opened']} connections opened.", flush=True)
+            print_report(results)
+            os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump({'base_url': base_url, 'records': len(records), 'levels': results}, f, indent=2)
+            print(f"Saved the load-test report to {report_path}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import shutil
+import argparse
+import yaml
+from datasets import concatenate_datasets, load_from_disk
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_pipeline.columnar import iter_frames, open_writer, resolve_input, stage_path, DEFAULT_ROWS_PER_SHARD
+from data_pipeline.metrics import stage_metrics
+from data_pipeline.sharding import shard_config
+
+def load_config(config_path='config.yaml'):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as file:
+        return yaml.safe_load(file)
+
+def check_shard_outputs(paths, what):
+    """Fails before anything is written if a shard's output is missing (its task has not finished)."""
+    missing = [path for path in paths if not os.path.exists(resolve_input(path))]
+    if missing:
+        raise FileNotFoundError(f"Missing {what} of {len(missing)} shard(s): {', '.join(missing)}")
+
+def merge_records(shard_paths, output_path, output_format, rows_per_shard, batch_size=50000):
+    """Concatenates the shards' processed records in shard order and returns the record count."""
+    count = 0
+    with open_writer(output_path, output_format, rows_per_shard=rows_per_shard) as writer:
+        for path in shard_paths:
+            for df in iter_frames(path, batch_size):
+                writer.write_frame(df)
+                count += len(df)
+    return count
+
+def merge_text_files(shard_paths, output_path):
+    """Concatenates JSONL files (e.g. the rejected records) in shard order, skipping shards without one."""
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'wb') as out:
+        for path in shard_paths:
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+
+def merge_tokenized(shard_paths, output_path):
+    """Concatenates the shards' tokenized datasets in shard order and returns the example count."""
+    dataset = concatenate_datasets([load_from_disk(path) for path in shard_paths])
+    # Written beside the old dataset and swapped in, so a failed merge leaves it intact.
+    staging = output_path.rstrip('/') + '.merging'
+    if os.path.isdir(staging):
+        shutil.rmtree(staging)
+    dataset.save_to_disk(staging)
+    if os.path.isdir(output_path):
+        shutil.rmtree(output_path)
+    os.replace(staging, output_path)
+    return len(dataset)
+
+def main():
+    """Merges the per-shard outputs of a sharded run into the final dataset, in shard order."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--shard-count', type=int, required=True, help="Number of shards in the plan.")
+    args = parser.parse_args()
+
+    config = load_config()
+    shards = [shard_config(config, index, args.shard_count) for index in range(args.shard_count)]
+    output_format = config['data'].get('intermediate_format', 'jsonl')
+    rows_per_shard = config['data'].get('rows_per_shard', DEFAULT_ROWS_PER_SHARD)
+    processed_paths = [shard['data']['final_alpaca_path'] for shard in shards]
+    tokenized_paths = [shard['data']['tokenized_path'] for shard in shards]
+    check_shard_outputs(processed_paths, "processed data")
+    check_shard_outputs(tokenized_paths, "tokenized data")
+
+    with stage_metrics("merge", config) as metrics:
+        final_alpaca_path = config['data']['final_alpaca_path']
+        records = merge_records(processed_paths, final_alpaca_path, output_format, rows_per_shard)
+        metrics.incr("records", records)
+        print(f"Merged {records} processed records from {args.shard_count} shards into {stage_path(final_alpaca_path, output_format)}")
+
+        for key in ('rejected_path', 'overflow_path'):
+            path = (config.get('processing') or {}).get(key)
+            if path:
+                merge_text_files([shard['processing'][key] for shard in shards], path)
+
+        tokenized_path = config['data']['tokenized_path']
+        examples = merge_tokenized(tokenized_paths, tokenized_path)
+        metrics.incr("tokenized_examples", examples)
+        print(f"Merged {examples} tokenized examples into {tokenized_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import os
+import sys
+import yaml
+from datasets import load_from_disk
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_pipeline.columnar import ShardedWriter
+from data_pipeline.metrics import stage_metrics
+from data_pipeline.ordering import (
+    ORDERING_MODES,
+    BatchPaddingMeter,
+    external_shuffle,
+    length_bucketed,
+    row_lengths,
+    spill_buckets,
+)
+
+def load_config(config_path='config.yaml'):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as file:
+        return yaml.safe_load(file)
+
+def main():
+    """Shuffles the tokenized dataset (optionally in length-bucketed batches) into indexed Arrow shards."""
+    config = load_config()
+    ordering_config = config.get('ordering') or {}
+    mode = ordering_config.get('mode', 'shuffle')
+    if mode not in ORDERING_MODES:
+        raise ValueError(f"Unknown ordering mode '{mode}'. Expected one of {ORDERING_MODES}.")
+    tokenized_path = config['data']['tokenized_path']
+    ordered_path = config['data']['ordered_path']
+    seed = ordering_config.get('seed', 0)
+    batch_size = ordering_config.get('batch_size', 16)
+    pool_batches = ordering_config.get('pool_batches', 64)
+    read_batch_rows = ordering_config.get('read_batch_rows', 10000)
+    length_column = ordering_config.get('length_column', 'length')
+    memory_bytes = ordering_config.get('memory_mb', 2048) * 1024 * 1024
+    spill_dir = ordering_config.get('spill_dir') or ordered_path.rstrip('/') + '.spill'
+    rows_per_shard = ordering_config.get('rows_per_shard', 10000)
+    if mode == 'length_bucketed':
+        # Whole batches per shard, so a loader never has to stitch a batch from two files.
+        rows_per_shard = -(-rows_per_shard // batch_size) * batch_size
+
+    with stage_metrics("order", config) as metrics:
+        print(f"Loading tokenized data from {tokenized_path}...")
+        dataset = load_from_disk(tokenized_path)
+        num_buckets = spill_buckets(dataset.data.nbytes, memory_bytes) if mode != 'none' else 1
+        print(f"Ordering {len(dataset)} examples ({dataset.data.nbytes / (1024 * 1024):.1f} MB, mode: {mode}, "
+              f"seed: {seed}, spill buckets: {num_buckets})...")
+
+        padding_before = BatchPaddingMeter(batch_size)
+        padding_after = BatchPaddingMeter(batch_size)
+
+        def input_tables():
+            for table in dataset.with_format('arrow').iter(batch_size=read_batch_rows):
+                padding_before.add(row_lengths(table, length_column))
+                yield table
+
+        shuffle_stats = {}
+        stream = input_tables()
+        if mode != 'none':
+            stream = external_shuffle(stream, seed, num_buckets, spill_dir, shuffle_stats)
+        if mode == 'length_bucketed':
+            stream = length_bucketed(stream, batch_size, pool_batches, seed, length_column)
+
+        has_lengths = length_column in dataset.column_names
+        writer = ShardedWriter(ordered_path, 'arrow', rows_per_shard, length_column=length_column if has_lengths else None)
+        writer.metadata = {"ordering": {"mode": mode, "seed": seed, "batch_size": batch_size,
+                                        "pool_batches": pool_batches, "source": tokenized_path}}
+        with writer:
+            for table in stream:
+                padding_after.add(row_lengths(table, length_column))
+                writer.write_table(table)
+                metrics.progress(writer.num_rows, len(dataset))
+
+        for name, value in shuffle_stats.items():
+            metrics.incr(name, value)
+        metrics.incr("records", writer.num_rows)
+        metrics.incr("shards", len(writer.shards))
+        metrics.incr("padding_ratio_before", padding_before.ratio)
+        metrics.incr("padding_ratio_after", padding_after.ratio)
+        print(f"Padding when batching {batch_size} examples in order and padding to the longest: "
+              f"{padding_before.ratio:.1%} before, {padding_after.ratio:.1%} after.")
+        print(f"Saved {writer.num_rows} examples in {len(writer.shards)} indexed Arrow shards to {ordered_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import os
+import sys
+import argparse
+import yaml
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_pipeline.metrics import stage_metrics
+from data_pipeline.sharding import build_plan, write_plan
+from extract_from_repo import iter_python_files
+
+def load_config(config_path='config.yaml'):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as file:
+        return yaml.safe_load(file)
+
+def main():
+    """Partitions the raw repository into byte-balanced shards for the sharded stages."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--shard-count', type=int, default=None,
+                        help="Number of shards (default: sharding.num_shards in config.yaml).")
+    args = parser.parse_args()
+
+    config = load_config()
+    sharding_config = config.get('sharding') or {}
+    repo_path = config['data']['raw_repo_path']
+    plan_path = sharding_config.get('plan_path', 'data/shards/plan.json')
+    num_shards = args.shard_count or sharding_config.get('num_shards', 1)
+
+    with stage_metrics("plan", config) as metrics:
+        plan = write_plan(plan_path, build_plan(repo_path, iter_python_files(repo_path), num_shards))
+        for shard in plan['shards']:
+            print(f"Shard {shard['index']}: {len(shard['files'])} files, {shard['bytes'] / (1024 * 1024):.2f} MB")
+        metrics.incr("shards", plan['num_shards'])
+        metrics.incr("files", sum(len(shard['files']) for shard in plan['shards']))
+        metrics.incr("bytes", plan['total_bytes'])
+        print(f"Saved a plan of {plan['num_shards']} shards to {plan_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import multiprocessing
+import yaml
+
+# Add the src directory (and this directory, for the stage scripts) to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.append(os.path.dirname(__file__))
+
+from data_pipeline.runner import start_stage, rebatch, TeeWriter
+from data_pipeline.metrics import stage_metrics, current_metrics
+
+# Heavy libraries (pandas, openai, datasets, transformers) are imported inside the
+# stage that needs them, so each stage only pays for what it uses.
+
+def load_config(config_path='config.yaml'):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as file:
+        return yaml.safe_load(file)
+
+def open_intermediate_writer(config, stage, path_key):
+    """Opens a writer for a stage's output file if the stage is listed in fused_runner.write_intermediates."""
+    stages = (config.get('fused_runner') or {}).get('write_intermediates') or []
+    if stage not in stages:
+        return None
+    from data_pipeline.columnar import open_writer, DEFAULT_ROWS_PER_SHARD
+
+    data_config = config['data']
+    return open_writer(
+        data_config[path_key],
+        data_config.get('intermediate_format', 'jsonl'),
+        rows_per_shard=data_config.get('rows_per_shard', DEFAULT_ROWS_PER_SHARD),
+    )
+
+def instrumented(config, stage, run, *args):
+    """
+    Runs a stage under its own metrics collector ('fused_<stage>'). The stages share
+    the process, so only the run as a whole resets the peak RSS reading.
+    """
+    with stage_metrics(f"fused_{stage}", config, reset_rss=False):
+        run(config, *args)
+
+def extract_stage(config, out):
+    """Extracts records from the repository and streams them, file by file, to the next stage."""
+    import extract_from_repo as extraction
+    from data_pipeline.manifest import ExtractionManifest
+
+    extraction_config = config.get('extraction', {})
+    num_workers = extraction_config.get('num_workers', 1) or os.cpu_count()
+    chunk_size = extraction_config.get('chunk_size', 16)
+    engine = extraction_config.get('engine', 'single_pass')
+    options = extraction.extractor_options(config)
+    if engine not in extraction.EXTRACTION_ENGINES:
+        raise ValueError(f"Unknown extraction engine '{engine}'. Expected one of {extraction.EXTRACTION_ENGINES}.")
+
+    sink = TeeWriter(out, open_intermediate_writer(config, 'extracted', 'extracted_path'))
+    _, file_paths = extraction.extraction_inputs(config)
+    if extraction_config.get('incremental', False):
+        manifest_path = extraction_config.get('manifest_path', config['data']['extracted_path'] + '.manifest.sqlite')
+        with ExtractionManifest(manifest_path, extractor_key=extraction.extractor_key(engine, options)) as manifest:
+            record_count = extraction.write_incremental_extraction(sink, file_paths, manifest, num_workers, chunk_size, engine, options)
+    else:
+        record_count = extraction.write_full_extraction(sink, file_paths, num_workers, chunk_size, engine, options)
+    sink.close()
+    print(f"[extract] Extracted {record_count} functions with docstrings and context.")
+    extraction.report_extraction_stats(current_metrics(), options)
+
+def dedup_stage(config, upstream, out):
+    """Drops exact and near-duplicate records as they arrive, before they reach refinement."""
+    import deduplicate_pairs as dedup
+    from collections import Counter
+
+    dedup_config = config.get('dedup') or {}
+    refinement_config = config.get('refinement', {})
+    num_workers = dedup_config.get('num_workers', 1) or os.cpu_count()
+    deduplicator = dedup.build_deduplicator(dedup_config)
+    triage = dedup.build_triage(refinement_config)
+    sink = TeeWriter(out, open_intermediate_writer(config, 'deduped', 'deduped_path'))
+    work = Counter()
+    pool = multiprocessing.Pool(processes=num_workers) if num_workers > 1 else None
+    try:
+        for records in rebatch(upstream, dedup_config.get('batch_size', 50000)):
+            keep = deduplicator.check(*dedup.fingerprint([r['completion'] for r in records], deduplicator.hasher, pool, num_workers))
+            sink.write_records([record for record, kept in zip(records, keep) if kept])
+            work.update(dedup.count_llm_work([record for record, kept in zip(records, keep) if not kept], triage))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    sink.close()
+    dedup.report_dedup(deduplicator, work, refinement_config, current_metrics())
+
+def refine_stage(config, upstream, out):
+    """Triages and refines records as they arrive, on one event loop shared by the whole run."""
+    import simulate_llm_refinement as refinement
+
+    refinement_config = config.get('refinement', {})
+    if refinement_config.get('batch_job_mode', 'online') != 'online':
+        raise ValueError("The fused runner only supports refinement.batch_job_mode: online.")
+    batch_records = (config.get('fused_runner') or {}).get('batch_records', 1000)
+    triage = refinement.build_triage(refinement_config)
+    cache = refinement.build_response_cache(refinement_config)
+    refiner = refinement.build_refiner(refinement_config, cache)
+    sink = TeeWriter(out, open_intermediate_writer(config, 'refined', 'llm_refined_path'))
+
+    async def judged_pairs():
+        async for batch in upstream:
+            for record in batch:
+                pair = {'prompt': record['prompt'], 'completion': record['completion']}
+                judgement = triage.judgement(pair['prompt'], pair['completion']) if triage is not None else None
+                yield pair, judgement
+
+    async def refine():
+        # Handing a batch downstream may block on backpressure, so it runs off the event loop.
+        loop = asyncio.get_running_loop()
+        batch = []
+        async with refinement.llm_client_session(refinement_config):
+            async for refined in refiner.iter_refined_pairs(judged_pairs()):
+                batch.append(refined)
+                if len(batch) >= batch_records:
+                    await loop.run_in_executor(None, sink.write_records, batch)
+                    batch = []
+        if batch:
+            await loop.run_in_executor(None, sink.write_records, batch)
+
+    try:
+        asyncio.run(refine())
+    finally:
+        if cache is not None:
+            cache.evict()
+            cache.close()
+    sink.close()
+
+    stats = refiner.stats
+    avoided = triage.judge_calls_avoided if triage is not None else 0
+    metrics = current_metrics()
+    for name, value in stats.items():
+        metrics.incr(name, value)
+    metrics.incr("judge_calls_avoided", avoided)
+    print(f"[refine] {stats['judge_calls']} judge calls, {stats['batch_judge_calls']} batched judge calls, "
+          f"{stats['generator_calls']} generator calls, {stats['retries']} retries, "
+          f"{stats['cache_hits']} cache hits, {avoided} judge calls avoided by triage.")
+
+def process_stage(config, upstream, out, length_budget=None):
+    """Validates and transforms refined records to Alpaca format in bounded batches, routing records over the length budget."""
+    import pandas as pd
+    from collections import Counter
+    from data_pipeline.processing import (
+        partition_valid_code,
+        to_alpaca_frame,
+        count_rejection_reasons,
+        print_rejection_summary,
+        append_jsonl,
+        ValidationMemo,
+    )
+
+    processing_config = config.get('processing', {})
+    num_workers = processing_config.get('num_workers', 1) or os.cpu_count()
+    batch_size = processing_config.get('batch_size') or 50000
+    memo_path = processing_config.get('validation_memo_path')
+    rejected_path = processing_config.get('rejected_path')
+    overflow_path = processing_config.get('overflow_path')
+
+    sink = TeeWriter(out, open_intermediate_writer(config, 'processed', 'final_alpaca_path'))
+    memo = ValidationMemo(memo_path) if memo_path else None
+    pool = multiprocessing.Pool(processes=num_workers) if num_workers > 1 else None
+    rejected_out = None
+    overflow_out = None
+    reasons = Counter()
+    metrics = current_metrics()
+    try:
+        if rejected_path:
+            os.makedirs(os.path.dirname(rejected_path) or '.', exist_ok=True)
+            rejected_out = open(rejected_path, 'w', encoding='utf-8')
+        if length_budget is not None and overflow_path:
+            os.makedirs(os.path.dirname(overflow_path) or '.', exist_ok=True)
+            overflow_out = open(overflow_path, 'w', encoding='utf-8')
+        for records in rebatch(upstream, batch_size):
+            valid_df, rejected_df = partition_valid_code(pd.DataFrame(records), num_workers=num_workers, memo=memo, pool=pool)
+            if length_budget is not None:
+                valid_df, over_df = length_budget.split(valid_df)
+                if overflow_out is not None:
+                    append_jsonl(over_df, overflow_out)
+            sink.write_frame(to_alpaca_frame(valid_df))
+            if rejected_out is not None:
+                append_jsonl(rejected_df, rejected_out)
+            reasons.update(count_rejection_reasons(rejected_df))
+            metrics.incr("read", len(records))
+            metrics.incr("written", len(valid_df))
+            metrics.incr("rejected", len(rejected_df))
+            metrics.progress(int(metrics.counters["read"]))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if memo is not None:
+            memo.close()
+        if rejected_out is not None:
+            rejected_out.close()
+        if overflow_out is not None:
+            overflow_out.close()
+    sink.close()
+    print_rejection_summary(reasons)
+    if length_budget is not None:
+        length_budget.report()
+
+def tokenize_stage(config, upstream):
+    """Tokenizes Alpaca batches as they arrive and saves the final Arrow dataset."""
+    from datasets import Dataset
+    from transformers import AutoTokenizer
+    from data_pipeline.tokenization import (
+        make_batch_tokenizer,
+        make_packing_tokenizer,
+        pack_dataset,
+        column_sum,
+        ThroughputReport,
+    )
+
+    tokenized_path = config['data']['tokenized_path']
+    tokenization_config = config.get('tokenization', {})
+    model_name = tokenization_config.get('model_name', "codellama/CodeLlama-7b-hf")
+    max_length = tokenization_config.get('max_length', 512)
+    packing_config = tokenization_config.get('packing') or {}
+    packing = packing_config.get('enabled', False)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    if packing:
+        tokenize_batch = make_packing_tokenizer(tokenizer, max_length)
+    else:
+        tokenize_batch = make_batch_tokenizer(tokenizer, max_length=max_length)
+
+    def generate_rows():
+        # The fast tokenizer encodes each whole batch in parallel natively.
+        for df in upstream:
+            batch = {column: df[column].tolist() for column in df.columns}
+            encoded = dict(tokenize_batch(batch))
+            columns = encoded if packing else {**batch, **encoded}
+            for i in range(len(df)):
+                yield {name: values[i] for name, values in columns.items()}
+
+    report = ThroughputReport("fused")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # A fresh fingerprint keeps `datasets` from hashing the generator (it reads a
+        # live queue) or reusing a cached result from an earlier run.
+        tokenized = Dataset.from_generator(generate_rows, cache_dir=cache_dir, fingerprint=f"fused-{time.time_ns()}")
+        record_count = len(tokenized)
+        if packing:
+            tokenized, stats = pack_dataset(tokenized, max_length, tokenizer.pad_token_id,
+                                            strategy=packing_config.get('strategy', 'best_fit'))
+            print(f"[tokenize] Packed {stats['examples']} examples into {stats['sequences']} sequences; padding ratio "
+                  f"{stats['padding_ratio_before']:.1%} before packing, {stats['padding_ratio_after']:.1%} after.")
+        throughput = report.finish(record_count, column_sum(tokenized, 'length'))
+        current_metrics().incr("records", throughput["records"])
+        current_metrics().incr("tokens", throughput["tokens"])
+        os.makedirs(tokenized_path, exist_ok=True)
+        tokenized.save_to_disk(tokenized_path)
+    print(f"[tokenize] Saved tokenized dataset to {tokenized_path}")
+
+def main():
+    """Runs extraction, deduplication, refinement, processing and tokenization as streaming stages in one process."""
+    config = load_config()
+    runner_config = config.get('fused_runner') or {}
+    queue_size = runner_config.get('queue_size', 8)
+
+    # Worker pools are started from stage threads; forking a multi-threaded process
+    # can deadlock, so workers come from a clean fork server instead.
+    multiprocessing.set_start_method('forkserver', force=True)
+
+    print(f"Starting fused pipeline (queue size: {queue_size}, "
+          f"intermediate files: {runner_config.get('write_intermediates') or 'none'})...")
+    with stage_metrics("fused", config) as metrics:
+        # Built before the stage threads start: it may load the tokenizer, and
+        # importing transformers from two threads at once can fail.
+        from data_pipeline.processing import LengthBudget
+        length_budget = LengthBudget.from_config(config)
+        extracted = start_stage('extract', lambda out: instrumented(config, 'extract', extract_stage, out), maxsize=queue_size)
+        stages = [extracted]
+        if (config.get('dedup') or {}).get('enabled', False):
+            stages.append(start_stage('dedup', lambda out: instrumented(config, 'dedup', dedup_stage, extracted, out), maxsize=queue_size))
+        refined = start_stage('refine', lambda out: instrumented(config, 'refine', refine_stage, stages[-1], out), maxsize=queue_size)
+        processed = start_stage('process', lambda out: instrumented(config, 'process', process_stage, refined, out, length_budget), maxsize=queue_size)
+        instrumented(config, 'tokenize', tokenize_stage, processed)
+        for stage in stages + [refined, processed]:
+            metrics.incr(f"{stage.name}.batches", stage.items)
+        print("Fused pipeline finished successfully.")
+
+if __name__ == '__main__':
+    main()
@@ -1,42 +1,103 @@
 import os
 import sys
 import yaml
+import argparse
 
 # Add the src directory to the Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from data_pipeline.processing import load_data, validate_code, transform_to_alpaca_format, save_processed_data
+from data_pipeline.processing import (
+    load_data,
+    validate_code,
+    to_alpaca_frame,
+    save_processed_data,
+    process_in_batches,
+    ValidationMemo,
+    LengthBudget,
+)
+from data_pipeline.columnar import stage_path, DEFAULT_ROWS_PER_SHARD
+from data_pipeline.metrics import stage_metrics
+from data_pipeline.sharding import add_shard_arguments, apply_shard_arguments
 
 def load_config(config_path='config.yaml'):
     """Loads the YAML configuration file."""
     with open(config_path, 'r') as file:
         return yaml.safe_load(file)
 
+def run_in_memory(input_data_path, final_alpaca_path, num_workers, memo, rejected_path, output_format, rows_per_shard,
+                  length_budget=None, overflow_path=None):
+    """Loads the whole input, validates and transforms it, and saves the result in one go."""
+    # Load raw data
+    raw_df = load_data(input_data_path, columns=['prompt', 'completion'])
+    print(f"Loaded {len(raw_df)} records from {input_data_path}")
+
+    # Validate data
+    validated_df = validate_code(raw_df, num_workers=num_workers, memo=memo, rejected_path=rejected_path)
+
+    # Route records over the token budget away from tokenization
+    if length_budget is not None:
+        validated_df, over_df = length_budget.split(validated_df)
+        length_budget.report()
+        if overflow_path:
+            os.makedirs(os.path.dirname(overflow_path) or '.', exist_ok=True)
+            over_df.to_json(overflow_path, orient='records', lines=True)
+
+    # Transform data
+    processed_df = to_alpaca_frame(validated_df)
+    print("Transformed data to Alpaca format.")
+
+    # Save processed data
+    save_processed_data(processed_df, final_alpaca_path, output_format, rows_per_shard)
+    print(f"Saved processed data to {stage_path(final_alpaca_path, output_format)}")
+
+def run_streaming(input_data_path, final_alpaca_path, batch_size, num_workers, memo, rejected_path, output_format, rows_per_shard,
+                  length_budget=None, overflow_path=None):
+    """Validates and transforms the input in bounded batches, appending each batch to the output."""
+    print(f"Streaming {input_data_path} in batches of {batch_size} records...")
+    counts = process_in_batches(input_data_path, final_alpaca_path, batch_size,
+                                num_workers=num_workers, memo=memo, rejected_path=rejected_path,
+                                output_format=output_format, rows_per_shard=rows_per_shard,
+                                length_budget=length_budget, overflow_path=overflow_path)
+    print(f"Read {counts['read']} records, wrote {counts['written']} in Alpaca format to {stage_path(final_alpaca_path, output_format)} "
+          f"({counts['rejected']} rejected, {counts['over_budget']} over the token budget).")
+
 def main():
     """Main function to run the data processing pipeline."""
     # Load configuration
-    config = load_config()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    add_shard_arguments(parser)
+    args = parser.parse_args()
+    config = apply_shard_arguments(load_config(), args)
     input_data_path = config['data']['llm_refined_path']
     final_alpaca_path = config['data']['final_alpaca_path']
+    processing_config = config.get('processing', {})
+    num_workers = processing_config.get('num_workers', 1) or os.cpu_count()
+    memo_path = processing_config.get('validation_memo_path')
+    rejected_path = processing_config.get('rejected_path')
+    overflow_path = processing_config.get('overflow_path')
+    batch_size = processing_config.get('batch_size')
+    output_format = config['data'].get('intermediate_format', 'jsonl')
+    rows_per_shard = config['data'].get('rows_per_shard', DEFAULT_ROWS_PER_SHARD)
     
     print("Starting data processing pipeline...")
     
-    # Load raw data
-    raw_df = load_data(input_data_path)
-    print(f"Loaded {len(raw_df)} records from {input_data_path}")
+    memo = ValidationMemo(memo_path) if memo_path else None
+    with stage_metrics("process", config) as metrics:
+        length_budget = LengthBudget.from_config(config)
+        try:
+            if batch_size:
+                run_streaming(input_data_path, final_alpaca_path, batch_size, num_workers, memo, rejected_path, output_format, rows_per_shard,
+                              length_budget, overflow_path)
+            else:
+                run_in_memory(input_data_path, final_alpaca_path, num_workers, memo, rejected_path, output_format, rows_per_shard,
+                              length_budget, overflow_path)
+        finally:
+            if memo is not None:
+                print(f"Validation memo: {memo.hits} results reused from previous runs.")
+                metrics.incr("validation_memo_hits", memo.hits)
+                memo.close()
 
-    # Validate data
-    validated_df = validate_code(raw_df)
-    
-    # Transform data
-    processed_data = transform_to_alpaca_format(validated_df)
-    print("Transformed data to Alpaca format.")
-    
-    # Save processed data
-    save_processed_data(processed_data, final_alpaca_path)
-    print(f"Saved processed data to {final_alpaca_path}")
-    
-    print("Data processing pipeline finished successfully.")
+        print("Data processing pipeline finished successfully.")
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
@@ -1,53 +1,100 @@
 import yaml
+import argparse
 import json
-import pandas as pd
 import time
 import os
-import openai
+import sys
+import asyncio
+import importlib
+from contextlib import asynccontextmanager
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_pipeline.batch_judge import (
+    build_batch_judge_prompt,
+    parse_batch_judge_response,
+    read_batch_job_results,
+    run_local_batch_job,
+    write_batch_job_requests,
+    BATCH_JOB_ENDPOINT,
+    BATCH_PROMPT_VERSION,
+)
+from data_pipeline.checkpoint import StageCheckpoint, open_stage_output, path_fingerprint, run_key
+from data_pipeline.columnar import read_frame, resolve_input, stage_path, DEFAULT_ROWS_PER_SHARD
+from data_pipeline.llm_cache import ResponseCache
+from data_pipeline.metrics import stage_metrics
+from data_pipeline.refinement import AsyncRefiner, MalformedLLMResponse, TransientLLMError
+from data_pipeline.triage import DocstringTriage
+from data_pipeline.sharding import add_shard_arguments, apply_shard_arguments
 
 # --- Configuration Switch ---
 # Set this to True to use the real OpenAI API (requires an API key)
 # Set to False to use the local simulation (default)
 USE_REAL_LLM = False
 
+# --- Models and Prompt Versioning ---
+# Cached responses are keyed by model name and prompt template version, so bump
+# PROMPT_TEMPLATE_VERSION whenever build_judge_prompt or build_generator_prompt changes.
+JUDGE_MODEL = "gpt-3.5-turbo"
+GENERATOR_MODEL = "gpt-4-turbo"
+SIMULATION_MODEL = "simulation"
+PROMPT_TEMPLATE_VERSION = "1"
+
+# Refinement settings that only change how fast records are refined, not the result,
+# so changing them between a crash and the re-run does not discard the checkpoint.
+THROUGHPUT_SETTINGS = (
+    'concurrency', 'requests_per_minute', 'tokens_per_minute', 'max_retries',
+    'backoff_base_seconds', 'backoff_max_seconds', 'cache_ttl_days', 'cache_max_entries',
+    'request_timeout_seconds', 'keepalive_seconds',
+)
+# Refined records handed to the output writer at a time.
+WRITE_BATCH_RECORDS = 1000
+
 # --- API Key Configuration ---
 # For security, the API key is loaded from an environment variable.
 # To use the real API, run: export OPENAI_API_KEY='your_key_here'
-if USE_REAL_LLM:
-    openai.api_key = os.getenv("OPENAI_API_KEY")
+# openai is only imported when the real API is used, so simulated runs (and the
+# fused runner) do not pay for loading it. httpx is the HTTP library it is built on.
+openai = None
+httpx = None
+
+# Errors from the real API that are worth retrying: rate limits, timeouts, dropped connections and 5xx.
+REAL_TRANSIENT_ERRORS = ()
+
+def enable_real_llm(api_key=None):
+    """
+    Switches refinement to the real OpenAI client. The key defaults to OPENAI_API_KEY;
+    the load test passes a placeholder key for the local fake server
+    (refinement.api_base_url).
+    """
+    global USE_REAL_LLM, REAL_TRANSIENT_ERRORS, openai, httpx
+    import openai as openai_module
+    openai = openai_module
+    # Newer SDKs are built on httpx2, the renamed successor of httpx; use whichever the SDK loaded.
+    httpx = sys.modules.get("httpx2") or importlib.import_module("httpx")
+    openai.api_key = api_key or os.getenv("OPENAI_API_KEY")
     if not openai.api_key:
         raise ValueError("OPENAI_API_KEY environment variable not set. Please set it to use the real LLM.")
+    REAL_TRANSIENT_ERRORS = (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+    USE_REAL_LLM = True
+
+if USE_REAL_LLM:
+    enable_real_llm()
 
 def load_config(config_path='config.yaml'):
     """Loads the YAML configuration file."""
     with open(config_path, 'r') as file:
         return yaml.safe_load(file)
 
-def call_llm_judge_api_simulation(docstring, code):
-    """
-    Simulates calling an LLM API to judge docstring quality.
-    This is a placeholder and does not make a real API call.
-    """
-    print(f"  [JUDGE SIM] Evaluating docstring: '{docstring[:40]}...'")
-    time.sleep(0.1) # Simulate network latency
-
-    # --- Simulation Logic ---
-    # To make this interesting, we'll pretend the 'is_prime' docstring is bad.
-    if "is_prime" in code:
-        print("  [JUDGE SIM] Verdict: Low quality.")
-        return {"score": 2, "reason": "Docstring is too brief and lacks detail."}
-    
-    print("  [JUDGE SIM] Verdict: High quality.")
-    return {"score": 5, "reason": "The docstring is clear and accurate."}
-
-def call_llm_judge_api_real(docstring, code):
-    """
-    Calls the real OpenAI API to judge docstring quality.
-    NOTE: This will incur costs.
-    """
-    print(f"  [JUDGE API] Evaluating docstring: '{docstring[:40]}...'")
-    
-    prompt = f"""
+def build_judge_prompt(docstring, code):
+    """Builds the judge prompt for a (docstring, code) pair."""
+    return f"""
 You are an expert Python code reviewer. Your task is to evaluate if the given docstring accurately and sufficiently describes the provided Python function.
 
 Respond ONLY with a JSON object with two keys:
@@ -64,31 +111,42 @@ Here is the docstring to evaluate:
 {docstring}
 ```
 """
-    
-    response = openai.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.1,
-    )
-    
-    try:
-        result = json.loads(response.choices[0].message.content)
-        print(f"  [JUDGE API] Verdict: Score {result.get('score', 'N/A')}")
-        return result
-    except (json.JSONDecodeError, KeyError):
-        print("  [JUDGE API] Error: Could not parse LLM response.")
-        return {"score": 3, "reason": "Could not parse API response."}
 
-def call_llm_generator_api_simulation(code):
+def build_generator_prompt(code):
+    """Builds the generator prompt for a piece of code."""
+    return f"""
+You are an expert Python programmer tasked with writing high-quality, professional documentation.
+
+Analyze the following Python function and write a clear, concise, and accurate docstring for it. The docstring should explain what the function does, its arguments, and what it returns.
+
+Do not write any other text or explanation. Output ONLY the docstring itself.
+
+Here is the function:
+```python
+{code}
+```
+"""
+
+def parse_judge_response(content):
     """
-    Simulates calling an LLM API to generate a new docstring.
-    This is a placeholder and does not make a real API call.
+    Parses the judge's JSON verdict. A malformed response raises MalformedLLMResponse
+    carrying a neutral fallback score, so the refiner uses it without caching it.
     """
-    print(f"  [GENERATOR SIM] Generating new docstring for function...")
-    time.sleep(0.2) # Simulate network latency
+    try:
+        return json.loads(content)
+    except (json.JSONDecodeError, KeyError, TypeError):
+        print("  [JUDGE API] Error: Could not parse LLM response.")
+        raise MalformedLLMResponse("Could not parse the judge response.", {"score": 3, "reason": "Could not parse API response."})
+
+def simulate_judge_verdict(code):
+    """The simulated judge's verdict: we pretend the 'is_prime' docstring is bad."""
+    if "is_prime" in code:
+        return {"score": 2, "reason": "Docstring is too brief and lacks detail."}
 
-    # --- Simulation Logic ---
-    # Generate a new, high-quality docstring.
+    return {"score": 5, "reason": "The docstring is clear and accurate."}
+
+def simulate_generated_docstring():
+    """The simulated generator's output: a new, high-quality docstring."""
     new_docstring = f"""This function takes a code snippet and generates a high-quality docstring.
     
     It analyzes the function's parameters and return values to create
@@ -100,32 +158,95 @@ def call_llm_generator_api_simulation(code):
     Returns:
         (Extracted from code): The value the function returns.
     """
-    print("  [GENERATOR SIM] New docstring created.")
     return new_docstring.strip()
 
-def call_llm_generator_api_real(code):
+def call_llm_judge_api_simulation(docstring, code):
     """
-    Calls the real OpenAI API to generate a new docstring.
+    Simulates calling an LLM API to judge docstring quality.
+    This is a placeholder and does not make a real API call.
+    """
+    print(f"  [JUDGE SIM] Evaluating docstring: '{docstring[:40]}...'")
+    time.sleep(0.1) # Simulate network latency
+    return simulate_judge_verdict(code)
+
+async def call_llm_judge_api_simulation_async(docstring, code):
+    """Async variant of call_llm_judge_api_simulation; the latency does not block other calls."""
+    await asyncio.sleep(0.1) # Simulate network latency
+    return simulate_judge_verdict(code)
+
+def call_llm_judge_api_real(docstring, code):
+    """
+    Calls the real OpenAI API to judge docstring quality.
     NOTE: This will incur costs.
     """
-    print(f"  [GENERATOR API] Generating new docstring for function...")
+    print(f"  [JUDGE API] Evaluating docstring: '{docstring[:40]}...'")
+    
+    response = openai.chat.completions.create(
+        model=JUDGE_MODEL,
+        messages=[{"role": "user", "content": build_judge_prompt(docstring, code)}],
+        temperature=0.1,
+    )
+    try:
+        return parse_judge_response(response.choices[0].message.content)
+    except MalformedLLMResponse as e:
+        return e.fallback
 
-    prompt = f"""
-You are an expert Python programmer tasked with writing high-quality, professional documentation.
+async def call_llm_judge_api_real_async(docstring, code):
+    """
+    Async variant of call_llm_judge_api_real.
+    NOTE: This will incur costs.
+    """
+    response = await get_async_client().chat.completions.create(
+        model=JUDGE_MODEL,
+        messages=[{"role": "user", "content": build_judge_prompt(docstring, code)}],
+        temperature=0.1,
+    )
+    return parse_judge_response(response.choices[0].message.content)
 
-Analyze the following Python function and write a clear, concise, and accurate docstring for it. The docstring should explain what the function does, its arguments, and what it returns.
+async def call_llm_batch_judge_api_simulation_async(pairs):
+    """Simulates judging several docstrings in one request; the response goes through the real batch parser."""
+    await asyncio.sleep(0.1) # Simulate network latency, paid once for the whole batch
+    answers = [{"id": i, **simulate_judge_verdict(code)} for i, (_, code) in enumerate(pairs)]
+    return parse_batch_judge_response(json.dumps(answers), len(pairs))
 
-Do not write any other text or explanation. Output ONLY the docstring itself.
+async def call_llm_batch_judge_api_real_async(pairs):
+    """
+    Judges several docstrings with one real API request that shares a single instruction preamble.
+    Items whose verdict cannot be parsed come back as None and are re-judged individually.
+    NOTE: This will incur costs.
+    """
+    response = await get_async_client().chat.completions.create(
+        model=JUDGE_MODEL,
+        messages=[{"role": "user", "content": build_batch_judge_prompt(pairs)}],
+        temperature=0.1,
+    )
+    verdicts = parse_batch_judge_response(response.choices[0].message.content, len(pairs))
+    return verdicts
 
-Here is the function:
-```python
-{code}
-```
-"""
+def call_llm_generator_api_simulation(code):
+    """
+    Simulates calling an LLM API to generate a new docstring.
+    This is a placeholder and does not make a real API call.
+    """
+    print(f"  [GENERATOR SIM] Generating new docstring for function...")
+    time.sleep(0.2) # Simulate network latency
+    return simulate_generated_docstring()
+
+async def call_llm_generator_api_simulation_async(code):
+    """Async variant of call_llm_generator_api_simulation."""
+    await asyncio.sleep(0.2) # Simulate network latency
+    return simulate_generated_docstring()
+
+def call_llm_generator_api_real(code):
+    """
+    Calls the real OpenAI API to generate a new docstring.
+    NOTE: This will incur costs.
+    """
+    print(f"  [GENERATOR API] Generating new docstring for function...")
 
     response = openai.chat.completions.create(
-        model="gpt-4-turbo",
-        messages=[{"role": "user", "content": prompt}],
+        model=GENERATOR_MODEL,
+        messages=[{"role": "user", "content": build_generator_prompt(code)}],
         temperature=0.3,
     )
     
@@ -133,55 +254,286 @@ Here is the function:
     print("  [GENERATOR API] New docstring created.")
     return new_docstring.strip()
 
+async def call_llm_generator_api_real_async(code):
+    """
+    Async variant of call_llm_generator_api_real.
+    NOTE: This will incur costs.
+    """
+    response = await get_async_client().chat.completions.create(
+        model=GENERATOR_MODEL,
+        messages=[{"role": "user", "content": build_generator_prompt(code)}],
+        temperature=0.3,
+    )
+
+    new_docstring = response.choices[0].message.content
+    return new_docstring.strip()
+
+_async_client = None
+
+def build_async_client(refinement_config):
+    """
+    Builds the AsyncOpenAI client for a run. Its pool holds up to `concurrency`
+    keep-alive connections, so every in-flight call reuses a warm connection instead
+    of paying a new TCP/TLS handshake. The SDK's own retries are off: AsyncRefiner
+    already retries transient errors with backoff, and retrying in both would
+    multiply the attempts under load.
+    """
+    concurrency = max(1, refinement_config.get('concurrency', 8))
+    limits = httpx.Limits(
+        max_connections=concurrency,
+        max_keepalive_connections=concurrency,
+        keepalive_expiry=refinement_config.get('keepalive_seconds', 30.0),
+    )
+    return openai.AsyncOpenAI(
+        api_key=openai.api_key,
+        base_url=refinement_config.get('api_base_url'),
+        timeout=refinement_config.get('request_timeout_seconds', 60.0),
+        max_retries=0,
+        http_client=openai.DefaultAsyncHttpxClient(limits=limits),
+    )
+
+def get_async_client():
+    """Returns the client of the current session (see llm_client_session), or a default one created on first use."""
+    global _async_client
+    if _async_client is None:
+        _async_client = build_async_client({})
+    return _async_client
+
+@asynccontextmanager
+async def llm_client_session(refinement_config):
+    """
+    Opens the pooled client for the real API for one event loop's run and closes its
+    connections at the end (a no-op in simulation mode). The connections belong to the
+    loop they were opened on, so every asyncio.run needs its own session.
+    """
+    global _async_client
+    if not USE_REAL_LLM:
+        yield
+        return
+    _async_client = build_async_client(refinement_config)
+    try:
+        yield
+    finally:
+        await _async_client.close()
+        _async_client = None
+
+def build_response_cache(refinement_config):
+    """Opens the persistent response cache configured in the 'refinement' section, if any."""
+    cache_path = refinement_config.get('cache_path')
+    if not cache_path:
+        return None
+    ttl_days = refinement_config.get('cache_ttl_days')
+    return ResponseCache(
+        cache_path,
+        ttl_seconds=ttl_days * 24 * 3600 if ttl_days else None,
+        max_entries=refinement_config.get('cache_max_entries'),
+    )
+
+def build_refiner(refinement_config, cache=None):
+    """Builds the async refiner for the real or simulated API from the 'refinement' config section."""
+    if USE_REAL_LLM:
+        judge, generator = call_llm_judge_api_real_async, call_llm_generator_api_real_async
+        batch_judge = call_llm_batch_judge_api_real_async
+        judge_model, generator_model = JUDGE_MODEL, GENERATOR_MODEL
+        transient_exceptions = REAL_TRANSIENT_ERRORS
+    else:
+        judge, generator = call_llm_judge_api_simulation_async, call_llm_generator_api_simulation_async
+        batch_judge = call_llm_batch_judge_api_simulation_async
+        judge_model, generator_model = SIMULATION_MODEL, SIMULATION_MODEL
+        transient_exceptions = (TransientLLMError,)
+    judge_batch_size = refinement_config.get('judge_batch_size', 1)
+    return AsyncRefiner(
+        judge,
+        generator,
+        concurrency=refinement_config.get('concurrency', 8),
+        requests_per_minute=refinement_config.get('requests_per_minute'),
+        tokens_per_minute=refinement_config.get('tokens_per_minute'),
+        max_retries=refinement_config.get('max_retries', 5),
+        backoff_base=refinement_config.get('backoff_base_seconds', 1.0),
+        backoff_max=refinement_config.get('backoff_max_seconds', 60.0),
+        transient_exceptions=transient_exceptions,
+        cache=cache,
+        judge_model=judge_model,
+        generator_model=generator_model,
+        prompt_version=PROMPT_TEMPLATE_VERSION,
+        batch_prompt_version=BATCH_PROMPT_VERSION,
+        batch_judge=batch_judge if judge_batch_size > 1 else None,
+        judge_batch_size=judge_batch_size,
+    )
+
+def build_triage(refinement_config):
+    """Builds the local docstring triage from the 'refinement.triage' config section, or None if disabled."""
+    triage_config = dict(refinement_config.get('triage') or {})
+    if not triage_config.pop('enabled', False):
+        return None
+    return DocstringTriage(**triage_config)
+
+def triage_records(records, triage):
+    """
+    Pre-scores every record locally. Returns one judgement per record: a verdict for
+    confidently good or bad docstrings, None for the ones the LLM judge still has to see.
+    """
+    if triage is None:
+        return [None] * len(records)
+    judgements = [triage.judgement(record['prompt'], record['completion']) for record in records]
+    stats = triage.stats
+    print(f"Local triage: {stats['good']} good, {stats['bad']} bad, {stats['uncertain']} uncertain "
+          f"-> {triage.judge_calls_avoided} judge calls avoided.")
+    return judgements
+
+def submit_batch_job(pairs, refinement_config):
+    """
+    Writes the offline batch-job request file for the given (docstring, code) pairs.
+
+    With the real API the file is uploaded and a batch job is created; its id must be
+    set as 'batch_job_id' in the config before collecting. In simulation mode the
+    local file-based stand-in answers the requests immediately.
+    """
+    request_path = refinement_config['batch_job_request_path']
+    result_path = refinement_config['batch_job_result_path']
+    batch_size = max(1, refinement_config.get('judge_batch_size', 1))
+    model = JUDGE_MODEL if USE_REAL_LLM else SIMULATION_MODEL
+
+    count = write_batch_job_requests(request_path, pairs, model, batch_size)
+    print(f"Wrote {count} batch-job requests covering {len(pairs)} records to {request_path}")
+
+    if USE_REAL_LLM:
+        client = openai.OpenAI(api_key=openai.api_key)
+        with open(request_path, 'rb') as f:
+            uploaded = client.files.create(file=f, purpose='batch')
+        batch = client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_JOB_ENDPOINT, completion_window='24h')
+        print(f"Created batch job {batch.id}. Set refinement.batch_job_id to it and re-run with batch_job_mode: collect.")
+    else:
+        processed = run_local_batch_job(request_path, result_path, lambda docstring, code: simulate_judge_verdict(code))
+        print(f"[BATCH SIM] Answered {processed} requests into {result_path}")
+
+def collect_batch_job(pairs, refinement_config):
+    """
+    Reads the batch-job results back into one judgement (or None) per (docstring, code)
+    pair, matching each result to the pairs its request was written for.
+    """
+    result_path = refinement_config['batch_job_result_path']
+    if USE_REAL_LLM:
+        client = openai.OpenAI(api_key=openai.api_key)
+        batch = client.batches.retrieve(refinement_config['batch_job_id'])
+        if batch.status != 'completed':
+            raise RuntimeError(f"Batch job {batch.id} is not complete yet (status: {batch.status}).")
+        os.makedirs(os.path.dirname(result_path), exist_ok=True)
+        with open(result_path, 'w', encoding='utf-8') as f:
+            f.write(client.files.content(batch.output_file_id).text)
+
+    stats = {}
+    judgements = read_batch_job_results(result_path, pairs, stats)
+    if stats['mismatched_requests']:
+        print(f"[WARN] {stats['mismatched_requests']} batch-job results do not match the records they were submitted for "
+              f"(the input changed since submitting?); their records will be judged individually.")
+    recovered = sum(judgement is not None for judgement in judgements)
+    print(f"Recovered {recovered}/{len(pairs)} judgements from {result_path}; the rest will be judged individually.")
+    return judgements
+
+def refinement_input_path(config):
+    """Returns the data refinement reads: the deduplicated records if the dedup stage is enabled."""
+    if (config.get('dedup') or {}).get('enabled', False):
+        return config['data']['deduped_path']
+    return config['data']['extracted_path']
+
+def refinement_run_key(input_path, refinement_config):
+    """Identifies a refinement run by its input and the settings that shape its output, for checkpoint resume."""
+    settings = {name: value for name, value in refinement_config.items() if name not in THROUGHPUT_SETTINGS}
+    return run_key(stage="refine", input=path_fingerprint(resolve_input(input_path)), settings=settings,
+                   models=[JUDGE_MODEL, GENERATOR_MODEL, PROMPT_TEMPLATE_VERSION, USE_REAL_LLM])
+
+async def write_refined(refiner, records, judgements, out, checkpoint=None):
+    """Streams refined records to `out` in input order, marking each written batch as done in the checkpoint."""
+    batch = []
+
+    def flush():
+        out.write_records(batch)
+        if checkpoint is not None:
+            checkpoint.advance(len(batch))
+        batch.clear()
+
+    async for refined in refiner.iter_refined(records, judgements):
+        batch.append(refined)
+        if len(batch) >= WRITE_BATCH_RECORDS:
+            flush()
+    if batch:
+        flush()
+
+async def refine_in_session(refiner, records, judgements, out, checkpoint, refinement_config):
+    """Runs write_refined with the real API's connection pool open for the whole run."""
+    async with llm_client_session(refinement_config):
+        await write_refined(refiner, records, judgements, out, checkpoint)
+
+def refine(input_path, output_path, refinement_config, output_format, rows_per_shard, metrics, checkpoint_config=None):
+    """
+    Triages and refines the extracted records, streaming them to the output and
+    counting calls in `metrics`. With checkpointing enabled, refined records are
+    committed as they finish and a re-run resumes after the last committed record.
+    """
+    df = read_frame(input_path, columns=['prompt', 'completion'])
+    records = df.to_dict('records')
+    judgements = triage_records(records, build_triage(refinement_config))
+    # Only records the triage could not decide go to the judge, online or as a batch job.
+    undecided = [i for i, judgement in enumerate(judgements) if judgement is None]
+
+    batch_job_mode = refinement_config.get('batch_job_mode', 'online')
+    undecided_pairs = [(records[i]['prompt'], records[i]['completion']) for i in undecided]
+    if batch_job_mode == 'submit':
+        submit_batch_job(undecided_pairs, refinement_config)
+        return
+    if batch_job_mode == 'collect':
+        for i, judgement in zip(undecided, collect_batch_job(undecided_pairs, refinement_config)):
+            judgements[i] = judgement
+
+    cache = build_response_cache(refinement_config)
+    refiner = build_refiner(refinement_config, cache)
+    key = refinement_run_key(input_path, refinement_config)
+
+    start = time.perf_counter()
+    try:
+        with open_stage_output(output_path, output_format, rows_per_shard, key, checkpoint_config) as out:
+            checkpoint = out if isinstance(out, StageCheckpoint) else None
+            done = checkpoint.position if checkpoint is not None else 0
+            if done:
+                print(f"Resuming from checkpoint: {done} of {len(records)} records already refined.")
+                metrics.incr("resumed_records", done)
+            print(f"Refining {len(records) - done} records with up to {refiner.concurrency} concurrent LLM calls...")
+            asyncio.run(refine_in_session(refiner, records[done:], judgements[done:], out, checkpoint, refinement_config))
+    finally:
+        if cache is not None:
+            cache.evict()
+            cache.close()
+    elapsed = time.perf_counter() - start
+
+    stats = refiner.stats
+    for name, value in stats.items():
+        metrics.incr(name, value)
+    print(f"\nLLM refinement process finished in {elapsed:.1f}s: {stats['judge_calls']} judge calls, "
+          f"{stats['batch_judge_calls']} batched judge calls ({stats['requeued']} records re-queued), "
+          f"{stats['generator_calls']} generator calls, {stats['retries']} retries, "
+          f"{stats['malformed_responses']} malformed responses (not cached).")
+    if cache is not None:
+        print(f"Response cache: {cache.stats['hits']} hits, {cache.stats['misses']} misses, "
+              f"{cache.stats['expired']} expired, {cache.stats['evicted']} evicted.")
+    print(f"Saved LLM-refined data to {stage_path(output_path, output_format)}")
+
 def main():
     """Main function to refine the data using a simulated LLM."""
-    config = load_config()
-    input_path = config['data']['extracted_path']
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    add_shard_arguments(parser)
+    args = parser.parse_args()
+    config = apply_shard_arguments(load_config(), args)
+    input_path = refinement_input_path(config)
     output_path = config['data']['llm_refined_path']
+    refinement_config = config.get('refinement', {})
+    output_format = config['data'].get('intermediate_format', 'jsonl')
+    rows_per_shard = config['data'].get('rows_per_shard', DEFAULT_ROWS_PER_SHARD)
     
     print(f"Starting LLM refinement process on {input_path}...")
-    
-    df = pd.read_json(input_path, lines=True)
-    refined_records = []
-    
-    for index, row in df.iterrows():
-        print(f"\nProcessing record {index+1}/{len(df)}...")
-        code = row['completion']
-        docstring = row['prompt']
-        
-        # --- Dynamic Dispatch: Use real API or simulation based on the flag ---
-        if USE_REAL_LLM:
-            judgement = call_llm_judge_api_real(docstring, code)
-        else:
-            judgement = call_llm_judge_api_simulation(docstring, code)
-        
-        # If score is low, generate a new one
-        if judgement.get('score', 0) <= 2:
-            print("  -> Low score detected. Generating a new docstring.")
-            if USE_REAL_LLM:
-                new_docstring = call_llm_generator_api_real(code)
-            else:
-                new_docstring = call_llm_generator_api_simulation(code)
-            final_docstring = new_docstring
-        else:
-            print("  -> High score. Keeping original docstring.")
-            final_docstring = docstring
-            
-        refined_records.append({
-            "prompt": final_docstring,
-            "completion": code
-        })
-
-    print("\nLLM refinement process finished.")
-    
-    # Ensure the output directory exists before saving
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    
-    # Save the refined data
-    refined_df = pd.DataFrame(refined_records)
-    refined_df.to_json(output_path, orient='records', lines=True)
-            
-    print(f"Saved LLM-refined data to {output_path}")
+
+    with stage_metrics("refine", config) as metrics:
+        refine(input_path, output_path, refinement_config, output_format, rows_per_shard, metrics, config.get('checkpoint'))
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
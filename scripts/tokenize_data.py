@@ -1,55 +1,107 @@
 import yaml
-from datasets import load_dataset
-from transformers import AutoTokenizer
+import argparse
+import sys
 import os
+from datasets import Dataset, concatenate_datasets, load_dataset
+from transformers import AutoTokenizer
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_pipeline.tokenization import (
+    tokenize_dataset,
+    make_packing_tokenizer,
+    pack_dataset,
+    column_sum,
+    ThroughputReport,
+)
+from data_pipeline.columnar import resolve_input, is_columnar, read_manifest, shard_paths
+from data_pipeline.metrics import stage_metrics, stage_timer
+from data_pipeline.sharding import add_shard_arguments, apply_shard_arguments
 
 def load_config(config_path='config.yaml'):
     """Loads the YAML configuration file."""
     with open(config_path, 'r') as file:
         return yaml.safe_load(file)
 
+def load_processed_dataset(processed_path):
+    """
+    Loads the processed Alpaca data as a `datasets.Dataset`.
+
+    Arrow shards are memory-mapped in place (no copy and no conversion into the
+    datasets cache); Parquet shards and JSONL go through `load_dataset`.
+    """
+    source = resolve_input(processed_path)
+    if not is_columnar(source):
+        return load_dataset('json', data_files=source, split='train')
+    manifest = read_manifest(source)
+    if not manifest['shards']:
+        return Dataset.from_dict({name: [] for name in manifest['columns']})
+    if manifest['format'] == 'parquet':
+        return load_dataset('parquet', data_files=shard_paths(source), split='train')
+    return concatenate_datasets([Dataset.from_file(path) for path in shard_paths(source)])
+
+def pack_tokenized_dataset(dataset, tokenizer, max_length, batch_size, num_proc, packing_config):
+    """Tokenizes without padding and packs the examples into fixed-length sequences separated by EOS."""
+    strategy = packing_config.get('strategy', 'best_fit')
+    with stage_timer("dataset.map.tokenize_for_packing"):
+        tokenized = dataset.map(
+            make_packing_tokenizer(tokenizer, max_length),
+            batched=True,
+            batch_size=batch_size,
+            num_proc=num_proc if num_proc > 1 else None,
+            remove_columns=dataset.column_names,
+            desc="Tokenizing for packing",
+        )
+    packed, stats = pack_dataset(tokenized, max_length, tokenizer.pad_token_id, strategy=strategy)
+    print(f"Packed {stats['examples']} examples into {stats['sequences']} sequences of {max_length} tokens ({strategy}).")
+    print(f"Padding ratio: {stats['padding_ratio_before']:.1%} before packing, {stats['padding_ratio_after']:.1%} after.")
+    return packed
+
 def main():
     """Main function to tokenize the data."""
     # Load configuration
-    config = load_config()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    add_shard_arguments(parser)
+    args = parser.parse_args()
+    config = apply_shard_arguments(load_config(), args)
     processed_path = config['data']['final_alpaca_path']
     tokenized_path = config['data']['tokenized_path']
-    model_name = "codellama/CodeLlama-7b-hf"
-
-    print(f"Loading processed data from {processed_path}...")
-    dataset = load_dataset('json', data_files=processed_path, split='train')
-
-    print(f"Loading tokenizer for '{model_name}'...")
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    
-    # Set a padding token if one doesn't exist
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
-
-    def format_and_tokenize(example):
-        """Formats the prompt and tokenizes it."""
-        # The prompt template is crucial for instruction-tuned models
-        prompt = f"### Instruction:\\n{example['instruction']}\\n\\n### Response:\\n{example['output']}"
-        
-        # Tokenize the formatted prompt
-        tokenized_example = tokenizer(
-            prompt,
-            truncation=True,
-            max_length=512, # A standard max_length
-            padding="max_length"
-        )
-        return tokenized_example
+    tokenization_config = config.get('tokenization', {})
+    model_name = tokenization_config.get('model_name', "codellama/CodeLlama-7b-hf")
+    max_length = tokenization_config.get('max_length', 512) # A standard max_length
+    batch_size = tokenization_config.get('batch_size', 1000)
+    num_proc = tokenization_config.get('num_proc', 1) or os.cpu_count()
+
+    with stage_metrics("tokenize", config) as metrics:
+        print(f"Loading processed data from {processed_path}...")
+        dataset = load_processed_dataset(processed_path)
+
+        print(f"Loading tokenizer for '{model_name}'...")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        # Set a padding token if one doesn't exist
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
 
-    print("Formatting and tokenizing the dataset...")
-    tokenized_dataset = dataset.map(format_and_tokenize)
+        packing_config = tokenization_config.get('packing') or {}
+        print(f"Formatting and tokenizing the dataset (batch size: {batch_size}, processes: {num_proc})...")
+        report = ThroughputReport("tokenize")
+        if packing_config.get('enabled', False):
+            tokenized_dataset = pack_tokenized_dataset(dataset, tokenizer, max_length, batch_size, num_proc, packing_config)
+        else:
+            tokenized_dataset = tokenize_dataset(dataset, tokenizer, max_length=max_length, batch_size=batch_size, num_proc=num_proc)
+        throughput = report.finish(len(dataset), column_sum(tokenized_dataset, 'length'))
+        metrics.incr("records", throughput["records"])
+        metrics.incr("tokens", throughput["tokens"])
 
-    print(f"Saving tokenized dataset to {tokenized_path}...")
-    # Ensure the output directory exists
-    os.makedirs(tokenized_path, exist_ok=True)
-    tokenized_dataset.save_to_disk(tokenized_path)
+        print(f"Saving tokenized dataset to {tokenized_path}...")
+        # Ensure the output directory exists
+        os.makedirs(tokenized_path, exist_ok=True)
+        tokenized_dataset.save_to_disk(tokenized_path)
 
-    print("Tokenization step finished successfully.")
-    print(f"Data is ready for training in: {tokenized_path}")
+        print("Tokenization step finished successfully.")
+        print(f"Data is ready for training in: {tokenized_path}")
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
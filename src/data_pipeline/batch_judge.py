@@ -0,0 +1,228 @@
+import os
+import re
+import json
+import hashlib
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Bump when the batch prompt wording or response format changes. It is part of the
+# cache key of batched verdicts and of every batch-job request's custom_id.
+BATCH_PROMPT_VERSION = "batch-1"
+
+# The endpoint every offline batch-job request targets.
+BATCH_JOB_ENDPOINT = "/v1/chat/completions"
+
+_ITEMS_START = "<<<ITEMS"
+_ITEMS_END = "ITEMS>>>"
+_CUSTOM_ID = re.compile(r"^records-(\d+)-(\d+)-([0-9a-f]+)$")
+
+BATCH_JUDGE_PREAMBLE = """
+You are an expert Python code reviewer. For each item below, evaluate if the given docstring accurately and sufficiently describes the provided Python function.
+
+Respond ONLY with a JSON array containing one object per item, in any order, with three keys:
+1. "id": The item's id, copied exactly.
+2. "score": A rating from 1 to 5, where 1 is "completely irrelevant" and 5 is "a perfect, comprehensive description".
+3. "reason": A brief, one-sentence explanation for your score.
+
+The items are a JSON array of objects with "id", "docstring" and "code" keys:
+"""
+
+
+def build_batch_judge_prompt(pairs: Sequence[Tuple[str, str]]) -> str:
+    """Packs (docstring, code) pairs into one judge prompt that shares a single instruction preamble."""
+    items = [{"id": i, "docstring": docstring, "code": code} for i, (docstring, code) in enumerate(pairs)]
+    return f"{BATCH_JUDGE_PREAMBLE}{_ITEMS_START}\n{json.dumps(items)}\n{_ITEMS_END}\n"
+
+
+def is_batch_judge_prompt(prompt: str) -> bool:
+    """Tells whether a prompt was built by build_batch_judge_prompt."""
+    return _ITEMS_START in prompt and _ITEMS_END in prompt
+
+
+def extract_batch_items(prompt: str) -> List[Tuple[str, str]]:
+    """Recovers the (docstring, code) pairs from a prompt built by build_batch_judge_prompt."""
+    start = prompt.index(_ITEMS_START) + len(_ITEMS_START)
+    end = prompt.index(_ITEMS_END, start)
+    return [(item["docstring"], item["code"]) for item in json.loads(prompt[start:end])]
+
+
+def _valid_verdict(entry) -> bool:
+    """Checks that a parsed entry has an integer id and a score between 1 and 5."""
+    if not isinstance(entry, dict) or not isinstance(entry.get("id"), int):
+        return False
+    score = entry.get("score")
+    return isinstance(score, (int, float)) and not isinstance(score, bool) and 1 <= score <= 5
+
+
+def parse_batch_judge_response(content: Optional[str], count: int) -> List[Optional[Dict]]:
+    """
+    Maps a batched judge response back to its items.
+
+    Returns a list of `count` verdicts in item order. The JSON array may be wrapped
+    in prose or a code fence, or nested under a single object key; entries are
+    matched by their "id", not their position. Any item that is missing, duplicated,
+    out of range or malformed maps to None so the caller can re-judge it on its own.
+    """
+    verdicts: List[Optional[Dict]] = [None] * count
+    if not content:
+        return verdicts
+    start, end = content.find("["), content.rfind("]")
+    if start == -1 or end <= start:
+        return verdicts
+    try:
+        entries = json.loads(content[start:end + 1])
+    except json.JSONDecodeError:
+        return verdicts
+    if isinstance(entries, dict) and len(entries) == 1:
+        entries = next(iter(entries.values()))
+    if not isinstance(entries, list):
+        return verdicts
+
+    seen = set()
+    for entry in entries:
+        if not _valid_verdict(entry) or not 0 <= entry["id"] < count:
+            continue
+        item_id = entry["id"]
+        if item_id in seen:
+            # Conflicting answers for the same item are not trusted.
+            verdicts[item_id] = None
+            continue
+        seen.add(item_id)
+        verdicts[item_id] = {"score": entry["score"], "reason": entry.get("reason", "")}
+    return verdicts
+
+
+def batch_digest(pairs: Sequence[Tuple[str, str]]) -> str:
+    """Hashes the (docstring, code) pairs of a batch-job request, and the batch prompt version."""
+    payload = json.dumps([BATCH_PROMPT_VERSION, [list(pair) for pair in pairs]])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _custom_id(start: int, batch: Sequence[Tuple[str, str]]) -> str:
+    """Encodes the record range a batch-job request covers and the digest of its contents."""
+    return f"records-{start}-{len(batch)}-{batch_digest(batch)}"
+
+
+def write_batch_job_requests(
+    request_path: str,
+    pairs: Iterable[Tuple[str, str]],
+    model: str,
+    batch_size: int,
+    temperature: float = 0.1,
+) -> int:
+    """
+    Writes an offline batch-job request file (OpenAI Batch API JSONL format).
+
+    Each line packs up to `batch_size` consecutive (docstring, code) pairs into one
+    chat completion request whose custom_id records which records it covers and a
+    digest of their contents.
+    Returns the number of requests written.
+    """
+    directory = os.path.dirname(request_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    def write_request(out, start, batch):
+        request = {
+            "custom_id": _custom_id(start, batch),
+            "method": "POST",
+            "url": BATCH_JOB_ENDPOINT,
+            "body": {
+                "model": model,
+                "messages": [{"role": "user", "content": build_batch_judge_prompt(batch)}],
+                "temperature": temperature,
+            },
+        }
+        out.write(json.dumps(request) + "\n")
+
+    requests = 0
+    with open(request_path, "w", encoding="utf-8") as out:
+        batch: List[Tuple[str, str]] = []
+        start = 0
+        for index, pair in enumerate(pairs):
+            if not batch:
+                start = index
+            batch.append(pair)
+            if len(batch) == batch_size:
+                write_request(out, start, batch)
+                requests += 1
+                batch = []
+        if batch:
+            write_request(out, start, batch)
+            requests += 1
+    return requests
+
+
+def read_batch_job_results(
+    result_path: str,
+    pairs: Sequence[Tuple[str, str]],
+    stats: Optional[Dict[str, int]] = None,
+) -> List[Optional[Dict]]:
+    """
+    Reads a batch-job results file back into one verdict per (docstring, code) pair.
+
+    A result is matched to the pairs its custom_id names, and only used if they
+    still hash to the digest the request was written with, so a result file from
+    other records (or another batch prompt version) is never applied. Records whose
+    request failed or did not match, whose response could not be parsed, or which
+    are absent from the file map to None and should be judged again individually.
+    `stats` counts the mismatched requests.
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault("mismatched_requests", 0)
+    verdicts: List[Optional[Dict]] = [None] * len(pairs)
+    with open(result_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            match = _CUSTOM_ID.match(str(result.get("custom_id", "")))
+            if match is None:
+                stats["mismatched_requests"] += 1
+                continue
+            start, count = int(match.group(1)), int(match.group(2))
+            if start + count > len(pairs) or batch_digest(pairs[start:start + count]) != match.group(3):
+                stats["mismatched_requests"] += 1
+                continue
+            response = result.get("response") or {}
+            if response.get("status_code", 200) != 200:
+                continue
+            try:
+                content = response["body"]["choices"][0]["message"]["content"]
+            except (KeyError, IndexError, TypeError):
+                continue
+            for offset, verdict in enumerate(parse_batch_judge_response(content, count)):
+                verdicts[start + offset] = verdict
+    return verdicts
+
+
+def run_local_batch_job(request_path: str, result_path: str, judge: Callable[[str, str], Dict]) -> int:
+    """
+    A file-based stand-in for the remote batch service.
+
+    Reads a request file, judges every packed item with `judge(docstring, code)` and
+    writes a results file in the same format the remote service produces, so the
+    whole submit/collect cycle can be exercised without the network. Returns the
+    number of requests processed.
+    """
+    directory = os.path.dirname(result_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    processed = 0
+    with open(request_path, "r", encoding="utf-8") as requests, open(result_path, "w", encoding="utf-8") as out:
+        for line in requests:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            pairs = extract_batch_items(request["body"]["messages"][0]["content"])
+            answers = [{"id": i, **judge(docstring, code)} for i, (docstring, code) in enumerate(pairs)]
+            result = {
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "body": {"choices": [{"message": {"role": "assistant", "content": json.dumps(answers)}}]},
+                },
+                "error": None,
+            }
+            out.write(json.dumps(result) + "\n")
+            processed += 1
+    return processed
@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import time
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Tuple
+
+from data_pipeline.metrics import reset_peak_rss, peak_rss_mb
+
+# Metrics compared against the baseline, and whether a higher value is better.
+REGRESSION_METRICS = {"records_per_sec": True, "mb_per_sec": True, "peak_rss_mb": False}
+
+
+def measure_stage(run: Callable[[], int], input_bytes: int, repeats: int = 1) -> Dict[str, float]:
+    """
+    Runs `run` (which returns the number of records it produced) and measures it.
+
+    The best of `repeats` wall times is reported as records/sec and MB/sec of input,
+    together with the peak RSS reached while the stage ran. The stage's own console
+    output is discarded so printing does not dominate the timings.
+    """
+    best = float("inf")
+    records = 0
+    reset_peak_rss()
+    for _ in range(repeats):
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            start = time.perf_counter()
+            records = run()
+            best = min(best, time.perf_counter() - start)
+    seconds = max(best, 1e-9)
+    return {
+        "records": records,
+        "seconds": best,
+        "records_per_sec": records / seconds,
+        "mb_per_sec": input_bytes / (1024 * 1024) / seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def find_regressions(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float = 0.2,
+) -> List[Tuple[str, str, float, float]]:
+    """
+    Compares results with a baseline and returns (stage, metric, baseline, current) for
+    every metric that got worse by more than `threshold` (a fraction, e.g. 0.2 = 20%).
+    Stages or metrics missing from either side are skipped.
+    """
+    regressions = []
+    for stage, metrics in results.items():
+        reference = baseline.get(stage)
+        if not reference:
+            continue
+        for metric, higher_is_better in REGRESSION_METRICS.items():
+            if metric not in metrics or not reference.get(metric):
+                continue
+            before, after = reference[metric], metrics[metric]
+            change = (after - before) / before
+            if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+                regressions.append((stage, metric, before, after))
+    return regressions
+
+
+def load_baseline(path: str) -> Dict:
+    """Loads the stored baseline ({'spec', 'python', 'stages'}), or an empty dict if there is none yet."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: Dict[str, Dict[str, float]], spec: Dict):
+    """Stores results as the new baseline, together with the synthetic-repo spec they were measured on."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"spec": spec, "python": sys.version.split()[0], "stages": results}, f, indent=2, sort_keys=True)
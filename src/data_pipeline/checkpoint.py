@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from typing import Callable, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from data_pipeline.columnar import (
+    MANIFEST_NAME,
+    DEFAULT_ROWS_PER_SHARD,
+    is_columnar,
+    open_writer,
+    stage_path,
+)
+
+# Bump this when the checkpoint layout changes; older checkpoints are then discarded.
+CHECKPOINT_VERSION = 1
+
+PROGRESS_NAME = "_progress.json"
+
+
+def run_key(**parts) -> str:
+    """Returns a short hash identifying a stage run by its inputs and settings."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+
+
+def path_fingerprint(path: str) -> Dict:
+    """Identifies a stage's input file or columnar dataset by size and modification time."""
+    target = os.path.join(path, MANIFEST_NAME) if is_columnar(path) else path
+    if not os.path.exists(target):
+        return {"path": path}
+    stat = os.stat(target)
+    return {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def chain_digest(digest: str, item: str) -> str:
+    """Extends a running digest of an ordered item listing by one item."""
+    return hashlib.sha256(f"{digest}\0{item}".encode("utf-8")).hexdigest()
+
+
+def _fsync_directory(directory: str):
+    """Makes a rename inside `directory` durable (a no-op where directories cannot be opened)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: str, text: str):
+    """
+    Writes a file so that it either has the full `text` or does not change, even if the
+    process dies. Each call writes its own temporary file, so processes writing the
+    same path at once never mix their contents; the last rename wins.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    _fsync_directory(directory)
+
+
+class StageCheckpoint:
+    """
+    A crash-safe stage output that a re-run resumes instead of starting over.
+
+    It has the interface of the stage writers in `columnar`. Records are buffered and
+    committed as JSONL shards in `<output>.checkpoint/`. Each shard is fsynced and
+    renamed into place before the progress marker (`_progress.json`) is atomically
+    replaced to list it. The marker also records the stage's `position`, the number
+    of input items (files, records) whose output is included. A stage that names its
+    items (`advance(item=...)`) also gets a digest of the names in order, so a
+    re-run can check that its listing still starts with the same items
+    (`matches_items`) before skipping them.
+
+    The stage calls `advance` after it has written an item's output. A commit happens
+    once `rows_per_commit` rows or `commit_interval` seconds have accumulated. When
+    the process dies, at most the uncommitted tail is lost. A re-run with the same
+    `key` starts from the committed position; anything written after that commit is
+    discarded. A different key (changed input or settings) starts from scratch.
+
+    On a clean exit the shards are copied to the real output in the configured
+    format and the checkpoint is removed. If the process dies during that copy, the
+    next run simply copies again.
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        fmt: str = "jsonl",
+        rows_per_shard: int = DEFAULT_ROWS_PER_SHARD,
+        key: str = "",
+        rows_per_commit: int = 5000,
+        commit_interval: float = 60.0,
+    ):
+        self.output_path = output_path
+        self.fmt = fmt
+        self.rows_per_shard = rows_per_shard
+        self.key = key
+        self.rows_per_commit = rows_per_commit
+        self.commit_interval = commit_interval
+        self.directory = stage_path(output_path, fmt) + ".checkpoint"
+        self.on_commit: Optional[Callable[[], None]] = None
+        self._last_commit = time.monotonic()
+        self._reset()
+        if not self._resume():
+            self._clear_directory()
+        self.resumed_from = self.position
+
+    def _reset(self):
+        """Forgets all progress in memory."""
+        self.position = 0
+        self.num_rows = 0
+        self.shards: List[Dict] = []
+        self.items_digest = ""
+        self._pending: List[str] = []
+        self._pending_rows = 0
+        # Buffered output up to the last `advance`; anything after it is an item still in progress.
+        self._advanced_chunks = 0
+        self._advanced_rows = 0
+
+    def _clear_directory(self):
+        """Removes every committed shard and marker."""
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+
+    def restart(self):
+        """Discards all progress, committed or not, so the stage starts again from its first item."""
+        self._reset()
+        self._clear_directory()
+        self.resumed_from = 0
+
+    def _resume(self) -> bool:
+        """Loads the committed progress of a matching earlier run; returns False if there is none."""
+        progress_path = os.path.join(self.directory, PROGRESS_NAME)
+        progress = None
+        if os.path.isfile(progress_path):
+            with open(progress_path, "r", encoding="utf-8") as f:
+                progress = json.load(f)
+        if progress is None or progress.get("version") != CHECKPOINT_VERSION or progress.get("key") != self.key:
+            return False
+        self.position = progress["position"]
+        self.num_rows = progress["num_rows"]
+        self.shards = progress["shards"]
+        self.items_digest = progress.get("items_digest", "")
+        # Shards written after the last committed marker are not part of the checkpoint.
+        committed = {shard["file"] for shard in self.shards} | {PROGRESS_NAME}
+        for name in os.listdir(self.directory):
+            if name not in committed:
+                os.remove(os.path.join(self.directory, name))
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.finalize()
+        else:
+            # Keep the work of every finished item; the item in progress is redone.
+            del self._pending[self._advanced_chunks:]
+            self._pending_rows = self._advanced_rows
+            self.commit()
+
+    @property
+    def rows_written(self) -> int:
+        """All rows written so far, committed or not, including those of earlier runs."""
+        return self.num_rows + self._pending_rows
+
+    def write_records(self, records: List[Dict]):
+        """Buffers a list of record dicts."""
+        if records:
+            self._pending.append("".join(json.dumps(record) + "\n" for record in records))
+            self._pending_rows += len(records)
+
+    def write_jsonl(self, text: str):
+        """Buffers records that are already JSONL text."""
+        if text:
+            self._pending.append(text)
+            self._pending_rows += text.count("\n")
+
+    def write_frame(self, df: pd.DataFrame):
+        """Buffers a DataFrame's rows."""
+        if len(df) > 0:
+            self.write_jsonl(df.to_json(orient="records", lines=True))
+
+    def advance(self, items: int = 1, item: Optional[str] = None) -> bool:
+        """
+        Marks `items` more input items as fully written; commits if one is due and returns
+        whether it did. `item` names a single finished item for the listing digest.
+        """
+        self.position += items
+        if item is not None:
+            self.items_digest = chain_digest(self.items_digest, item)
+        self._advanced_chunks = len(self._pending)
+        self._advanced_rows = self._pending_rows
+        if self._pending_rows >= self.rows_per_commit or time.monotonic() - self._last_commit >= self.commit_interval:
+            self.commit()
+            return True
+        return False
+
+    def commit(self):
+        """Makes the buffered output and the current position durable."""
+        if self.on_commit is not None:
+            self.on_commit()
+        if self._pending:
+            name = f"part-{len(self.shards):05d}.jsonl"
+            atomic_write(os.path.join(self.directory, name), "".join(self._pending))
+            self.shards.append({"file": name, "num_rows": self._pending_rows})
+            self.num_rows += self._pending_rows
+        progress = {
+            "version": CHECKPOINT_VERSION,
+            "key": self.key,
+            "position": self.position,
+            "num_rows": self.num_rows,
+            "shards": self.shards,
+            "items_digest": self.items_digest,
+        }
+        atomic_write(os.path.join(self.directory, PROGRESS_NAME), json.dumps(progress, indent=2))
+        self._pending = []
+        self._pending_rows = 0
+        self._advanced_chunks = 0
+        self._advanced_rows = 0
+        self._last_commit = time.monotonic()
+
+    def matches_items(self, items: Iterable[str]) -> bool:
+        """Returns whether `items` are, in order, the items named by the committed progress."""
+        digest = ""
+        count = 0
+        for item in items:
+            digest = chain_digest(digest, item)
+            count += 1
+        return count == self.position and digest == self.items_digest
+
+    def finalize(self) -> int:
+        """Commits, writes the whole checkpoint to the stage output, removes the checkpoint and returns the row count."""
+        self.commit()
+        with open_writer(self.output_path, self.fmt, rows_per_shard=self.rows_per_shard) as writer:
+            for shard in self.shards:
+                with open(os.path.join(self.directory, shard["file"]), "r", encoding="utf-8") as f:
+                    writer.write_jsonl(f.read())
+        shutil.rmtree(self.directory)
+        return self.num_rows
+
+
+def open_stage_output(
+    output_path: str,
+    fmt: str = "jsonl",
+    rows_per_shard: int = DEFAULT_ROWS_PER_SHARD,
+    key: str = "",
+    checkpoint_config: Optional[Dict] = None,
+):
+    """
+    Opens a stage's output: a resumable StageCheckpoint if the 'checkpoint' config
+    section enables it, else a plain writer that starts over on every run.
+    """
+    checkpoint_config = checkpoint_config or {}
+    if not checkpoint_config.get("enabled", False):
+        return open_writer(output_path, fmt, rows_per_shard=rows_per_shard)
+    return StageCheckpoint(
+        output_path,
+        fmt,
+        rows_per_shard=rows_per_shard,
+        key=key,
+        rows_per_commit=checkpoint_config.get("rows_per_commit", 5000),
+        commit_interval=checkpoint_config.get("commit_interval_seconds", 60.0),
+    )
@@ -0,0 +1,195 @@
+import ast
+import functools
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# How chunk sizes are measured: 'estimate' (about four characters per token) or
+# 'tokenizer' (the real tokenizer named by tokenizer_name).
+TOKEN_COUNTERS = ("estimate", "tokenizer")
+
+TokenCounter = Callable[[str], int]
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheaply estimates the number of tokens in a text (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+@functools.lru_cache(maxsize=None)
+def _load_tokenizer(tokenizer_name: str):
+    """Loads a tokenizer once per process (worker processes each load their own)."""
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(tokenizer_name)
+
+
+def make_token_counter(token_counter: str = "estimate", tokenizer_name: Optional[str] = None) -> TokenCounter:
+    """Returns a function counting the tokens of a text with the estimate or the real tokenizer."""
+    if token_counter == "estimate":
+        return estimate_tokens
+    if token_counter == "tokenizer":
+        if not tokenizer_name:
+            raise ValueError("token_counter 'tokenizer' needs a tokenizer_name.")
+        tokenizer = _load_tokenizer(tokenizer_name)
+        return lambda text: len(tokenizer(text, add_special_tokens=False)["input_ids"])
+    raise ValueError(f"Unknown token counter '{token_counter}'. Expected one of {TOKEN_COUNTERS}.")
+
+
+class Piece(NamedTuple):
+    """
+    A run of source to emit as one chunk.
+
+    kind is 'group' for consecutive sibling `statements`, or 'prefix' for the compound
+    statement `node` (possibly the function itself) cut after its first body
+    `statements`. Those may sit in a nested block: when a compound statement's first
+    body statement is itself too large, the prefix runs down through that
+    statement's header too. `path` describes the enclosing blocks, outermost first.
+    """
+    kind: str
+    node: Optional[ast.AST]
+    statements: Tuple[ast.stmt, ...]
+    path: Tuple[str, ...]
+
+
+_BRANCH_FIELDS = ("body", "orelse", "handlers", "cases", "finalbody")
+
+
+def head_nodes(node: ast.AST) -> List[ast.AST]:
+    """Returns the parts of a compound statement outside its nested blocks (decorators, arguments, test, ...)."""
+    parts = []
+    for field, value in ast.iter_fields(node):
+        if field in _BRANCH_FIELDS:
+            continue
+        if isinstance(value, ast.AST):
+            parts.append(value)
+        elif isinstance(value, list):
+            parts.extend(item for item in value if isinstance(item, ast.AST))
+    return parts
+
+
+def statement_lists(node: ast.AST) -> List[Tuple[str, List[ast.stmt]]]:
+    """
+    Returns the (branch, statements) lists nested directly inside a compound statement,
+    in source order. The first list directly follows the statement's header.
+    """
+    lists = []
+    body = getattr(node, "body", None)
+    if isinstance(body, list):
+        lists.append(("", body))
+    if getattr(node, "orelse", None):
+        lists.append(("else branch", node.orelse))
+    for handler in getattr(node, "handlers", None) or ():
+        lists.append(("except branch", handler.body))
+    for case in getattr(node, "cases", None) or ():
+        lists.append(("case branch", case.body))
+    if getattr(node, "finalbody", None):
+        lists.append(("finally branch", node.finalbody))
+    return lists
+
+
+def prefix_heads(piece: Piece) -> List[ast.AST]:
+    """Returns the header parts (see head_nodes) of every compound statement a prefix piece opens."""
+    heads = []
+    node = piece.node
+    while node is not None:
+        heads.extend(head_nodes(node))
+        if isinstance(node, ast.Match):
+            heads.extend(head_nodes(node.cases[0]))
+        first = statement_lists(node)[0][1][0]
+        node = None if first is piece.statements[0] else first
+    return heads
+
+
+class TokenBudgetChunker:
+    """
+    Splits a function into pieces of at most `budget` tokens that together cover all of it.
+
+    Adjacent statements are grouped while they fit. A statement too large on its own
+    is split recursively into its nested blocks: the statement is cut after as many
+    leading body statements as fit (keeping its header line, e.g. the function
+    signature or the `for` line), the rest of its body and its else/except/finally
+    branches are split in turn. A header is never dropped: when not even the first
+    body statement fits beside it, the prefix takes that statement anyway, or, if it
+    is a compound statement, continues through its header into its own first
+    statements. Every piece is complete statements, so it parses on its own once
+    dedented, except the start of a `try` block, whose handlers follow in later pieces. Only a simple statement larger than the budget, with the headers above
+    it, yields a piece over the budget. Piece sizes are the sum of their statements'
+    token counts at the piece's indentation, an upper bound for the estimate and
+    close for real tokenizers.
+    """
+
+    def __init__(self, index, count_tokens: TokenCounter, budget: int):
+        self.index = index
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self._costs: Dict[Tuple[int, int], int] = {}
+
+    def cost(self, node: ast.AST, base_col: Optional[int] = None) -> int:
+        """
+        Returns the token count of a statement (and its line break) in a piece dedented
+        to `base_col` (its own column by default), measured once. Summing these gives
+        an upper bound of the estimated size of a piece.
+        """
+        if base_col is None:
+            base_col = node.col_offset
+        key = (id(node), base_col)
+        if key not in self._costs:
+            self._costs[key] = self.count_tokens(self.index.relative_segment(node, base_col) + "\n")
+        return self._costs[key]
+
+    def split(self, node: ast.AST) -> List[Piece]:
+        """Returns the pieces of a function (or any compound statement)."""
+        return list(self._split_compound(node, (), root=True))
+
+    def _split_compound(
+        self,
+        node: ast.AST,
+        path: Tuple[str, ...],
+        root: bool = False,
+        outer: Optional[Tuple[ast.AST, Tuple[str, ...]]] = None,
+    ) -> Iterator[Piece]:
+        """
+        Splits an oversized compound statement into a prefix piece and its nested blocks.
+        `outer` is the (statement, path) whose headers the prefix must start from, when
+        `node` is the first body statement of an enclosing prefix that fitted nothing.
+        """
+        start, start_path = outer or (node, path)
+        label = f"'{type(node).__name__}' block"
+        lists = statement_lists(node)
+        branch, body = lists[0]
+        inner = path if root else path + (f"{label} ({branch})" if branch else label,)
+        total = self.count_tokens(self.index.head(start, body[0]))
+        count = 0
+        while count < len(body) and total + self.cost(body[count], start.col_offset) <= self.budget:
+            total += self.cost(body[count], start.col_offset)
+            count += 1
+        if count:
+            yield Piece("prefix", start, tuple(body[:count]), start_path)
+        elif statement_lists(body[0]):
+            yield from self._split_compound(body[0], inner, outer=(start, start_path))
+            count = 1
+        else:
+            yield Piece("prefix", start, (body[0],), start_path)
+            count = 1
+        yield from self._split_statements(body[count:], inner)
+        for branch, statements in lists[1:]:
+            yield from self._split_statements(statements, path + (f"{label} ({branch})",))
+
+    def _split_statements(self, statements: List[ast.stmt], path: Tuple[str, ...]) -> Iterator[Piece]:
+        """Groups sibling statements up to the budget, recursing into any that are too large alone."""
+        group: List[ast.stmt] = []
+        total = 0
+        for statement in statements:
+            cost = self.cost(statement)
+            if cost > self.budget and statement_lists(statement):
+                if group:
+                    yield Piece("group", None, tuple(group), path)
+                    group, total = [], 0
+                yield from self._split_compound(statement, path)
+                continue
+            if group and total + cost > self.budget:
+                yield Piece("group", None, tuple(group), path)
+                group, total = [], 0
+            group.append(statement)
+            total += cost
+        if group:
+            yield Piece("group", None, tuple(group), path)
@@ -0,0 +1,333 @@
+import os
+import json
+import shutil
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# 'jsonl' keeps the original one-file text hand-off between stages. The columnar
+# formats write a directory of shards plus a manifest: 'arrow' shards are Arrow IPC
+# streams (the layout `datasets` memory-maps), 'parquet' shards are compressed Parquet.
+INTERMEDIATE_FORMATS = ("jsonl", "arrow", "parquet")
+COLUMNAR_FORMATS = ("arrow", "parquet")
+
+MANIFEST_NAME = "_manifest.json"
+MANIFEST_VERSION = 1
+DEFAULT_ROWS_PER_SHARD = 100_000
+
+
+def stage_path(path: str, fmt: str) -> str:
+    """
+    Returns where a stage's data lives in the given format.
+
+    JSONL uses the configured path as is; a columnar dataset is a directory next to
+    it with the format as extension, e.g. `extracted_pairs.jsonl` -> `extracted_pairs.arrow/`.
+    """
+    if fmt not in INTERMEDIATE_FORMATS:
+        raise ValueError(f"Unknown intermediate format '{fmt}'. Expected one of {INTERMEDIATE_FORMATS}.")
+    if fmt == "jsonl":
+        return path
+    return os.path.splitext(path)[0] + "." + fmt
+
+
+def is_columnar(path: str) -> bool:
+    """Checks whether `path` is a columnar dataset directory with a manifest."""
+    return os.path.isfile(os.path.join(path, MANIFEST_NAME))
+
+
+def read_manifest(path: str) -> Dict:
+    """Reads the manifest of a columnar dataset."""
+    with open(os.path.join(path, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def shard_paths(path: str) -> List[str]:
+    """Returns the shard files of a columnar dataset, in row order."""
+    return [os.path.join(path, shard["file"]) for shard in read_manifest(path)["shards"]]
+
+
+def _parse_type(name: str) -> Optional[pa.DataType]:
+    """Parses a type as recorded in a manifest's "columns", or returns None if it is not a simple type."""
+    for prefix, make in (("list<", pa.list_), ("large_list<", pa.large_list)):
+        if name.startswith(prefix) and name.endswith(">"):
+            item = _parse_type(name[len(prefix):-1].split(": ", 1)[-1])
+            return make(item) if item is not None else None
+    try:
+        return pa.type_for_alias(name)
+    except ValueError:
+        return None
+
+
+def _conform_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """Casts a table to `schema`, filling columns it lacks with nulls."""
+    if table.schema == schema:
+        return table
+    columns = [
+        table.column(field.name).cast(field.type) if field.name in table.column_names else pa.nulls(table.num_rows, field.type)
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+class ShardedWriter:
+    """
+    Writes records to a columnar dataset directory in shards of `rows_per_shard` rows.
+
+    Rows are buffered per shard and written column-wise. The manifest (format, schema,
+    shard files and row counts) is written last on close, so a crashed write never
+    looks like a complete dataset. An existing dataset at `path` is replaced.
+
+    The manifest also indexes each shard's first row. With a `length_column` it also
+    records each shard's minimum and maximum of that column and its sum, so a
+    loader can plan batches without opening the shards. Extra top-level manifest
+    entries can be set in `metadata`.
+
+    Tables need not share a schema: the dataset's schema is the permissive union of
+    all of them, so a column that was all null or missing in earlier tables is
+    widened or filled with nulls. Shards written before a widening are cast to the
+    manifest's schema when read.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fmt: str = "arrow",
+        rows_per_shard: int = DEFAULT_ROWS_PER_SHARD,
+        length_column: Optional[str] = None,
+    ):
+        if fmt not in COLUMNAR_FORMATS:
+            raise ValueError(f"Unknown columnar format '{fmt}'. Expected one of {COLUMNAR_FORMATS}.")
+        self.path = path
+        self.fmt = fmt
+        self.rows_per_shard = rows_per_shard
+        self.length_column = length_column
+        self.metadata: Dict = {}
+        self.num_rows = 0
+        self.schema: Optional[pa.Schema] = None
+        self.shards: List[Dict] = []
+        self._pending: List[pa.Table] = []
+        self._pending_rows = 0
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    def write_table(self, table: pa.Table):
+        """Appends an Arrow table, flushing full shards."""
+        if table.num_rows == 0:
+            return
+        if self.schema is None:
+            self.schema = table.schema
+        elif table.schema != self.schema:
+            schema = pa.unify_schemas([self.schema, table.schema], promote_options="permissive")
+            if schema != self.schema:
+                self.schema = schema
+                self._pending = [_conform_table(pending, schema) for pending in self._pending]
+            table = _conform_table(table, self.schema)
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+        self.num_rows += table.num_rows
+        while self._pending_rows >= self.rows_per_shard:
+            combined = pa.concat_tables(self._pending)
+            self._write_shard(combined.slice(0, self.rows_per_shard))
+            rest = combined.slice(self.rows_per_shard)
+            self._pending = [rest] if rest.num_rows else []
+            self._pending_rows = rest.num_rows
+
+    def write_frame(self, df: pd.DataFrame):
+        """Appends a DataFrame's rows."""
+        self.write_table(pa.Table.from_pandas(df, preserve_index=False))
+
+    def write_records(self, records: List[Dict]):
+        """Appends a list of record dicts."""
+        if records:
+            self.write_table(pa.Table.from_pylist(records))
+
+    def write_jsonl(self, text: str):
+        """Appends records given as JSONL text, e.g. carried forward from a JSONL cache."""
+        self.write_records([json.loads(line) for line in text.splitlines() if line])
+
+    def _write_shard(self, table: pa.Table):
+        """Writes one shard file and records it for the manifest."""
+        name = f"part-{len(self.shards):05d}.{self.fmt}"
+        shard_path = os.path.join(self.path, name)
+        if self.fmt == "parquet":
+            pq.write_table(table, shard_path)
+        else:
+            with pa.OSFile(shard_path, 'wb') as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+        shard = {"file": name, "num_rows": table.num_rows, "first_row": sum(entry["num_rows"] for entry in self.shards)}
+        if self.length_column is not None:
+            lengths = table.column(self.length_column)
+            bounds = pc.min_max(lengths).as_py()
+            shard.update({"min_length": bounds["min"], "max_length": bounds["max"], "total_length": pc.sum(lengths).as_py()})
+        self.shards.append(shard)
+
+    def close(self):
+        """Flushes the last partial shard and writes the manifest."""
+        if self._pending:
+            self._write_shard(pa.concat_tables(self._pending))
+            self._pending = []
+            self._pending_rows = 0
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "format": self.fmt,
+            "num_rows": self.num_rows,
+            "columns": {field.name: str(field.type) for field in self.schema} if self.schema is not None else {},
+            "shards": self.shards,
+            **self.metadata,
+        }
+        with open(os.path.join(self.path, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+
+class JsonlWriter:
+    """Writes records to a single JSONL file with the same interface as ShardedWriter."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.num_rows = 0
+        self._out = open(path, 'w', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_frame(self, df: pd.DataFrame):
+        """Appends a DataFrame's rows."""
+        if len(df) > 0:
+            self._out.write(df.to_json(orient='records', lines=True))
+            self.num_rows += len(df)
+
+    def write_records(self, records: List[Dict]):
+        """Appends a list of record dicts."""
+        self._out.write("".join(json.dumps(record) + "\n" for record in records))
+        self.num_rows += len(records)
+
+    def write_jsonl(self, text: str):
+        """Appends records that are already JSONL text."""
+        self._out.write(text)
+        self.num_rows += text.count("\n")
+
+    def close(self):
+        """Closes the output file."""
+        self._out.close()
+
+
+def open_writer(path: str, fmt: str = "jsonl", rows_per_shard: int = DEFAULT_ROWS_PER_SHARD):
+    """Opens a writer for a stage's output at `stage_path(path, fmt)`."""
+    target = stage_path(path, fmt)
+    directory = os.path.dirname(target)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if fmt == "jsonl":
+        return JsonlWriter(target)
+    return ShardedWriter(target, fmt, rows_per_shard=rows_per_shard)
+
+
+def _read_shard(shard_path: str, fmt: str, columns: Optional[List[str]]) -> pa.Table:
+    """Reads one shard memory-mapped, keeping those of `columns` it has."""
+    if fmt == "parquet":
+        if columns is not None:
+            names = pq.read_schema(shard_path, memory_map=True).names
+            columns = [name for name in columns if name in names]
+        return pq.read_table(shard_path, columns=columns, memory_map=True)
+    # Buffers of an IPC stream read from a memory map point into the map, so
+    # selecting columns does not copy any data.
+    table = pa.ipc.open_stream(pa.memory_map(shard_path, 'r')).read_all()
+    return table.select([name for name in columns if name in table.column_names]) if columns is not None else table
+
+
+def _column_types(manifest: Dict, columns: Optional[List[str]]) -> Dict[str, Optional[pa.DataType]]:
+    """
+    Returns the manifest's type of each of `columns` (default: all).
+
+    Types that do not parse back from the manifest are None and keep the type the
+    shard has. If nothing was ever written the manifest has no columns, and the
+    requested ones are strings.
+    """
+    recorded = manifest["columns"]
+    if columns is None:
+        columns = list(recorded)
+    elif not recorded:
+        return {name: pa.string() for name in columns}
+    return {name: _parse_type(recorded[name]) for name in columns}
+
+
+def iter_tables(path: str, columns: Optional[List[str]] = None) -> Iterator[pa.Table]:
+    """Yields a columnar dataset shard by shard, each cast to the manifest's schema."""
+    manifest = read_manifest(path)
+    types = _column_types(manifest, columns)
+    for shard in manifest["shards"]:
+        table = _read_shard(os.path.join(path, shard["file"]), manifest["format"], columns)
+        schema = pa.schema([
+            (name, column_type if column_type is not None else table.schema.field(name).type if name in table.column_names else pa.string())
+            for name, column_type in types.items()
+        ])
+        yield _conform_table(table, schema)
+
+
+def read_table(path: str, columns: Optional[List[str]] = None) -> pa.Table:
+    """Reads a whole columnar dataset as one Arrow table (shards are concatenated without copying)."""
+    tables = list(iter_tables(path, columns))
+    if not tables:
+        types = _column_types(read_manifest(path), columns)
+        return pa.schema([(name, column_type or pa.string()) for name, column_type in types.items()]).empty_table()
+    return pa.concat_tables(tables)
+
+
+def resolve_input(path: str) -> str:
+    """
+    Finds a stage's input: the configured JSONL path, or a columnar dataset next to it.
+
+    A downstream stage therefore reads whatever format the upstream stage wrote.
+    If both exist, the more recently written one wins.
+    """
+    candidates = [stage_path(path, fmt) for fmt in INTERMEDIATE_FORMATS]
+    existing = [p for p in candidates if (is_columnar(p) if p != path else os.path.isfile(p))]
+    if not existing:
+        return path
+    return max(existing, key=lambda p: os.path.getmtime(os.path.join(p, MANIFEST_NAME) if p != path else p))
+
+
+def read_frame(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Reads a stage's data (JSONL or columnar) into a DataFrame."""
+    source = resolve_input(path)
+    if is_columnar(source):
+        return read_table(source, columns).to_pandas()
+    df = pd.read_json(source, lines=True)
+    if columns is None:
+        return df
+    # An empty JSONL file reads as a frame without columns.
+    return df[columns] if len(df.columns) else pd.DataFrame(columns=columns)
+
+
+def iter_frames(path: str, batch_size: int, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """Reads a stage's data (JSONL or columnar) in DataFrames of at most `batch_size` rows."""
+    source = resolve_input(path)
+    if not is_columnar(source):
+        with pd.read_json(source, lines=True, chunksize=batch_size) as reader:
+            for df in reader:
+                yield df[columns] if columns is not None else df
+        return
+    for table in iter_tables(source, columns):
+        for start in range(0, table.num_rows, batch_size):
+            yield table.slice(start, batch_size).to_pandas()
+
+
+def write_frame(df: pd.DataFrame, path: str, fmt: str = "jsonl", rows_per_shard: int = DEFAULT_ROWS_PER_SHARD) -> str:
+    """Writes a DataFrame as a stage's output and returns where it was written."""
+    with open_writer(path, fmt, rows_per_shard=rows_per_shard) as writer:
+        writer.write_frame(df)
+    return stage_path(path, fmt)
@@ -0,0 +1,222 @@
+import os
+import json
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from data_pipeline.columnar import is_columnar, read_manifest
+from data_pipeline.dedup import mix64
+
+# Columns the statistics read; any others (the text columns) are never touched.
+STAT_COLUMNS = ("input_ids", "attention_mask", "length", "document_lengths")
+LENGTH_QUANTILES = (0.5, 0.9, 0.99)
+# Multiplier seeding the per-position weights of the sequence hash.
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def dataset_shards(path: str) -> Tuple[str, List[str]]:
+    """
+    Returns the (format, shard files) of a dataset on disk: a columnar dataset with a
+    manifest (e.g. data.ordered_path) or a `datasets.save_to_disk` directory (e.g.
+    data.tokenized_path), whose data files are Arrow IPC streams.
+    """
+    if is_columnar(path):
+        manifest = read_manifest(path)
+        return manifest["format"], [os.path.join(path, shard["file"]) for shard in manifest["shards"]]
+    state_path = os.path.join(path, "state.json")
+    if not os.path.isfile(state_path):
+        raise FileNotFoundError(f"{path} is neither a columnar dataset nor a saved `datasets` dataset.")
+    with open(state_path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    return "arrow", [os.path.join(path, entry["filename"]) for entry in state["_data_files"]]
+
+
+def iter_shard_batches(shard_path: str, fmt: str, columns: Optional[List[str]] = None) -> Iterator[pa.RecordBatch]:
+    """
+    Yields a shard's record batches, keeping only `columns`. Arrow shards are
+    memory-mapped, so a batch's buffers point into the file and nothing is copied;
+    Parquet shards are decoded one row group at a time.
+    """
+    if fmt == "parquet":
+        yield from pq.ParquetFile(shard_path, memory_map=True).iter_batches(columns=columns)
+        return
+    for batch in pa.ipc.open_stream(pa.memory_map(shard_path, 'r')):
+        yield batch.select(columns) if columns is not None else batch
+
+
+def _segment_sums(values: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Sums consecutive runs of `values` of the given lengths (empty runs sum to 0), wrapping like the dtype."""
+    if len(values) and np.all(lengths == lengths[0]):
+        # Fixed-length runs (rows padded to max_length) sum as the rows of a 2-D view.
+        return values.reshape(len(lengths), -1).sum(axis=1, dtype=values.dtype)
+    totals = np.zeros(len(values) + 1, dtype=values.dtype)
+    np.cumsum(values, out=totals[1:])
+    ends = np.cumsum(lengths)
+    return totals[ends] - totals[ends - lengths]
+
+
+class _PositionWeights:
+    """Random odd 64-bit weights per position in a sequence, grown as longer sequences appear."""
+
+    def __init__(self):
+        self.weights = np.zeros(0, dtype=np.uint64)
+
+    def __getitem__(self, positions: np.ndarray) -> np.ndarray:
+        needed = int(positions.max()) + 1 if len(positions) else 0
+        if needed > len(self.weights):
+            size = max(needed, 2 * len(self.weights), 1024)
+            self.weights = mix64((np.arange(size, dtype=np.uint64) + np.uint64(1)) * _GOLDEN) | np.uint64(1)
+        return self.weights[positions]
+
+
+def sequence_hashes(column: pa.Array, weights: Optional[_PositionWeights] = None) -> np.ndarray:
+    """
+    Returns a 64-bit hash of each token list in a list column, without building a
+    Python list per row.
+
+    A row hashes to the sum of its tokens times a random weight per position, mixed
+    with its length, all in vectorized uint64 arithmetic (one multiply and a running
+    sum per token). Equal rows get equal hashes; different rows collide with
+    probability around 2^-64.
+    """
+    weights = weights if weights is not None else _PositionWeights()
+    lengths = pc.list_value_length(column).fill_null(0).to_numpy(zero_copy_only=False).astype(np.int64)
+    tokens = pc.list_flatten(column).to_numpy(zero_copy_only=False).astype(np.uint64)
+    if len(tokens) and np.all(lengths == lengths[0]):
+        # Fixed-length rows (padded to max_length) need no per-token position index.
+        sums = _segment_sums((tokens.reshape(len(lengths), -1) * weights[np.arange(lengths[0])]).ravel(), lengths)
+    else:
+        starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.arange(len(tokens), dtype=np.int64) - starts
+        sums = _segment_sums(tokens * weights[positions], lengths)
+    return mix64(sums ^ mix64(lengths.astype(np.uint64)))
+
+
+class DatasetStats:
+    """
+    Accumulates statistics over a tokenized dataset batch by batch, from the Arrow
+    columns only:
+
+    - a histogram of example token lengths (the `length` column, or the
+      attention_mask / input_ids lengths; the packed documents' `document_lengths`
+      for a packed dataset), with exact quantiles from a count per length;
+    - the padding ratio, the share of `attention_mask` slots that are 0;
+    - the truncation rate, the share of examples whose length reaches `max_length`
+      (tokenization cut them there);
+    - the duplicate rate, the share of rows whose `input_ids` hash equals an earlier row's;
+    - rows, real tokens and bytes on disk per shard.
+
+    Memory grows with one 8-byte hash per row and one counter per distinct length.
+    """
+
+    def __init__(self, max_length: Optional[int] = None, bin_width: Optional[int] = None, duplicates: bool = True):
+        self.max_length = max_length
+        self.bin_width = bin_width or max(1, (max_length or 512) // 16)
+        self.duplicates = duplicates
+        self.rows = 0
+        self.length_counts = np.zeros(0, dtype=np.int64)
+        self.length_unit = "rows"
+        self.mask_tokens = 0
+        self.mask_slots = 0
+        self.shards: List[Dict] = []
+        self._hashes: List[np.ndarray] = []
+        self._weights = _PositionWeights()
+
+    def start_shard(self, shard_path: str):
+        """Starts counting rows and tokens towards a new shard."""
+        self.shards.append({"file": os.path.basename(shard_path), "bytes": os.path.getsize(shard_path), "rows": 0, "tokens": 0})
+
+    def add(self, batch: pa.RecordBatch):
+        """Adds the next record batch of the current shard."""
+        names = batch.schema.names
+        lengths = None
+        if "length" in names:
+            lengths = batch.column("length").to_numpy(zero_copy_only=False).astype(np.int64)
+        if "attention_mask" in names:
+            mask = batch.column("attention_mask")
+            mask_lengths = pc.list_value_length(mask).fill_null(0).to_numpy(zero_copy_only=False).astype(np.int64)
+            real = _segment_sums(pc.list_flatten(mask).to_numpy(zero_copy_only=False).astype(np.int64), mask_lengths)
+            self.mask_tokens += int(real.sum())
+            self.mask_slots += int(mask_lengths.sum())
+            lengths = real if lengths is None else lengths
+        if lengths is None and "input_ids" in names:
+            lengths = pc.list_value_length(batch.column("input_ids")).fill_null(0).to_numpy(zero_copy_only=False).astype(np.int64)
+        if lengths is None:
+            lengths = np.zeros(batch.num_rows, dtype=np.int64)
+
+        examples = lengths
+        if "document_lengths" in names:
+            self.length_unit = "documents"
+            examples = pc.list_flatten(batch.column("document_lengths")).to_numpy(zero_copy_only=False).astype(np.int64)
+        counts = np.bincount(examples, minlength=len(self.length_counts)) if len(examples) else np.zeros(0, dtype=np.int64)
+        if len(counts) > len(self.length_counts):
+            self.length_counts = np.pad(self.length_counts, (0, len(counts) - len(self.length_counts)))
+        self.length_counts[:len(counts)] += counts
+
+        if self.duplicates and "input_ids" in names:
+            self._hashes.append(sequence_hashes(batch.column("input_ids"), self._weights))
+        self.rows += batch.num_rows
+        if self.shards:
+            self.shards[-1]["rows"] += batch.num_rows
+            self.shards[-1]["tokens"] += int(lengths.sum())
+
+    def length_summary(self) -> Dict:
+        """Count, mean, min, quantiles, max and histogram of the example lengths."""
+        counts = self.length_counts
+        total = int(counts.sum())
+        if not total:
+            return {"unit": self.length_unit, "count": 0}
+        values = np.arange(len(counts))
+        cumulative = np.cumsum(counts)
+        summary = {
+            "unit": self.length_unit,
+            "count": total,
+            "mean": float((values * counts).sum() / total),
+            "min": int(np.flatnonzero(counts)[0]),
+        }
+        for q in LENGTH_QUANTILES:
+            summary[f"p{round(q * 100)}"] = int(np.searchsorted(cumulative, q * total))
+        summary["max"] = int(np.flatnonzero(counts)[-1])
+        bins = -(-len(counts) // self.bin_width)
+        padded = np.pad(counts, (0, bins * self.bin_width - len(counts)))
+        summary["histogram"] = {"bin_width": self.bin_width, "counts": padded.reshape(bins, self.bin_width).sum(axis=1).tolist()}
+        return summary
+
+    def report(self) -> Dict:
+        """Returns all statistics as a JSON-serializable dict."""
+        report = {"rows": self.rows, "shards": self.shards, "lengths": self.length_summary()}
+        report["padding_ratio"] = 1 - self.mask_tokens / self.mask_slots if self.mask_slots else None
+        if self.max_length:
+            examples = int(self.length_counts.sum())
+            truncated = int(self.length_counts[self.max_length:].sum())
+            report["truncation"] = {"max_length": self.max_length, "truncated": truncated,
+                                    "rate": truncated / examples if examples else 0.0}
+        if self.duplicates and self._hashes:
+            hashes = np.concatenate(self._hashes)
+            duplicates = len(hashes) - len(np.unique(hashes))
+            report["duplicates"] = {"duplicate_rows": duplicates, "rate": duplicates / len(hashes)}
+        return report
+
+
+def dataset_statistics(
+    path: str,
+    max_length: Optional[int] = None,
+    bin_width: Optional[int] = None,
+    duplicates: bool = True,
+) -> Dict:
+    """Computes DatasetStats over every shard of the dataset at `path`, reading only the statistics columns."""
+    fmt, shards = dataset_shards(path)
+    stats = DatasetStats(max_length=max_length, bin_width=bin_width, duplicates=duplicates)
+    for shard_path in shards:
+        stats.start_shard(shard_path)
+        schema_names = (pq.read_schema(shard_path) if fmt == "parquet"
+                        else pa.ipc.open_stream(pa.memory_map(shard_path, 'r')).schema).names
+        columns = [name for name in STAT_COLUMNS if name in schema_names]
+        for batch in iter_shard_batches(shard_path, fmt, columns):
+            stats.add(batch)
+    report = stats.report()
+    report["path"] = path
+    return report
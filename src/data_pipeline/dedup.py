@@ -0,0 +1,228 @@
+import re
+import hashlib
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Multiplier combining consecutive token hashes into a shingle hash.
+_SHINGLE_MULTIPLIER = np.uint64(1_000_003)
+# Shingles permuted at once, bounding the (num_perm x shingles) scratch array.
+_SHINGLE_BLOCK = 8192
+
+# String literals are kept whole so a '#' inside one is not mistaken for a comment;
+# comments match outside the group and come back as empty strings.
+_TOKEN = re.compile(
+    r'#[^\n]*|("""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|\w+|[^\w\s])'
+)
+
+
+def code_tokens(code: str) -> List[str]:
+    """Splits code into identifier, literal and punctuation tokens, dropping comments and whitespace."""
+    return list(filter(None, _TOKEN.findall(code)))
+
+
+def content_hash(tokens: Sequence[str]) -> int:
+    """Returns a 64-bit hash of a token sequence, equal for code differing only in layout or comments."""
+    digest = hashlib.blake2b("\x00".join(tokens).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def lsh_params(threshold: float, num_perm: int, false_positive_weight: float = 0.5) -> Tuple[int, int]:
+    """
+    Returns the (bands, rows) split of `num_perm` MinHash values whose banding best
+    separates pairs above and below the Jaccard `threshold`.
+
+    Two records share a band with probability 1 - (1 - s^rows)^bands at similarity s.
+    The split minimizes the weighted area of false positives below the threshold and
+    false negatives above it.
+    """
+    # Midpoints of 200 equal steps on each side of the threshold.
+    below = (np.arange(200) + 0.5) / 200 * threshold
+    above = threshold + (np.arange(200) + 0.5) / 200 * (1 - threshold)
+    best, best_error = (1, num_perm), np.inf
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        false_positives = np.mean(1 - (1 - below ** rows) ** bands) * threshold
+        false_negatives = np.mean((1 - above ** rows) ** bands) * (1 - threshold)
+        error = false_positive_weight * false_positives + (1 - false_positive_weight) * false_negatives
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+def mix64(x: np.ndarray) -> np.ndarray:
+    """Scrambles 64-bit values (the splitmix64 finalizer), so linear combinations hash evenly."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class MinHasher:
+    """
+    Computes the fingerprints the deduplicator compares: a normalized-content hash per
+    record and one LSH band key per band of its MinHash signature.
+
+    Code is tokenized without comments or whitespace and every token starts a shingle
+    of up to `shingle_size` tokens (cut short at the end of the record). The signature
+    holds the minimum of `num_perm` seeded multiply-shift hash permutations over the
+    shingles, and every `rows` consecutive values are hashed into one 64-bit band key.
+    A whole batch is hashed and permuted as flat numpy arrays rather than record by
+    record, and the object is small and picklable, so batches can be fingerprinted in
+    worker processes.
+    """
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        gen = np.random.RandomState(seed)
+        self.a = gen.randint(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = gen.randint(0, 1 << 63, size=num_perm, dtype=np.uint64)
+        self.row_weights = gen.randint(0, 1 << 63, size=self.rows, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.band_salts = gen.randint(0, 1 << 63, size=self.bands, dtype=np.uint64)
+
+    def shingles(self, token_lists: Sequence[List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the shingle hashes of a batch and the record each one belongs to."""
+        lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+        records = np.repeat(np.arange(len(token_lists)), lengths)
+        flat = np.array([token for tokens in token_lists for token in tokens], dtype=object)
+        # Each record is followed by shingle_size - 1 zeros, so no shingle spans two records.
+        pad = self.shingle_size - 1
+        padded = np.zeros(len(flat) + pad * len(token_lists) + 1, dtype=np.uint64)
+        positions = np.arange(len(flat)) + pad * records
+        padded[positions] = pd.util.hash_array(flat) if len(flat) else padded[:0]
+        hashes = np.zeros(len(flat), dtype=np.uint64)
+        for offset in range(self.shingle_size):
+            hashes = hashes * _SHINGLE_MULTIPLIER + padded[positions + offset]
+        return hashes, records
+
+    def signatures(self, token_lists: Sequence[List[str]]) -> np.ndarray:
+        """Returns the (records x num_perm) MinHash signatures of a batch of token sequences."""
+        hashes, records = self.shingles(token_lists)
+        signatures = np.full((len(token_lists), self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint64)
+        for start in range(0, len(hashes), _SHINGLE_BLOCK):
+            block = hashes[start:start + _SHINGLE_BLOCK]
+            owners = records[start:start + _SHINGLE_BLOCK]
+            permuted = (self.a[:, None] * block[None, :] + self.b[:, None]) >> np.uint64(32)
+            # Minimum over each run of shingles from the same record.
+            starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+            minima = np.minimum.reduceat(permuted, starts, axis=1).T
+            signatures[owners[starts]] = np.minimum(signatures[owners[starts]], minima)
+        return signatures
+
+    def band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """Hashes each band of a (records x num_perm) signature matrix into a (records x bands) key matrix."""
+        used = signatures[:, :self.bands * self.rows].reshape(len(signatures), self.bands, self.rows)
+        return mix64((used * self.row_weights).sum(axis=2, dtype=np.uint64) + self.band_salts)
+
+    def fingerprint(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the content hashes (records,) and LSH band keys (records x bands) of a batch of code."""
+        token_lists = [code_tokens(text) for text in texts]
+        hashes = np.fromiter((content_hash(tokens) for tokens in token_lists), dtype=np.uint64, count=len(texts))
+        return hashes, self.band_keys(self.signatures(token_lists))
+
+
+class SortedKeySet:
+    """
+    An append-only set of 64-bit keys held in sorted numpy arrays.
+
+    Keys are added in batches as sorted runs; a run is merged into the one before it
+    as soon as it is at least as large, so there are O(log n) runs and each key is
+    re-sorted O(log n) times. Lookups binary-search every run for a whole batch at
+    once. Memory is 8 bytes per key, with no per-key Python objects.
+    """
+
+    def __init__(self):
+        self.runs: List[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self.runs)
+
+    @property
+    def nbytes(self) -> int:
+        """The memory held by the keys."""
+        return sum(run.nbytes for run in self.runs)
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        """Returns a mask of the keys already in the set."""
+        found = np.zeros(keys.shape, dtype=bool)
+        for run in self.runs:
+            positions = np.minimum(np.searchsorted(run, keys), len(run) - 1)
+            found |= run[positions] == keys
+        return found
+
+    def add(self, keys: np.ndarray):
+        """Adds a batch of keys."""
+        run = np.unique(keys)
+        if len(run) == 0:
+            return
+        self.runs.append(run)
+        while len(self.runs) > 1 and len(self.runs[-2]) <= len(self.runs[-1]):
+            last = self.runs.pop()
+            self.runs[-1] = np.union1d(self.runs[-1], last)
+
+
+def _repeats_earlier_row(keys: np.ndarray) -> np.ndarray:
+    """Returns a mask of the rows of a key matrix that share a key with an earlier row of the same batch."""
+    if len(keys) == 0:
+        return np.zeros(0, dtype=bool)
+    flat = keys.reshape(-1)
+    _, first, inverse = np.unique(flat, return_index=True, return_inverse=True)
+    return (first[inverse] < np.arange(len(flat))).reshape(len(keys), -1).any(axis=1)
+
+
+class Deduplicator:
+    """
+    Streams records through exact and near-duplicate detection, keeping first occurrences.
+
+    A record is an exact duplicate if an earlier record has the same content hash, and
+    a near duplicate if it shares an LSH band key with any earlier record that was not
+    an exact duplicate (so near duplicates chain, as in a union-find over candidate
+    pairs). Decisions depend only on record order, not on how the stream is batched.
+    The index costs 8 bytes per record for the exact hashes plus 8 per band, so tens
+    of millions of records fit in a few GB.
+    """
+
+    def __init__(self, hasher: MinHasher, exact: bool = True, near_duplicates: bool = True):
+        self.hasher = hasher
+        self.exact = exact
+        self.near_duplicates = near_duplicates
+        self.exact_keys = SortedKeySet()
+        self.band_keys = SortedKeySet()
+        self.stats = {"records": 0, "exact_duplicates": 0, "near_duplicates": 0, "kept": 0}
+
+    def check(self, hashes: np.ndarray, band_keys: np.ndarray) -> np.ndarray:
+        """Returns the keep mask of a batch given its fingerprints, and adds the batch to the index."""
+        exact_dup = np.zeros(len(hashes), dtype=bool)
+        near_dup = np.zeros(len(hashes), dtype=bool)
+        if self.exact and len(hashes):
+            exact_dup = self.exact_keys.contains(hashes) | _repeats_earlier_row(hashes)
+            self.exact_keys.add(hashes)
+        if self.near_duplicates and len(hashes):
+            candidates = band_keys[~exact_dup]
+            near_dup[~exact_dup] = self.band_keys.contains(candidates).any(axis=1) | _repeats_earlier_row(candidates)
+            self.band_keys.add(candidates.reshape(-1))
+        keep = ~(exact_dup | near_dup)
+        self.stats["records"] += len(hashes)
+        self.stats["exact_duplicates"] += int(exact_dup.sum())
+        self.stats["near_duplicates"] += int(near_dup.sum())
+        self.stats["kept"] += int(keep.sum())
+        return keep
+
+    def keep_mask(self, texts: Sequence[str]) -> np.ndarray:
+        """Fingerprints a batch of code in this process and returns its keep mask."""
+        return self.check(*self.hasher.fingerprint(texts))
+
+    @property
+    def index_bytes(self) -> int:
+        """The memory held by the index."""
+        return self.exact_keys.nbytes + self.band_keys.nbytes
+
+    def summary(self) -> Dict[str, int]:
+        """Returns the counts so far plus the removed total and the index size."""
+        removed = self.stats["exact_duplicates"] + self.stats["near_duplicates"]
+        return {**self.stats, "removed": removed, "index_bytes": self.index_bytes}
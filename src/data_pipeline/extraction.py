@@ -0,0 +1,470 @@
+import ast
+import re
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from data_pipeline.chunking import Piece, TokenBudgetChunker, TokenCounter, make_token_counter, prefix_heads, statement_lists
+
+# Functions whose source spans more than this many bytes are split into chunks.
+OVERSIZED_FUNCTION_BYTES = 2 * 1024 * 1024
+
+# Separator placed between the file's context header and a function's source.
+CONTEXT_SEPARATOR = "\n\n"
+
+# Where a function's own source starts after the context header: a function (or a
+# chunk of one) begins with its decorators or its `def`, which no header line can.
+_FUNCTION_AFTER_HEADER = re.compile(re.escape(CONTEXT_SEPARATOR) + r"(?=@|def |async def )")
+
+FunctionNode = Union[ast.FunctionDef, ast.AsyncFunctionDef]
+
+_CONTEXT_NODE_TYPES = (ast.Import, ast.ImportFrom, ast.Assign)
+_CHUNK_NODE_TYPES = (ast.For, ast.While, ast.If, ast.With)
+_NEWLINE = re.compile(b"\n")
+# Only these fields can hold nested statements, so the traversal never descends into expressions.
+_BLOCK_FIELDS = ("body", "orelse", "finalbody", "handlers", "cases")
+
+
+class SourceIndex:
+    """
+    Maps AST positions back to the original source.
+
+    AST column offsets are UTF-8 byte offsets, so the source is kept as bytes and
+    every node's span can be measured and sliced without re-generating code.
+    """
+
+    def __init__(self, source: str):
+        self.data = source.encode("utf-8")
+        self.line_starts = [0] + [match.end() for match in _NEWLINE.finditer(self.data)]
+
+    def offset(self, lineno: int, col_offset: int) -> int:
+        """Returns the byte offset of a (1-based line, byte column) position."""
+        return self.line_starts[lineno - 1] + col_offset
+
+    def span(self, node: ast.AST) -> Tuple[int, int]:
+        """Returns the (start, end) byte span of a statement, including any decorators."""
+        decorators = getattr(node, "decorator_list", None)
+        if decorators:
+            # Decorators sit at the same indentation as the definition itself.
+            start = self.offset(decorators[0].lineno, node.col_offset)
+        else:
+            start = self.offset(node.lineno, node.col_offset)
+            if isinstance(node, ast.If) and self.data.startswith(b"elif", start):
+                # An `elif` is an If nested in the else branch; its source starts at the `if`.
+                start += 2
+        return start, self.offset(node.end_lineno, node.end_col_offset)
+
+    def span_size(self, node: ast.AST) -> int:
+        """Returns the size of a statement's source in bytes."""
+        start, end = self.span(node)
+        return end - start
+
+    def segment(self, node: ast.AST) -> str:
+        """Returns the verbatim source of a statement, dedented to column zero."""
+        return self.segment_range(node, node)
+
+    def relative_segment(self, node: ast.AST, base_col: int) -> str:
+        """Returns a statement's source indented relative to column `base_col`, as it appears in a chunk starting there."""
+        start, end = self.span(node)
+        text = self.data[start:end].decode("utf-8")
+        return " " * (node.col_offset - base_col) + _dedent(text, base_col)
+
+    def head(self, node: ast.AST, first_child: ast.AST) -> str:
+        """Returns a compound statement's source up to its first nested statement, dedented to column zero."""
+        start = self.span(node)[0]
+        end = self.offset(first_child.lineno, first_child.col_offset)
+        return _dedent(self.data[start:end].decode("utf-8"), node.col_offset)
+
+    def segment_range(self, first: ast.AST, last: ast.AST) -> str:
+        """Returns the verbatim source from the start of `first` to the end of `last`, dedented by `first`'s indentation."""
+        start = self.span(first)[0]
+        end = self.span(last)[1]
+        text = self.data[start:end].decode("utf-8")
+        return _dedent(text, first.col_offset)
+
+
+def _dedent(text: str, indent: int) -> str:
+    """Removes up to `indent` leading whitespace characters from every line after the first."""
+    if indent == 0:
+        return text
+    lines = text.split("\n")
+    for i in range(1, len(lines)):
+        line = lines[i]
+        leading = len(line) - len(line.lstrip(" \t"))
+        lines[i] = line[min(leading, indent):]
+    return "\n".join(lines)
+
+
+def _normalize_newlines(content: str) -> str:
+    """Converts CRLF and CR line endings to LF so line numbers match the byte index."""
+    return content.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _build_completion(context_header: str, source: str) -> str:
+    """Prepends the file's context header to a code snippet."""
+    return context_header + CONTEXT_SEPARATOR + source if context_header else source
+
+
+def strip_context_header(completion: str) -> str:
+    """Returns a completion's function source without the context header prepended to it."""
+    if completion.startswith(("@", "def ", "async def ")):
+        return completion
+    match = _FUNCTION_AFTER_HEADER.search(completion)
+    return completion[match.end():] if match else completion
+
+
+def get_context_header(tree: ast.Module, index: SourceIndex) -> str:
+    """Returns the verbatim source of the module's top-level imports and assignments."""
+    return "\n".join(index.segment(node) for node in tree.body if isinstance(node, _CONTEXT_NODE_TYPES))
+
+
+def _loaded_names(node: ast.AST) -> Set[str]:
+    """Returns every name read anywhere below `node` (decorators and nested functions included)."""
+    return {child.id for child in ast.walk(node) if isinstance(child, ast.Name) and not isinstance(child.ctx, ast.Store)}
+
+
+def _defined_names(node: ast.stmt) -> Set[str]:
+    """
+    Returns the names a context statement binds: import aliases and assignment targets.
+    An assignment into an attribute or item of a global (`TABLE["k"] = 1`) counts as
+    defining that global, so the mutation is kept along with it.
+    """
+    if isinstance(node, ast.Import):
+        return {alias.asname or alias.name.split(".")[0] for alias in node.names}
+    if isinstance(node, ast.ImportFrom):
+        return {alias.asname or alias.name for alias in node.names}
+    names = set()
+    for target in node.targets:
+        for child in ast.walk(target):
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store):
+                names.add(child.id)
+        base = target
+        while isinstance(base, (ast.Attribute, ast.Subscript)):
+            base = base.value
+        if isinstance(base, ast.Name):
+            names.add(base.id)
+    return names
+
+
+class ContextIndex:
+    """
+    A per-file symbol index over the context statements (top-level imports and assignments).
+
+    `header_for(node)` keeps only the statements defining a name the node reads, plus,
+    transitively, the statements those depend on (`B = A * 2` pulls in `A`). A name
+    that is also a local variable of the function may keep a statement it does not
+    need; a global the function uses is never dropped. Star imports cannot be
+    resolved, so they are always kept. Statements stay in source order.
+    """
+
+    def __init__(self, tree: ast.Module, index: SourceIndex):
+        nodes = [node for node in tree.body if isinstance(node, _CONTEXT_NODE_TYPES)]
+        self.segments = [index.segment(node) for node in nodes]
+        self.references = [_loaded_names(node) for node in nodes]
+        self.full_header = "\n".join(self.segments)
+        self.definers: Dict[str, List[int]] = {}
+        self.always_kept: Set[int] = set()
+        for i, node in enumerate(nodes):
+            if isinstance(node, ast.ImportFrom) and any(alias.name == "*" for alias in node.names):
+                self.always_kept.add(i)
+            for name in _defined_names(node):
+                self.definers.setdefault(name, []).append(i)
+
+    def header_for(self, *nodes: ast.AST) -> str:
+        """Returns the context header pruned to the statements the nodes depend on."""
+        selected = set(self.always_kept)
+        pending = [name for node in nodes for name in _loaded_names(node)]
+        for i in self.always_kept:
+            pending.extend(self.references[i])
+        seen: Set[str] = set()
+        while pending:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            for i in self.definers.get(name, ()):
+                if i not in selected:
+                    selected.add(i)
+                    pending.extend(self.references[i])
+        return "\n".join(self.segments[i] for i in sorted(selected))
+
+
+def _count(stats: Optional[Dict[str, int]], name: str, amount: int = 1):
+    """Adds to a counter of the optional stats dict."""
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + amount
+
+
+class _HeaderSource:
+    """Supplies the context header of each record, pruned or not, and counts the header bytes it saved."""
+
+    def __init__(self, context: Optional[ContextIndex], prune: bool, stats: Optional[Dict[str, int]]):
+        self.context = context
+        self.prune = prune
+        self.stats = stats
+
+    def peek(self, *nodes: ast.AST) -> str:
+        """Returns the header for the nodes without counting it."""
+        if self.context is None:
+            return ""
+        return self.context.header_for(*nodes) if self.prune else self.context.full_header
+
+    def header_for(self, *nodes: ast.AST) -> str:
+        """Returns the header for one record."""
+        header = self.peek(*nodes)
+        if self.context is not None:
+            _count(self.stats, "context_records")
+            _count(self.stats, "context_bytes_full", _header_bytes(self.context.full_header))
+            _count(self.stats, "context_bytes_kept", _header_bytes(header))
+        return header
+
+
+def context_savings(stats: Dict[str, int]) -> Dict[str, int]:
+    """
+    Summarizes accumulated context stats as header bytes before/after pruning and the
+    bytes and (estimated, four bytes per token) tokens saved.
+    """
+    full = stats.get("context_bytes_full", 0)
+    kept = stats.get("context_bytes_kept", 0)
+    return {
+        "records": stats.get("context_records", 0),
+        "bytes_full": full,
+        "bytes_kept": kept,
+        "bytes_saved": full - kept,
+        "tokens_saved": (full - kept) // 4,
+    }
+
+
+def _header_bytes(header: str) -> int:
+    """Returns how many bytes a header adds to a completion, separator included."""
+    return len(header.encode("utf-8")) + len(CONTEXT_SEPARATOR) if header else 0
+
+
+def iter_function_nodes(node: ast.AST, include_nested: bool = True) -> Iterator[FunctionNode]:
+    """
+    Yields function definitions below `node` in source (pre-)order.
+
+    Top-level functions, methods of (possibly nested) classes and functions defined
+    inside conditional or try blocks are always yielded. Functions defined inside
+    other functions are yielded as separate records after their enclosing function
+    when include_nested is True, and skipped otherwise. Every node is visited once.
+    """
+    for field in _BLOCK_FIELDS:
+        block = getattr(node, field, None)
+        if not isinstance(block, list):
+            continue
+        for child in block:
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                yield child
+                if include_nested:
+                    yield from iter_function_nodes(child, include_nested)
+            else:
+                yield from iter_function_nodes(child, include_nested)
+
+
+def chunk_function_node(node: FunctionNode, index: SourceIndex, headers: _HeaderSource) -> Iterator[Dict[str, str]]:
+    """
+    Yields one record per top-level loop, conditional or with-block of an oversized
+    function. With pruning, each chunk's header covers only the names the chunk reads.
+    """
+    for child in node.body:
+        if isinstance(child, _CHUNK_NODE_TYPES):
+            chunk_prompt = f"This is a code chunk from the function '{node.name}'. It contains a '{type(child).__name__}' block. Explain, refactor, or complete this code."
+            yield {
+                "prompt": chunk_prompt,
+                "completion": _build_completion(headers.header_for(child), index.segment(child)),
+            }
+
+
+def _describe_piece(piece: Piece, function: FunctionNode) -> str:
+    """Describes what a token-budget chunk contains, for its prompt."""
+    count = len(piece.statements)
+    statements = f"{count} statement{'s' if count != 1 else ''}"
+    nested = piece.kind == "prefix" and piece.statements[0] is not statement_lists(piece.node)[0][1][0]
+    opening = ", the headers of its first nested blocks and their" if nested else " and its"
+    if piece.kind == "prefix" and piece.node is function:
+        return f"the signature of '{function.name}'{opening} first {statements}"
+    if piece.kind == "prefix":
+        return f"the start of a '{type(piece.node).__name__}' block{opening} first {statements}"
+    if count == 1 and isinstance(piece.statements[0], _CHUNK_NODE_TYPES):
+        return f"a '{type(piece.statements[0]).__name__}' block"
+    return statements
+
+
+def chunk_function_by_tokens(
+    node: FunctionNode,
+    index: SourceIndex,
+    headers: _HeaderSource,
+    count_tokens: TokenCounter,
+    token_budget: int,
+    stats: Optional[Dict[str, int]] = None,
+) -> Iterator[Dict[str, str]]:
+    """
+    Yields records covering the whole of a function that does not fit `token_budget`.
+
+    The budget applies to each completion, context header included: the source gets
+    what the function's header leaves (at least a quarter of the budget). Pieces come
+    from TokenBudgetChunker, so every statement of the function lands in exactly one
+    record. Each prompt says which part of the function the chunk is, after the
+    function's docstring when it has one, so every chunk keeps the instruction.
+    """
+    header_tokens = count_tokens(headers.peek(node) + CONTEXT_SEPARATOR)
+    source_budget = max(token_budget - header_tokens, token_budget // 4)
+    pieces = TokenBudgetChunker(index, count_tokens, source_budget).split(node)
+    docstring = ast.get_docstring(node)
+    _count(stats, "chunked_functions")
+    for number, piece in enumerate(pieces, 1):
+        if piece.kind == "prefix":
+            source = index.segment_range(piece.node, piece.statements[-1])
+            header = headers.header_for(*prefix_heads(piece), *piece.statements)
+        else:
+            source = index.segment_range(piece.statements[0], piece.statements[-1])
+            header = headers.header_for(*piece.statements)
+        completion = _build_completion(header, source)
+        _count(stats, "chunks")
+        if count_tokens(completion) > token_budget:
+            _count(stats, "chunks_over_budget")
+        inside = f", inside {' > '.join(piece.path)}" if piece.path else ""
+        if docstring:
+            prompt = (f"{docstring.strip()}\n\nThis is part {number} of {len(pieces)} of the function '{node.name}'{inside}. "
+                      f"It contains {_describe_piece(piece, node)}.")
+        else:
+            prompt = (f"This is a code chunk (part {number} of {len(pieces)}) from the function '{node.name}'{inside}. "
+                      f"It contains {_describe_piece(piece, node)}. Explain, refactor, or complete this code.")
+        yield {"prompt": prompt, "completion": completion}
+
+
+def _extract_from_tree(
+    tree: ast.Module,
+    index: SourceIndex,
+    headers: _HeaderSource,
+    include_nested: bool,
+    max_function_bytes: int,
+    token_budget: Optional[int] = None,
+    count_tokens: Optional[TokenCounter] = None,
+    stats: Optional[Dict[str, int]] = None,
+) -> Iterator[Dict[str, str]]:
+    """
+    Yields the records for every function of an already-parsed module.
+
+    Without a token budget, functions over `max_function_bytes` are split into their
+    top-level blocks. With one, documented functions whose completion would exceed
+    the budget, and oversized functions, are chunked with chunk_function_by_tokens.
+    """
+    for node in iter_function_nodes(tree, include_nested):
+        oversized = index.span_size(node) > max_function_bytes
+        if oversized:
+            print(f"  [INFO] Oversized function '{node.name}' found. Applying chunking strategy.")
+            if token_budget is None:
+                yield from chunk_function_node(node, index, headers)
+                continue
+        docstring = ast.get_docstring(node)
+        if not docstring and not oversized:
+            continue
+        source = index.segment(node)
+        if token_budget is not None and (oversized or count_tokens(_build_completion(headers.peek(node), source)) > token_budget):
+            yield from chunk_function_by_tokens(node, index, headers, count_tokens, token_budget, stats)
+            continue
+        yield {
+            "prompt": docstring.strip(),
+            "completion": _build_completion(headers.header_for(node), source),
+        }
+
+
+def _split_top_level_definitions(content: str) -> List[str]:
+    """Splits source into chunks that start at top-level def, class or decorator lines."""
+    chunks: List[str] = []
+    buffer: List[str] = []
+    for line in content.splitlines(True):
+        if line.startswith(("def ", "class ", "async def ", "@")):
+            if buffer:
+                chunks.append("".join(buffer))
+            buffer = [line]
+        elif buffer:
+            buffer.append(line)
+    if buffer:
+        chunks.append("".join(buffer))
+    return chunks
+
+
+def extract_functions_from_source(
+    content: str,
+    include_nested: bool = True,
+    max_function_bytes: int = OVERSIZED_FUNCTION_BYTES,
+    prune_context: bool = False,
+    stats: Optional[Dict[str, int]] = None,
+    token_budget: Optional[int] = None,
+    count_tokens: Optional[TokenCounter] = None,
+) -> Iterator[Dict[str, str]]:
+    """
+    Extracts {prompt, completion} records from Python source with a single parse.
+
+    The context header and every function body are sliced straight out of the source
+    using the AST's line/column offsets, and function sizes are measured from their
+    byte spans. With `prune_context`, each record's header keeps only the imports and
+    globals the function references (see ContextIndex). With `token_budget`, functions
+    whose completion would not fit are chunked by tokens, counted with `count_tokens`
+    (the estimate by default). If `stats` is given, header bytes with and without
+    pruning and chunking counts are added to it. If the file does not parse as a
+    whole, each top-level definition is parsed on its own (without a context header)
+    so one broken function does not cost the rest of the file.
+    """
+    if token_budget is not None and count_tokens is None:
+        count_tokens = make_token_counter()
+    content = _normalize_newlines(content)
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        tree = None
+
+    if tree is not None:
+        index = SourceIndex(content)
+        headers = _HeaderSource(ContextIndex(tree, index), prune_context, stats)
+        yield from _extract_from_tree(tree, index, headers, include_nested, max_function_bytes, token_budget, count_tokens, stats)
+        return
+
+    headers = _HeaderSource(None, prune_context, stats)
+    for chunk in _split_top_level_definitions(content):
+        try:
+            chunk_tree = ast.parse(chunk)
+        except (SyntaxError, ValueError):
+            continue
+        yield from _extract_from_tree(chunk_tree, SourceIndex(chunk), headers, include_nested, max_function_bytes,
+                                      token_budget, count_tokens, stats)
+
+
+def extract_functions_from_bytes(
+    data: bytes,
+    include_nested: bool = True,
+    max_function_bytes: Optional[int] = None,
+    prune_context: bool = False,
+    stats: Optional[Dict[str, int]] = None,
+    token_budget: Optional[int] = None,
+    token_counter: str = "estimate",
+    tokenizer_name: Optional[str] = None,
+) -> Iterator[Dict[str, str]]:
+    """
+    Decodes a Python file's contents (e.g. a git blob) and extracts its records with
+    extract_functions_from_source. `token_counter` and `tokenizer_name` select how
+    chunks are measured (see make_token_counter).
+    """
+    if max_function_bytes is None:
+        max_function_bytes = OVERSIZED_FUNCTION_BYTES
+    count_tokens = make_token_counter(token_counter, tokenizer_name) if token_budget is not None else None
+    yield from extract_functions_from_source(data.decode("utf-8", errors="ignore"), include_nested, max_function_bytes,
+                                             prune_context, stats, token_budget, count_tokens)
+
+
+def extract_functions_from_file(
+    file_path: str,
+    include_nested: bool = True,
+    max_function_bytes: Optional[int] = None,
+    prune_context: bool = False,
+    stats: Optional[Dict[str, int]] = None,
+    token_budget: Optional[int] = None,
+    token_counter: str = "estimate",
+    tokenizer_name: Optional[str] = None,
+) -> Iterator[Dict[str, str]]:
+    """Reads a Python file and extracts its records with extract_functions_from_bytes."""
+    with open(file_path, "rb") as f:
+        data = f.read()
+    yield from extract_functions_from_bytes(data, include_nested, max_function_bytes, prune_context, stats,
+                                            token_budget, token_counter, tokenizer_name)
@@ -0,0 +1,290 @@
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from data_pipeline.batch_judge import extract_batch_items, is_batch_judge_prompt
+
+_FENCED_CODE = re.compile(r"```python\n(.*?)\n```", re.S)
+_FUNCTION_NAME = re.compile(r"def\s+(\w+)")
+
+
+def _unit(*parts) -> float:
+    """Maps its arguments to a stable pseudo-random number in [0, 1)."""
+    digest = hashlib.blake2b("\x00".join(map(str, parts)).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") / 2 ** 64
+
+
+class LatencyModel:
+    """
+    Samples response latencies in seconds: 'constant' (always `seconds`), 'uniform'
+    between `low_seconds` and `high_seconds`, or 'lognormal' with median `seconds`
+    and shape `sigma` (a long right tail, like real API latencies). Samples are
+    capped at `max_seconds`.
+    """
+
+    DISTRIBUTIONS = ("constant", "uniform", "lognormal")
+
+    def __init__(
+        self,
+        distribution: str = "lognormal",
+        seconds: float = 0.5,
+        sigma: float = 0.5,
+        low_seconds: float = 0.0,
+        high_seconds: float = 1.0,
+        max_seconds: float = 30.0,
+    ):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{distribution}'. Expected one of {self.DISTRIBUTIONS}.")
+        self.distribution = distribution
+        self.seconds = seconds
+        self.sigma = sigma
+        self.low_seconds = low_seconds
+        self.high_seconds = high_seconds
+        self.max_seconds = max_seconds
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> "LatencyModel":
+        """Builds a latency model from a config mapping with the constructor's keyword names."""
+        return cls(**(config or {}))
+
+    def sample(self, rng: random.Random) -> float:
+        """Draws one latency."""
+        if self.distribution == "constant":
+            value = self.seconds
+        elif self.distribution == "uniform":
+            value = rng.uniform(self.low_seconds, self.high_seconds)
+        else:
+            value = self.seconds * math.exp(rng.gauss(0.0, self.sigma))
+        return min(max(value, 0.0), self.max_seconds)
+
+
+class FakeLLM:
+    """
+    Decides what the fake server answers, the same way for the same input.
+
+    Requests are classified from their prompt: batch judge prompts carry the item
+    markers of `batch_judge`, judge prompts ask for a JSON "score", anything else is
+    a generator request. Verdicts depend only on the judged code: a stable fraction
+    `bad_docstring_rate` of functions scores 2 (and gets regenerated), the rest score 5.
+    Generated docstrings name the function they document.
+
+    Faults are injected per attempt: the n-th request with a given prompt fails with a
+    429 (with a Retry-After header) with probability `rate_limit_rate` and with a 500
+    with probability `error_rate`, decided by a hash of (seed, prompt, n). A run makes
+    the same faults whatever order concurrent requests arrive in. Only latencies come
+    from a seeded random generator shared by all requests.
+    """
+
+    def __init__(
+        self,
+        judge_latency: Optional[LatencyModel] = None,
+        generator_latency: Optional[LatencyModel] = None,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after_seconds: float = 1.0,
+        bad_docstring_rate: float = 0.2,
+        seed: int = 0,
+    ):
+        self.latencies = {
+            "judge": judge_latency or LatencyModel(seconds=0.3),
+            "generator": generator_latency or LatencyModel(seconds=1.5),
+        }
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.bad_docstring_rate = bad_docstring_rate
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.attempts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> "FakeLLM":
+        """Builds the fake model from the 'fake_llm_server' config section."""
+        config = config or {}
+        return cls(
+            judge_latency=LatencyModel.from_config(config.get("judge_latency")),
+            generator_latency=LatencyModel.from_config(config.get("generator_latency")),
+            error_rate=config.get("error_rate", 0.0),
+            rate_limit_rate=config.get("rate_limit_rate", 0.0),
+            retry_after_seconds=config.get("retry_after_seconds", 1.0),
+            bad_docstring_rate=config.get("bad_docstring_rate", 0.2),
+            seed=config.get("seed", 0),
+        )
+
+    @staticmethod
+    def classify(prompt: str) -> str:
+        """Returns the request kind: 'batch_judge', 'judge' or 'generator'."""
+        if is_batch_judge_prompt(prompt):
+            return "batch_judge"
+        if '"score"' in prompt:
+            return "judge"
+        return "generator"
+
+    def verdict(self, code: str) -> Dict:
+        """The judge's verdict on a function."""
+        if _unit(self.seed, "verdict", code) < self.bad_docstring_rate:
+            return {"score": 2, "reason": "Docstring is too brief and lacks detail."}
+        return {"score": 5, "reason": "The docstring is clear and accurate."}
+
+    def respond(self, kind: str, prompt: str) -> str:
+        """Returns the message content answering a prompt of the given kind."""
+        if kind == "batch_judge":
+            answers = [{"id": i, **self.verdict(code)} for i, (_, code) in enumerate(extract_batch_items(prompt))]
+            return json.dumps(answers)
+        match = _FENCED_CODE.search(prompt)
+        code = match.group(1) if match else prompt
+        if kind == "judge":
+            return json.dumps(self.verdict(code))
+        name = _FUNCTION_NAME.search(code)
+        return (
+            f"Runs `{name.group(1) if name else 'the function'}` on its arguments and returns the result.\n\n"
+            "Args:\n    The arguments the function accepts.\n\n"
+            "Returns:\n    The value the function computes."
+        )
+
+    def fault(self, prompt: str) -> Optional[Tuple[int, str]]:
+        """Returns the (HTTP status, error type) to fail this attempt with, or None to answer it."""
+        key = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest()
+        with self.lock:
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+        roll = _unit(self.seed, "fault", key, attempt)
+        if roll < self.rate_limit_rate:
+            return 429, "rate_limit_error"
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500, "server_error"
+        return None
+
+    def latency(self, kind: str) -> float:
+        """Draws the latency of one response."""
+        with self.lock:
+            return self.latencies["judge" if kind == "batch_judge" else kind].sample(self.rng)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves POST /v1/chat/completions and GET /stats over keep-alive HTTP/1.1 connections."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.counted = False
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        if not self.counted:
+            # Connections are counted once they carry a completion, so polling /stats does not add to them.
+            self.server.count("connections")
+            self.counted = True
+        llm = self.server.llm
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        kind = llm.classify(prompt)
+        self.server.count("requests", f"requests.{kind}")
+
+        fault = llm.fault(prompt)
+        if fault is not None and fault[0] == 429:
+            self.server.count("rate_limited")
+            self._send_json(429, {"error": {"message": "Rate limit reached.", "type": fault[1], "code": "rate_limit_exceeded"}},
+                            {"Retry-After": f"{llm.retry_after_seconds:g}"})
+            return
+        time.sleep(llm.latency(kind))
+        if fault is not None:
+            self.server.count("server_errors")
+            self._send_json(fault[0], {"error": {"message": "The server had an error.", "type": fault[1]}})
+            return
+
+        content = llm.respond(kind, prompt)
+        prompt_tokens, completion_tokens = len(prompt) // 4 + 1, len(content) // 4 + 1
+        self._send_json(200, {
+            "id": "chatcmpl-" + hashlib.blake2b(prompt.encode("utf-8"), digest_size=12).hexdigest(),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    """
+    A local stand-in for the OpenAI chat-completions API, for exercising the real
+    client path (HTTP, connection pooling, error handling, response parsing) without
+    paying for it. Answers come from a FakeLLM; every connection is served by its own
+    thread, so concurrent requests wait out their latencies in parallel. GET /stats
+    returns the request, connection and fault counters.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, llm: FakeLLM, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.llm = llm
+        self.stats: Dict[str, int] = {"connections": 0, "requests": 0, "rate_limited": 0, "server_errors": 0}
+        self._stats_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """The base URL to give the OpenAI client."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, *names: str):
+        """Adds one to each of the named counters."""
+        with self._stats_lock:
+            for name in names:
+                self.stats[name] = self.stats.get(name, 0) + 1
+
+    def snapshot(self) -> Dict[str, int]:
+        """Returns a copy of the counters."""
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def start(self) -> "FakeLLMServer":
+        """Serves requests on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-llm-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and closes the socket."""
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
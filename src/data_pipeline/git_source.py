@@ -0,0 +1,148 @@
+import os
+import subprocess
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+# Tree entry modes that are not regular files: symbolic links and submodules (gitlinks).
+_SKIPPED_MODES = (b"120000", b"160000")
+
+
+class GitBlob(NamedTuple):
+    """
+    A Python file at one revision of a git repository, identified by its blob object
+    id. `content` is filled in only while the blob is on its way to an extractor.
+    """
+    repo: str
+    commit: str
+    path: str
+    oid: str
+    size: int
+    content: Optional[bytes] = None
+
+    @property
+    def key(self) -> str:
+        """The blob's identity in the extraction manifest; equal blobs share it across revisions and repositories."""
+        return f"git:{self.oid}"
+
+    def __str__(self) -> str:
+        return f"{self.repo}@{self.commit[:12]}:{self.path}"
+
+
+def _git(repo: str, *args: str) -> bytes:
+    """Runs a git command in `repo` and returns its output."""
+    result = subprocess.run(["git", "-C", repo, *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        message = result.stderr.decode("utf-8", errors="replace").strip()
+        raise ValueError(f"git {' '.join(args)} failed in {repo}: {message}")
+    return result.stdout
+
+
+def resolve_commit(repo: str, revision: str) -> str:
+    """Returns the commit id a revision (commit, tag, branch, ...) names."""
+    return _git(repo, "rev-parse", "--verify", "--end-of-options", f"{revision}^{{commit}}").decode("ascii").strip()
+
+
+def resolve_sources(repositories: Iterable[Dict]) -> List[Tuple[str, List[str]]]:
+    """
+    Resolves the 'extraction.git.repositories' entries ({path, revisions}) to
+    (absolute repository path, commit ids). Revisions default to HEAD.
+    """
+    sources = []
+    for entry in repositories:
+        repo = os.path.abspath(entry["path"])
+        revisions = entry.get("revisions") or ["HEAD"]
+        if isinstance(revisions, str):
+            revisions = [revisions]
+        sources.append((repo, [resolve_commit(repo, str(revision)) for revision in revisions]))
+    return sources
+
+
+def list_python_blobs(repo: str, commit: str) -> Iterator[GitBlob]:
+    """
+    Yields the .py files of a commit's tree, sorted by path, straight from the object
+    database (`git ls-tree`): nothing is checked out and no file contents are read.
+    """
+    listing = _git(repo, "ls-tree", "-r", "-z", "--long", "--full-tree", commit)
+    for entry in listing.split(b"\0"):
+        if not entry:
+            continue
+        meta, path = entry.split(b"\t", 1)
+        mode, kind, oid, size = meta.split()
+        if kind != b"blob" or mode in _SKIPPED_MODES or not path.endswith(b".py"):
+            continue
+        yield GitBlob(repo, commit, path.decode("utf-8", errors="replace"), oid.decode("ascii"), int(size))
+
+
+def iter_git_blobs(
+    sources: Iterable[Tuple[str, List[str]]],
+    stats: Optional[Dict[str, int]] = None,
+    seen: Optional[Set[str]] = None,
+) -> Iterator[GitBlob]:
+    """
+    Yields the Python blobs of every (repository, commits) source in order, each
+    distinct blob once: a file that is unchanged between revisions, or shared between
+    repositories, has the same object id and is only extracted at its first
+    occurrence. `stats` counts the blobs listed and the duplicates skipped.
+    """
+    stats = stats if stats is not None else {}
+    seen = seen if seen is not None else set()
+    stats.setdefault("blobs", 0)
+    stats.setdefault("duplicate_blobs", 0)
+    for repo, commits in sources:
+        for commit in commits:
+            for blob in list_python_blobs(repo, commit):
+                stats["blobs"] += 1
+                if blob.oid in seen:
+                    stats["duplicate_blobs"] += 1
+                    continue
+                seen.add(blob.oid)
+                yield blob
+
+
+class GitBlobReader:
+    """Reads blob contents from one repository through a single long-running `git cat-file --batch`."""
+
+    def __init__(self, repo: str):
+        self.repo = repo
+        self.process = subprocess.Popen(["git", "-C", repo, "cat-file", "--batch"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def read(self, oid: str) -> bytes:
+        """Returns the contents of a blob."""
+        self.process.stdin.write(oid.encode("ascii") + b"\n")
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+        if len(header) != 3:
+            raise ValueError(f"Object {oid} is missing from {self.repo}.")
+        data = self.process.stdout.read(int(header[2]))
+        self.process.stdout.read(1)  # The newline after the contents.
+        return data
+
+    def close(self):
+        """Ends the cat-file process."""
+        self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
+
+
+def with_contents(items: Iterable[Union[str, GitBlob]]) -> Iterator[Union[str, GitBlob]]:
+    """
+    Fills in the content of each GitBlob as it is consumed, passing file paths
+    through unchanged. One reader per repository stays open until the items run out,
+    so only the blobs in flight are held in memory.
+    """
+    readers: Dict[str, GitBlobReader] = {}
+    try:
+        for item in items:
+            if isinstance(item, GitBlob):
+                if item.repo not in readers:
+                    readers[item.repo] = GitBlobReader(item.repo)
+                item = item._replace(content=readers[item.repo].read(item.oid))
+            yield item
+    finally:
+        for reader in readers.values():
+            reader.close()
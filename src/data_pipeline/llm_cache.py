@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from typing import Any, Optional
+
+
+class ResponseCache:
+    """
+    A persistent SQLite cache of LLM responses.
+
+    Entries are keyed by a hash of the call kind, model name, prompt template version
+    and the call's inputs, so a change to any of them misses the cache. Entries older
+    than `ttl_seconds` are treated as misses, and `evict` trims the cache to
+    `max_entries` by least recent use. Hits and misses are counted in `stats`.
+    """
+
+    def __init__(
+        self,
+        cache_path: str,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        commit_every: int = 100,
+    ):
+        directory = os.path.dirname(cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(cache_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def make_key(kind: str, model: str, template_version: str, *inputs: str) -> str:
+        """Returns the cache key for one call: a SHA-256 over its kind, model, template version and inputs."""
+        digest = hashlib.sha256()
+        for part in (kind, model, template_version) + inputs:
+            encoded = part.encode("utf-8")
+            # Length-prefix every part so ('ab', 'c') and ('a', 'bc') never collide.
+            digest.update(len(encoded).to_bytes(8, "little"))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def _maybe_commit(self):
+        """Commits once every `commit_every` writes so a long run does not fsync per call."""
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self.commit()
+
+    def get(self, key: str, *fallbacks: str) -> Optional[Any]:
+        """
+        Returns the cached value for a key, or for the first of `fallbacks` that is
+        cached, or None on a miss or an expired entry. One lookup counts one hit or
+        one miss however many keys it tries.
+        """
+        now = time.time()
+        for key in (key, *fallbacks):
+            row = self.conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self.stats["expired"] += 1
+                row = None
+            if row is not None:
+                break
+        else:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self._maybe_commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        """Stores a JSON-serializable value under a key."""
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now, now),
+        )
+        self._maybe_commit()
+
+    def evict(self) -> int:
+        """Deletes expired entries, then the least recently used ones beyond max_entries. Returns the number deleted."""
+        deleted = 0
+        if self.ttl_seconds is not None:
+            deleted += self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)).rowcount
+        if self.max_entries is not None:
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            if count > self.max_entries:
+                deleted += self.conn.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+        self.stats["evicted"] += deleted
+        self.commit()
+        return deleted
+
+    def __len__(self) -> int:
+        """Returns the number of stored entries."""
+        return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def commit(self):
+        """Makes all pending writes durable."""
+        self.conn.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        """Commits pending writes and closes the database."""
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,145 @@
+import os
+import json
+import sqlite3
+import hashlib
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# Bump this when the manifest schema changes; older manifests are then rebuilt from scratch.
+MANIFEST_SCHEMA_VERSION = 1
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class FileState(NamedTuple):
+    """The identity of a source file at the time it was last extracted."""
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: Optional[str]
+
+
+def file_sha256(file_path: str) -> str:
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_file_state(file_path: str) -> Tuple[bytes, FileState]:
+    """
+    Reads a file and returns its contents with the identity of exactly those bytes.
+    The mtime is taken before reading, so a file modified during the read looks
+    changed on the next run.
+    """
+    with open(file_path, 'rb') as f:
+        mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+        data = f.read()
+    return data, FileState(file_path, len(data), mtime_ns, hashlib.sha256(data).hexdigest())
+
+
+def records_to_jsonl(records: Iterable[Dict[str, str]]) -> str:
+    """Serializes records to JSONL text, one record per line."""
+    return "".join(json.dumps(record) + "\n" for record in records)
+
+
+class ExtractionManifest:
+    """
+    A persistent SQLite manifest of every extracted file and the records it produced.
+
+    Each row holds a file's path, size, mtime and content hash together with its
+    records as JSONL text, so the records of unchanged files can be carried forward
+    into a new output without re-reading or re-parsing the file. The manifest is
+    tied to an extractor key (engine name and settings); if the key changes, all
+    stored entries are discarded because they would no longer match a fresh run.
+    """
+
+    def __init__(self, manifest_path: str, extractor_key: str):
+        directory = os.path.dirname(manifest_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(manifest_path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "sha256 TEXT NOT NULL, record_count INTEGER NOT NULL, records TEXT NOT NULL)"
+        )
+        expected_key = f"{MANIFEST_SCHEMA_VERSION}:{extractor_key}"
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'extractor'").fetchone()
+        if row is None or row[0] != expected_key:
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('extractor', ?)", (expected_key,))
+        self.stats = {"unchanged": 0, "touched": 0, "changed": 0, "new": 0, "deleted": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        self.close()
+
+    def classify(self, file_path: str) -> Tuple[bool, FileState]:
+        """
+        Decides whether a file needs to be re-extracted.
+
+        Returns (unchanged, state). A file whose size and mtime match the manifest is
+        unchanged without being read. Otherwise its contents are hashed, and a file
+        whose hash still matches (e.g. it was only touched) is unchanged as well.
+        """
+        stat = os.stat(file_path)
+        row = self.conn.execute("SELECT size, mtime_ns, sha256 FROM files WHERE path = ?", (file_path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            self.stats["unchanged"] += 1
+            return True, FileState(file_path, stat.st_size, stat.st_mtime_ns, row[2])
+
+        state = FileState(file_path, stat.st_size, stat.st_mtime_ns, file_sha256(file_path))
+        if row is not None and row[2] == state.sha256:
+            self.conn.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?", (state.size, state.mtime_ns, file_path))
+            self.stats["touched"] += 1
+            return True, state
+
+        self.stats["changed" if row is not None else "new"] += 1
+        return False, state
+
+    def classify_blob(self, key: str, size: int) -> Tuple[bool, FileState]:
+        """
+        Decides whether a git blob needs to be extracted. Blobs are immutable and keyed
+        by object id, so a blob is unchanged exactly when the manifest already has it.
+        """
+        row = self.conn.execute("SELECT 1 FROM files WHERE path = ?", (key,)).fetchone()
+        self.stats["unchanged" if row is not None else "new"] += 1
+        return row is not None, FileState(key, size, 0, key)
+
+    def get_records(self, file_path: str) -> Tuple[int, str]:
+        """Returns (record_count, records as JSONL text) stored for a file."""
+        row = self.conn.execute("SELECT record_count, records FROM files WHERE path = ?", (file_path,)).fetchone()
+        return (row[0], row[1]) if row is not None else (0, "")
+
+    def put(self, state: FileState, records: List[Dict[str, str]]):
+        """Stores the records a file produced along with its current identity."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256, record_count, records) VALUES (?, ?, ?, ?, ?, ?)",
+            (state.path, state.size, state.mtime_ns, state.sha256, len(records), records_to_jsonl(records)),
+        )
+
+    def remove(self, file_path: str):
+        """Drops a file from the manifest so it is re-extracted on the next run."""
+        self.conn.execute("DELETE FROM files WHERE path = ?", (file_path,))
+
+    def prune(self, present_paths: Set[str]) -> int:
+        """Removes entries for files that no longer exist and returns how many were removed."""
+        stale = [path for (path,) in self.conn.execute("SELECT path FROM files") if path not in present_paths]
+        self.conn.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in stale))
+        self.stats["deleted"] += len(stale)
+        return len(stale)
+
+    def commit(self):
+        """Makes all changes since the last commit durable."""
+        self.conn.commit()
+
+    def close(self):
+        """Closes the underlying database connection."""
+        self.conn.close()
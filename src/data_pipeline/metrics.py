@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import math
+import time
+import bisect
+import cProfile
+import pstats
+import resource
+import functools
+import inspect
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional
+
+# Upper bounds (seconds) of the latency histogram buckets: roughly x2 steps from 1ms to 5 minutes.
+LATENCY_BUCKETS = [0.001 * 2 ** i for i in range(19)]
+
+# The collector of the stage running in the current thread or asyncio task, if any.
+_active: ContextVar[Optional["StageMetrics"]] = ContextVar("data_pipeline_metrics", default=None)
+
+
+def _read_status_kb(field: str) -> Optional[int]:
+    """Reads a field such as VmHWM from /proc/self/status, in kB (None where /proc is unavailable)."""
+    try:
+        with open("/proc/self/status", "r") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """Resets the process's peak RSS counter so the next reading covers one stage only (Linux)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    """Returns the process's peak resident set size in MB since the last reset."""
+    peak_kb = _read_status_kb("VmHWM")
+    if peak_kb is None:
+        # ru_maxrss is the lifetime peak: kB on Linux, bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_kb = peak // 1024 if sys.platform == "darwin" else peak
+    return peak_kb / 1024
+
+
+class Histogram:
+    """A fixed-bucket latency histogram with count, sum, min, max and approximate percentiles."""
+
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value: float):
+        """Adds one observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """Returns the upper bound of the bucket holding the q-th quantile (capped at the observed max)."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + [self.max], self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict:
+        """Summarizes the histogram for the metrics file."""
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "min": self.min if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": {f"le_{bound:g}": count for bound, count in zip(self.buckets, self.counts) if count},
+        }
+
+
+class StageMetrics:
+    """
+    Counters, timers, latency histograms and peak memory for one pipeline stage.
+
+    Used as a context manager, the collector becomes the active one for the current
+    thread (and the asyncio tasks it starts), so instrumented functions record into
+    it without having it passed around; outside a stage they cost a single lookup.
+    On exit it writes `<metrics_dir>/<stage>.json` and prints the summary as one
+    JSON line last, which Airflow's BashOperator pushes as the task's XCom.
+
+    `progress` prints at most one line every `progress_interval` seconds however
+    often it is called, so it is safe to call per record. Peak RSS is per process:
+    stages sharing a process should pass `reset_rss=False` so they do not reset
+    each other's readings. A `quiet` collector does not print its summary, for
+    measurements taken inside a stage that prints its own.
+    """
+
+    def __init__(
+        self,
+        stage: str,
+        metrics_dir: Optional[str] = None,
+        progress_interval: float = 10.0,
+        profile: bool = False,
+        reset_rss: bool = True,
+        quiet: bool = False,
+    ):
+        self.stage = stage
+        self.quiet = quiet
+        self.metrics_dir = metrics_dir
+        self.progress_interval = progress_interval
+        self.counters: Dict[str, float] = {}
+        self.timers: Dict[str, Dict[str, float]] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.profiler = cProfile.Profile() if profile else None
+        self.start = time.perf_counter()
+        self._last_progress = self.start
+        self._token = None
+        if reset_rss:
+            reset_peak_rss()
+
+    def __enter__(self):
+        outer = _active.get()
+        if outer is not None and outer.profiler is not None:
+            # Only one profiler can run per thread; the enclosing stage's covers this one.
+            self.profiler = None
+        self._token = _active.set(self)
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.profiler is not None:
+            self.profiler.disable()
+        _active.reset(self._token)
+        self.counters["failed"] = int(exc_type is not None)
+        self.finish()
+
+    def incr(self, name: str, amount: float = 1):
+        """Adds to a counter."""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_time(self, name: str, seconds: float):
+        """Adds one timed call to a timer."""
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        timer["calls"] += 1
+        timer["total_seconds"] += seconds
+        timer["max_seconds"] = max(timer["max_seconds"], seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Times the enclosed block into the `name` timer."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def observe(self, name: str, seconds: float):
+        """Records a latency in a histogram."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def progress(self, done: int, total: Optional[int] = None, unit: str = "records"):
+        """Prints a progress line if `progress_interval` seconds have passed since the last one."""
+        now = time.perf_counter()
+        if now - self._last_progress < self.progress_interval:
+            return
+        self._last_progress = now
+        elapsed = now - self.start
+        share = f" ({done / total:.0%})" if total else ""
+        of_total = f"/{total}" if total else ""
+        print(f"[{self.stage}] {done}{of_total} {unit}{share}, {done / elapsed:.0f} {unit}/sec, {elapsed:.0f}s elapsed", flush=True)
+
+    def to_dict(self) -> Dict:
+        """Returns everything collected so far."""
+        return {
+            "stage": self.stage,
+            "elapsed_seconds": time.perf_counter() - self.start,
+            "peak_rss_mb": peak_rss_mb(),
+            "counters": self.counters,
+            "timers": self.timers,
+            "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+        }
+
+    def finish(self) -> Dict:
+        """Writes the metrics file (and profile, if enabled) and prints the one-line summary."""
+        summary = self.to_dict()
+        if self.metrics_dir:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            with open(os.path.join(self.metrics_dir, f"{self.stage}.json"), "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+            if self.profiler is not None:
+                self.dump_profile(os.path.join(self.metrics_dir, f"{self.stage}.prof"))
+        if not self.quiet:
+            print(json.dumps(summary, sort_keys=True, separators=(",", ":")), flush=True)
+        return summary
+
+    def dump_profile(self, path: str, top: int = 40):
+        """Saves the raw cProfile data and a text table of the slowest functions by cumulative time."""
+        self.profiler.dump_stats(path)
+        with open(path + ".txt", "w", encoding="utf-8") as f:
+            pstats.Stats(self.profiler, stream=f).sort_stats("cumulative").print_stats(top)
+
+
+def current_metrics() -> Optional[StageMetrics]:
+    """Returns the active stage's collector, or None outside a stage."""
+    return _active.get()
+
+
+def stage_timer(name: str):
+    """Returns a context manager timing a block into the active stage's `name` timer (a no-op outside a stage)."""
+    metrics = _active.get()
+    return metrics.timer(name) if metrics is not None else nullcontext()
+
+
+def stage_metrics(stage: str, config: Dict, reset_rss: bool = True) -> StageMetrics:
+    """Builds a stage's collector from the 'metrics' section of config.yaml."""
+    metrics_config = config.get("metrics") or {}
+    return StageMetrics(
+        stage,
+        metrics_dir=metrics_config.get("metrics_dir"),
+        progress_interval=metrics_config.get("progress_interval_seconds", 10.0),
+        profile=metrics_config.get("profile", False),
+        reset_rss=reset_rss,
+    )
+
+
+def timed(name: str) -> Callable:
+    """
+    Decorates a function so each call adds to the `name` timer of the active stage.
+
+    For generator functions the time spent producing items is measured, i.e. the
+    time until the generator is exhausted, excluding the consumer's own work.
+    """
+    def decorate(fn: Callable) -> Callable:
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                metrics = _active.get()
+                if metrics is None:
+                    yield from fn(*args, **kwargs)
+                    return
+                elapsed = 0.0
+                iterator = fn(*args, **kwargs)
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            return
+                        finally:
+                            elapsed += time.perf_counter() - start
+                        yield item
+                finally:
+                    metrics.add_time(name, elapsed)
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            metrics = _active.get()
+            if metrics is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.add_time(name, time.perf_counter() - start)
+        return wrapper
+
+    return decorate
@@ -0,0 +1,202 @@
+import os
+import math
+import shutil
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from data_pipeline.dedup import mix64
+
+ORDERING_MODES = ("none", "shuffle", "length_bucketed")
+
+# Column holding each row's random sort key while it is in the spill files.
+_KEY = "__order_key"
+# Golden-ratio increment of splitmix64: consecutive row numbers map to well-spread inputs.
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def random_keys(seed: int, start: int, count: int) -> np.ndarray:
+    """
+    Returns the random 64-bit sort keys of rows start..start+count-1. A row's key
+    depends only on the seed and its position in the input, not on how the input is
+    batched or how many spill buckets are used.
+    """
+    rows = np.arange(start, start + count, dtype=np.uint64)
+    return mix64((rows + np.uint64(1)) * _GOLDEN + mix64(np.array([seed], dtype=np.uint64)))
+
+
+def spill_buckets(total_bytes: int, memory_bytes: int) -> int:
+    """Returns how many buckets the input is spilled into so that one bucket (with 25% headroom) fits in memory."""
+    return max(1, math.ceil(1.25 * total_bytes / max(memory_bytes, 1)))
+
+
+def row_lengths(table: pa.Table, length_column: str = "length") -> np.ndarray:
+    """Returns each row's token count: the length column, or the length of its input_ids."""
+    if length_column in table.column_names:
+        return table.column(length_column).to_numpy(zero_copy_only=False).astype(np.int64)
+    return pc.list_value_length(table.column("input_ids")).to_numpy(zero_copy_only=False).astype(np.int64)
+
+
+def external_shuffle(
+    tables: Iterable[pa.Table],
+    seed: int = 0,
+    num_buckets: int = 1,
+    spill_dir: Optional[str] = None,
+    stats: Optional[Dict[str, int]] = None,
+) -> Iterator[pa.Table]:
+    """
+    Yields the rows of `tables` in a seeded random order, holding one bucket at a time.
+
+    Every row gets a random key (random_keys). Pass 1 streams the input and appends
+    each row to the spill file of the key range it falls in, one of `num_buckets`
+    equal ranges, as Arrow IPC in `spill_dir`. Pass 2 loads the buckets in key order,
+    sorts each by key and yields it. The result is a uniformly random permutation
+    sorted by key. It is the same for any bucket count, so changing the memory budget
+    does not change the order. With one bucket nothing is spilled. `stats` counts the
+    rows, buckets and bytes spilled. The spill directory is removed at the end.
+    """
+    stats = stats if stats is not None else {}
+    stats.update({"rows": 0, "buckets": num_buckets, "spilled_bytes": 0})
+    in_memory: List[pa.Table] = []
+    writers: List[Optional[pa.RecordBatchStreamWriter]] = [None] * num_buckets
+    sinks: List[Optional[pa.OSFile]] = [None] * num_buckets
+    if num_buckets > 1:
+        if spill_dir is None:
+            raise ValueError("Spilling to more than one bucket needs a spill directory.")
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def bucket_path(bucket: int) -> str:
+        return os.path.join(spill_dir, f"bucket-{bucket:05d}.arrow")
+
+    try:
+        # Pass 1: scatter rows into key-range buckets.
+        schema = None
+        for table in tables:
+            if table.num_rows == 0:
+                continue
+            keys = random_keys(seed, stats["rows"], table.num_rows)
+            stats["rows"] += table.num_rows
+            table = table.append_column(_KEY, pa.array(keys, type=pa.uint64()))
+            schema = table.schema
+            if num_buckets == 1:
+                in_memory.append(table)
+                continue
+            buckets = ((keys >> np.uint64(32)) * np.uint64(num_buckets)) >> np.uint64(32)
+            order = np.argsort(buckets, kind="stable")
+            grouped = table.take(pa.array(order))
+            bounds = np.searchsorted(buckets[order], np.arange(num_buckets + 1))
+            for bucket in np.flatnonzero(np.diff(bounds)):
+                if writers[bucket] is None:
+                    sinks[bucket] = pa.OSFile(bucket_path(bucket), "wb")
+                    writers[bucket] = pa.ipc.new_stream(sinks[bucket], schema)
+                writers[bucket].write_table(grouped.slice(bounds[bucket], bounds[bucket + 1] - bounds[bucket]))
+        for bucket, writer in enumerate(writers):
+            if writer is not None:
+                writer.close()
+                sinks[bucket].close()
+                stats["spilled_bytes"] += os.path.getsize(bucket_path(bucket))
+
+        # Pass 2: gather each bucket, sorted by key.
+        for bucket in range(num_buckets):
+            if num_buckets == 1:
+                if not in_memory:
+                    return
+                table = pa.concat_tables(in_memory)
+                in_memory = []
+            elif writers[bucket] is None:
+                continue
+            else:
+                table = pa.ipc.open_stream(pa.memory_map(bucket_path(bucket), "r")).read_all()
+            order = np.argsort(table.column(_KEY).to_numpy(), kind="stable")
+            yield table.take(pa.array(order)).drop_columns([_KEY])
+    finally:
+        for bucket, writer in enumerate(writers):
+            if sinks[bucket] is not None and not sinks[bucket].closed:
+                writer.close()
+                sinks[bucket].close()
+        if num_buckets > 1 and os.path.isdir(spill_dir):
+            shutil.rmtree(spill_dir)
+
+
+def length_bucketed(
+    tables: Iterable[pa.Table],
+    batch_size: int,
+    pool_batches: int = 64,
+    seed: int = 0,
+    length_column: str = "length",
+) -> Iterator[pa.Table]:
+    """
+    Regroups a (shuffled) row stream into batches of similar token length.
+
+    Consecutive rows are collected in pools of `pool_batches` batches. Each pool is
+    sorted by length and cut into batches of `batch_size` rows, and the batches of a
+    pool are yielded in a seeded random order. Training therefore does not see every
+    short example first, while each batch pads only to a length close to its own.
+    Every batch has exactly `batch_size` rows except the very last one, so a loader
+    reading the output in order with that batch size gets these batches.
+    """
+    rng = np.random.default_rng(seed)
+    pool_rows = batch_size * max(1, pool_batches)
+    pending: List[pa.Table] = []
+    pending_rows = 0
+
+    def emit(pool: pa.Table) -> Iterator[pa.Table]:
+        by_length = pool.take(pa.array(np.argsort(row_lengths(pool, length_column), kind="stable")))
+        starts = np.arange(0, by_length.num_rows, batch_size)
+        for start in starts[rng.permutation(len(starts))]:
+            yield by_length.slice(start, batch_size)
+
+    for table in tables:
+        if table.num_rows == 0:
+            continue
+        pending.append(table)
+        pending_rows += table.num_rows
+        if pending_rows < pool_rows:
+            continue
+        combined = pa.concat_tables(pending)
+        full = (combined.num_rows // pool_rows) * pool_rows
+        for start in range(0, full, pool_rows):
+            yield from emit(combined.slice(start, pool_rows))
+        rest = combined.slice(full)
+        pending, pending_rows = ([rest], rest.num_rows) if rest.num_rows else ([], 0)
+    if pending_rows:
+        combined = pa.concat_tables(pending)
+        # Keep the one partial batch at the very end rather than at a random place.
+        whole = (combined.num_rows // batch_size) * batch_size
+        if whole:
+            yield from emit(combined.slice(0, whole))
+        if combined.num_rows > whole:
+            yield combined.slice(whole)
+
+
+class BatchPaddingMeter:
+    """
+    Measures the padding a loader would add when it pads each batch of `batch_size`
+    consecutive rows to that batch's longest row, as a share of all token slots.
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.real_tokens = 0
+        self.slots = 0
+        self._carry = np.zeros(0, dtype=np.int64)
+
+    def add(self, lengths: np.ndarray):
+        """Adds the lengths of the next rows in order."""
+        lengths = np.concatenate([self._carry, lengths])
+        whole = (len(lengths) // self.batch_size) * self.batch_size
+        batches = lengths[:whole].reshape(-1, self.batch_size)
+        self.real_tokens += int(batches.sum())
+        self.slots += int(batches.max(axis=1).sum()) * self.batch_size if len(batches) else 0
+        self._carry = lengths[whole:]
+
+    @property
+    def ratio(self) -> float:
+        """The padding share, counting the last partial batch."""
+        real, slots = self.real_tokens, self.slots
+        if len(self._carry):
+            real += int(self._carry.sum())
+            slots += int(self._carry.max()) * len(self._carry)
+        return 1 - real / slots if slots else 0.0
@@ -1,41 +1,460 @@
+import numpy as np
 import pandas as pd
-from typing import List, Dict
+from typing import Iterator, List, Dict, Optional, Tuple, Union
+from collections import Counter
+from contextlib import ExitStack
+import multiprocessing
+import hashlib
+import sqlite3
 import ast
+import sys
+import os
 
-def load_data(file_path: str) -> pd.DataFrame:
-    """Loads data from a JSONL file."""
-    return pd.read_json(file_path, lines=True)
+from data_pipeline.columnar import open_writer, read_frame, iter_frames, DEFAULT_ROWS_PER_SHARD
+from data_pipeline.metrics import current_metrics, timed
+from data_pipeline.tokenization import PROMPT_PREFIX, RESPONSE_SEPARATOR
 
-def is_valid_python_code(code: str) -> bool:
-    """Checks if a string is valid Python code."""
+def load_data(file_path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Loads data from a JSONL file or the columnar dataset written in its place."""
+    return read_frame(file_path, columns=columns)
+
+def syntax_error_reason(code: str) -> Optional[str]:
+    """Returns None if a string is valid Python code, otherwise the reason it is not."""
+    if not isinstance(code, str):
+        return f"NotAString: completion is {type(code).__name__}"
     try:
+        # The tree is dropped immediately; only the parse result matters.
         ast.parse(code)
-        return True
-    except SyntaxError:
-        return False
-
-def validate_code(df: pd.DataFrame) -> pd.DataFrame:
-    """Filters out rows with invalid Python code in the 'completion' column."""
-    initial_count = len(df)
-    df['is_valid'] = df['completion'].apply(is_valid_python_code)
-    valid_df = df[df['is_valid']].drop(columns=['is_valid'])
-    dropped_count = initial_count - len(valid_df)
-    if dropped_count > 0:
-        print(f"Validated data: Dropped {dropped_count} records with invalid code.")
+        return None
+    except SyntaxError as e:
+        return f"{type(e).__name__}: {e.msg} (line {e.lineno})"
+    except ValueError as e:
+        # e.g. null bytes in the source, which older Pythons report as ValueError.
+        return f"ValueError: {e}"
+
+def is_valid_python_code(code: str) -> bool:
+    """Checks if a string is valid Python code."""
+    return syntax_error_reason(code) is None
+
+def code_hash(code: str) -> str:
+    """Returns the content hash used to memoize validation results."""
+    return hashlib.sha256(code.encode('utf-8', errors='surrogatepass')).hexdigest()
+
+class ValidationMemo:
+    """
+    A persistent SQLite memo of validation results keyed by completion content hash.
+
+    The Python grammar changes between releases, so results are tied to the running
+    interpreter's major.minor version and discarded when it changes.
+    """
+
+    def __init__(self, memo_path: str):
+        directory = os.path.dirname(memo_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(memo_path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results (hash TEXT PRIMARY KEY, reason TEXT)")
+        version = f"{sys.version_info.major}.{sys.version_info.minor}"
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'python_version'").fetchone()
+        if row is None or row[0] != version:
+            self.conn.execute("DELETE FROM results")
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('python_version', ?)", (version,))
+        self.hits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get_many(self, hashes: List[str]) -> Dict[str, Optional[str]]:
+        """Returns {hash: reason} for the hashes already in the memo (reason is None for valid code)."""
+        found = {}
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for key, reason in self.conn.execute(f"SELECT hash, reason FROM results WHERE hash IN ({placeholders})", batch):
+                found[key] = reason
+        self.hits += len(found)
+        return found
+
+    def put_many(self, results: Dict[str, Optional[str]]):
+        """Stores {hash: reason} validation results."""
+        self.conn.executemany("INSERT OR REPLACE INTO results (hash, reason) VALUES (?, ?)", results.items())
+        self.conn.commit()
+
+    def close(self):
+        """Commits and closes the memo database."""
+        self.conn.commit()
+        self.conn.close()
+
+def find_invalid_code(
+    completions: List[str],
+    num_workers: int = 1,
+    chunk_size: int = 256,
+    memo: Optional[ValidationMemo] = None,
+    pool=None,
+) -> List[Optional[str]]:
+    """
+    Returns the rejection reason for every completion (None for valid code), in order.
+
+    Each distinct completion is parsed at most once: duplicates within the input share
+    one result, results already in `memo` are reused, and the remaining completions
+    are parsed across `num_workers` processes (or an existing `pool`, so callers
+    validating many batches pay the pool start-up once) before being added to the memo.
+    """
+    hashes = [code_hash(code) if isinstance(code, str) else None for code in completions]
+    unique: Dict[str, str] = {}
+    for key, code in zip(hashes, completions):
+        if key is not None and key not in unique:
+            unique[key] = code
+
+    results: Dict[str, Optional[str]] = memo.get_many(list(unique)) if memo is not None else {}
+    todo = [key for key in unique if key not in results]
+    codes = [unique[key] for key in todo]
+    if pool is not None and len(codes) > chunk_size:
+        reasons = pool.map(syntax_error_reason, codes, chunksize=chunk_size)
+    elif num_workers > 1 and len(codes) > chunk_size:
+        with multiprocessing.Pool(processes=num_workers) as new_pool:
+            reasons = new_pool.map(syntax_error_reason, codes, chunksize=chunk_size)
+    else:
+        reasons = [syntax_error_reason(code) for code in codes]
+    new_results = dict(zip(todo, reasons))
+    if memo is not None and new_results:
+        memo.put_many(new_results)
+    results.update(new_results)
+
+    return [results[key] if key is not None else syntax_error_reason(code) for key, code in zip(hashes, completions)]
+
+@timed("partition_valid_code")
+def partition_valid_code(
+    df: pd.DataFrame,
+    num_workers: int = 1,
+    memo: Optional[ValidationMemo] = None,
+    pool=None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Splits rows into (valid, rejected); the rejected rows get a 'rejection_reason' column."""
+    reasons = pd.Series(find_invalid_code(df['completion'].tolist(), num_workers=num_workers, memo=memo, pool=pool), index=df.index, dtype=object)
+    is_valid = reasons.isna()
+    return df[is_valid], df[~is_valid].assign(rejection_reason=reasons[~is_valid])
+
+def print_rejection_summary(reason_counts: Counter):
+    """Prints how many records were dropped for each rejection reason."""
+    total = sum(reason_counts.values())
+    if total == 0:
+        return
+    print(f"Validated data: Dropped {total} records with invalid code.")
+    for reason, count in reason_counts.most_common():
+        print(f"  {count:>8}  {reason}")
+
+def count_rejection_reasons(rejected_df: pd.DataFrame) -> Counter:
+    """Counts rejections by message, ignoring the line number so similar errors group together."""
+    return Counter(reason.rsplit(" (line", 1)[0] for reason in rejected_df['rejection_reason'])
+
+def _ensure_parent_dir(path: str):
+    """Creates the directory a file will be written to."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+@timed("validate_code")
+def validate_code(
+    df: pd.DataFrame,
+    num_workers: int = 1,
+    memo: Optional[ValidationMemo] = None,
+    rejected_path: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Filters out rows with invalid Python code in the 'completion' column.
+
+    The reason for each rejection is summarized on stdout and, if `rejected_path` is
+    given, the rejected rows are written there with a 'rejection_reason' column.
+    """
+    valid_df, rejected_df = partition_valid_code(df, num_workers=num_workers, memo=memo)
+    print_rejection_summary(count_rejection_reasons(rejected_df))
+    if rejected_path:
+        _ensure_parent_dir(rejected_path)
+        rejected_df.to_json(rejected_path, orient='records', lines=True)
     return valid_df
 
+def load_cached_tokenizer(tokenizer_name: Optional[str]):
+    """Loads a tokenizer from the local Hugging Face cache (or a local directory), or returns None; never downloads."""
+    if not tokenizer_name:
+        return None
+    try:
+        from transformers import AutoTokenizer
+
+        return AutoTokenizer.from_pretrained(tokenizer_name, local_files_only=True)
+    except (ImportError, OSError, ValueError):
+        return None
+
+def formatted_examples(df: pd.DataFrame) -> pd.Series:
+    """Returns the text tokenization will see for each row: the prompt template around 'prompt' and 'completion'."""
+    return PROMPT_PREFIX + df['prompt'].astype(str) + RESPONSE_SEPARATOR + df['completion'].astype(str)
+
+class LengthEstimator:
+    """
+    Estimates token counts from cheap, vectorized text features.
+
+    The estimate is a linear model of the number of characters, word runs and
+    punctuation characters. Uncalibrated, it is the four-characters-per-token rule of
+    `chunking.estimate_tokens`. `calibrate` fits the model by least squares to the
+    exact counts of a sample from `tokenizer` and sets `margin`, the relative error
+    the estimate stays within for a `quantile` of that sample. Every exact count
+    (calibration and `count`) is kept to report the estimator's error.
+    """
+
+    DEFAULT_COEFFICIENTS = (0.25, 0.0, 0.0, 1.0)
+
+    def __init__(self, tokenizer=None, quantile: float = 0.99):
+        self.tokenizer = tokenizer
+        self.quantile = quantile
+        self.coefficients = np.array(self.DEFAULT_COEFFICIENTS)
+        self.margin = 0.0
+        self.calibrated = False
+        self._estimated: List[np.ndarray] = []
+        self._exact: List[np.ndarray] = []
+
+    @staticmethod
+    def features(texts: pd.Series) -> np.ndarray:
+        """Returns the (characters, word runs, punctuation, 1) feature matrix of the texts."""
+        return np.column_stack([
+            texts.str.len().to_numpy(dtype=np.float64),
+            texts.str.count(r"\w+").to_numpy(dtype=np.float64),
+            texts.str.count(r"[^\w\s]").to_numpy(dtype=np.float64),
+            np.ones(len(texts)),
+        ])
+
+    def estimate(self, texts: pd.Series) -> np.ndarray:
+        """Returns the estimated token count of each text."""
+        if len(texts) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.maximum(np.rint(self.features(texts) @ self.coefficients), 1).astype(np.int64)
+
+    def _tokenize(self, texts: pd.Series) -> np.ndarray:
+        """Returns the exact token count of each text (special tokens included, as tokenization adds them)."""
+        return np.array([len(ids) for ids in self.tokenizer(texts.tolist())["input_ids"]], dtype=np.int64)
+
+    def count(self, texts: pd.Series, estimates: Optional[np.ndarray] = None) -> np.ndarray:
+        """Returns the exact token counts from the tokenizer, recording the estimator's error on them."""
+        exact = self._tokenize(texts)
+        self._estimated.append(self.estimate(texts) if estimates is None else estimates)
+        self._exact.append(exact)
+        return exact
+
+    def calibrate(self, texts: pd.Series):
+        """Fits the model and the margin to exact counts of `texts`."""
+        if self.tokenizer is None or len(texts) == 0:
+            return
+        exact = self._tokenize(texts)
+        self.coefficients = np.linalg.lstsq(self.features(texts), exact.astype(np.float64), rcond=None)[0]
+        estimates = self.estimate(texts)
+        self._estimated.append(estimates)
+        self._exact.append(exact)
+        self.margin = float(np.quantile(np.abs(estimates - exact) / np.maximum(exact, 1), self.quantile))
+        self.calibrated = True
+
+    def error_summary(self) -> Dict[str, float]:
+        """Mean absolute relative error, mean signed error in tokens and samples, over every exact count."""
+        if not self._exact:
+            return {"samples": 0}
+        estimated, exact = np.concatenate(self._estimated), np.concatenate(self._exact)
+        relative = np.abs(estimated - exact) / np.maximum(exact, 1)
+        return {
+            "samples": len(exact),
+            "mean_abs_pct_error": float(relative.mean() * 100),
+            "p99_abs_pct_error": float(np.quantile(relative, 0.99) * 100),
+            "bias_tokens": float((estimated - exact).mean()),
+        }
+
+class LengthBudget:
+    """
+    Splits records whose formatted example would exceed `max_tokens` tokens off
+    before tokenization, which would otherwise silently truncate their response.
+
+    Token counts are estimated (LengthEstimator). With a tokenizer, the estimator is
+    calibrated on the first `calibration_samples` records, and with
+    `verify_borderline` records whose estimate is within the estimator's margin of
+    the budget are counted exactly, so only those pay for tokenization. Records
+    clearly over the budget are routed without being tokenized. `stats` counts the
+    records routed and checked, and the tokens tokenization no longer processes.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        estimator: Optional[LengthEstimator] = None,
+        verify_borderline: bool = True,
+        calibration_samples: int = 2000,
+    ):
+        self.max_tokens = max_tokens
+        self.estimator = estimator or LengthEstimator()
+        self.verify_borderline = verify_borderline and self.estimator.tokenizer is not None
+        self.calibration_samples = calibration_samples
+        self.stats = {"records": 0, "over_budget": 0, "checked": 0, "tokens_not_tokenized": 0, "tokens_over_budget": 0}
+
+    @classmethod
+    def from_config(cls, config: Dict) -> Optional["LengthBudget"]:
+        """
+        Builds the budget from 'processing.length_budget' and 'tokenization', or returns
+        None when it is disabled. Without a locally cached tokenizer the estimate cannot
+        be calibrated or checked, so records are not routed on it (None, with a warning).
+        """
+        budget_config = (config.get('processing') or {}).get('length_budget') or {}
+        if not budget_config.get('enabled', False):
+            return None
+        tokenization_config = config.get('tokenization') or {}
+        max_tokens = budget_config.get('max_tokens') or tokenization_config.get('max_length', 512)
+        if (tokenization_config.get('packing') or {}).get('enabled', False) and not budget_config.get('max_tokens'):
+            # Packing truncates to max_length - 1 and appends EOS.
+            max_tokens -= 1
+        tokenizer = load_cached_tokenizer(budget_config.get('tokenizer_name') or tokenization_config.get('model_name'))
+        if tokenizer is None:
+            print("[WARN] Length budget is enabled, but no tokenizer is in the local cache to calibrate its estimate; "
+                  "records are NOT routed by length. Cache length_budget.tokenizer_name (or tokenization.model_name) "
+                  "to enable it.")
+            return None
+        return cls(
+            max_tokens,
+            LengthEstimator(tokenizer, quantile=budget_config.get('borderline_quantile', 0.99)),
+            verify_borderline=budget_config.get('verify_borderline', True),
+            calibration_samples=budget_config.get('calibration_samples', 2000),
+        )
+
+    @timed("length_budget")
+    def split(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Splits rows into (within budget, over budget). Over-budget rows get an
+        'estimated_tokens' column and a 'token_count' column (exact where it was checked).
+        """
+        texts = formatted_examples(df)
+        estimator = self.estimator
+        if estimator.tokenizer is not None and not estimator.calibrated and len(df):
+            estimator.calibrate(texts.iloc[:self.calibration_samples])
+        estimates = estimator.estimate(texts)
+        counts = estimates.astype(np.float64)
+        exact = np.zeros(len(df), dtype=bool)
+        if self.verify_borderline:
+            borderline = np.abs(estimates - self.max_tokens) <= estimator.margin * estimates + 1
+            if borderline.any():
+                counts[borderline] = estimator.count(texts[borderline], estimates[borderline])
+                exact[borderline] = True
+        over = counts > self.max_tokens
+        self.stats["records"] += len(df)
+        self.stats["over_budget"] += int(over.sum())
+        self.stats["checked"] += int(exact.sum())
+        self.stats["tokens_not_tokenized"] += int(counts[over].sum())
+        self.stats["tokens_over_budget"] += int((counts[over] - self.max_tokens).sum())
+        over_df = df[over].assign(estimated_tokens=estimates[over], token_count=np.where(exact[over], counts[over], np.nan))
+        return df[~over], over_df
+
+    def report(self) -> Dict[str, float]:
+        """Prints the budget summary and adds it to the active stage's metrics."""
+        stats = dict(self.stats)
+        errors = self.estimator.error_summary()
+        print(f"Length budget ({self.max_tokens} tokens): routed {stats['over_budget']} of {stats['records']} records "
+              f"over budget, {stats['checked']} borderline records counted exactly. Tokenization skips "
+              f"{stats['tokens_not_tokenized']} tokens, {stats['tokens_over_budget']} of which would have been truncated.")
+        if errors["samples"]:
+            print(f"Length estimator error over {errors['samples']} exact counts: {errors['mean_abs_pct_error']:.1f}% mean, "
+                  f"{errors['p99_abs_pct_error']:.1f}% p99, bias {errors['bias_tokens']:+.1f} tokens.")
+        stats.update({f"estimator_{name}": value for name, value in errors.items()})
+        metrics = current_metrics()
+        if metrics is not None:
+            for name, value in stats.items():
+                metrics.incr(f"length_budget_{name}", value)
+        return stats
+
+def to_alpaca_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Builds the Alpaca-format columns from 'prompt' and 'completion' column-wise, without iterating rows."""
+    return pd.DataFrame({
+        "instruction": df["prompt"].to_numpy(),
+        "input": "",
+        "output": df["completion"].to_numpy(),
+    })
+
 def transform_to_alpaca_format(df: pd.DataFrame) -> List[Dict[str, str]]:
     """Transforms a DataFrame with 'prompt' and 'completion' columns to Alpaca format."""
-    processed_data = []
-    for _, row in df.iterrows():
-        processed_data.append({
-            "instruction": row["prompt"],
-            "input": "",
-            "output": row["completion"]
-        })
-    return processed_data
-
-def save_processed_data(data: List[Dict[str, str]], output_path: str):
-    """Saves the processed data to a JSONL file."""
-    df = pd.DataFrame(data)
-    df.to_json(output_path, orient='records', lines=True) 
\ No newline at end of file
+    return to_alpaca_frame(df).to_dict('records')
+
+def save_processed_data(
+    data: Union[pd.DataFrame, List[Dict[str, str]]],
+    output_path: str,
+    output_format: str = "jsonl",
+    rows_per_shard: int = DEFAULT_ROWS_PER_SHARD,
+):
+    """Saves the processed data (a DataFrame or a list of records) as JSONL or a columnar dataset."""
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+    with open_writer(output_path, output_format, rows_per_shard=rows_per_shard) as writer:
+        writer.write_frame(df)
+
+def iter_data_batches(file_path: str, batch_size: int, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """Reads a JSONL file (or its columnar counterpart) in DataFrames of at most `batch_size` rows."""
+    yield from iter_frames(file_path, batch_size, columns=columns)
+
+def append_jsonl(df: pd.DataFrame, out):
+    """Appends a DataFrame's rows to an open JSONL file."""
+    if len(df) > 0:
+        out.write(df.to_json(orient='records', lines=True))
+
+def process_in_batches(
+    input_path: str,
+    output_path: str,
+    batch_size: int,
+    num_workers: int = 1,
+    memo: Optional[ValidationMemo] = None,
+    rejected_path: Optional[str] = None,
+    output_format: str = "jsonl",
+    rows_per_shard: int = DEFAULT_ROWS_PER_SHARD,
+    length_budget: Optional[LengthBudget] = None,
+    overflow_path: Optional[str] = None,
+) -> Dict[str, int]:
+    """
+    Validates and transforms the refined data to Alpaca format in bounded batches.
+
+    Each batch is read, validated, transformed column-wise and appended to the output
+    before the next one is read, so peak memory is set by `batch_size` rather than
+    the size of the dataset. Only the 'prompt' and 'completion' columns are read.
+    With a `length_budget`, valid records over the token budget are written to
+    `overflow_path` instead of the output.
+    Returns the number of records read, written, rejected and over budget.
+    """
+    if length_budget is None:
+        overflow_path = None
+    for path in (rejected_path, overflow_path):
+        if path:
+            _ensure_parent_dir(path)
+    counts = {"read": 0, "written": 0, "rejected": 0, "over_budget": 0}
+    reasons: Counter = Counter()
+    metrics = current_metrics()
+    pool = multiprocessing.Pool(processes=num_workers) if num_workers > 1 else None
+    try:
+        with ExitStack() as files:
+            out = files.enter_context(open_writer(output_path, output_format, rows_per_shard=rows_per_shard))
+            rejected_out = files.enter_context(open(rejected_path, 'w', encoding='utf-8')) if rejected_path else None
+            overflow_out = files.enter_context(open(overflow_path, 'w', encoding='utf-8')) if overflow_path else None
+            for batch in iter_data_batches(input_path, batch_size, columns=['prompt', 'completion']):
+                valid_df, rejected_df = partition_valid_code(batch, num_workers=num_workers, memo=memo, pool=pool)
+                if length_budget is not None:
+                    valid_df, over_df = length_budget.split(valid_df)
+                    if overflow_out is not None:
+                        append_jsonl(over_df, overflow_out)
+                    counts["over_budget"] += len(over_df)
+                out.write_frame(to_alpaca_frame(valid_df))
+                if rejected_out is not None:
+                    append_jsonl(rejected_df, rejected_out)
+                counts["read"] += len(batch)
+                counts["written"] += len(valid_df)
+                counts["rejected"] += len(rejected_df)
+                reasons.update(count_rejection_reasons(rejected_df))
+                if metrics is not None:
+                    metrics.progress(counts["read"])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    print_rejection_summary(reasons)
+    if length_budget is not None:
+        length_budget.report()
+    return counts
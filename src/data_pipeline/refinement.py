@@ -0,0 +1,359 @@
+import asyncio
+import itertools
+import random
+import time
+from collections import deque
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Type
+
+from data_pipeline.chunking import estimate_tokens
+from data_pipeline.llm_cache import ResponseCache
+from data_pipeline.metrics import current_metrics
+
+# Records whose docstring is judged at or below this score get a generated docstring.
+LOW_SCORE_THRESHOLD = 2
+
+# Rough token cost of each call beyond its code/docstring: the instruction preamble
+# plus the expected response. Used only to pace requests against a tokens/min limit.
+JUDGE_OVERHEAD_TOKENS = 200
+GENERATOR_OVERHEAD_TOKENS = 400
+
+JudgeFn = Callable[[str, str], Awaitable[Dict]]
+GeneratorFn = Callable[[str], Awaitable[str]]
+# Judges several (docstring, code) pairs in one request; returns one verdict per pair, None where parsing failed.
+BatchJudgeFn = Callable[[List[Tuple[str, str]]], Awaitable[List[Optional[Dict]]]]
+
+
+class TransientLLMError(Exception):
+    """Raised by an LLM call for errors that are worth retrying (rate limits, timeouts, 5xx)."""
+
+
+class MalformedLLMResponse(Exception):
+    """
+    Raised by an LLM call whose response could not be parsed. `fallback` is the result
+    to use instead; it is never cached, so a later run asks again.
+    """
+
+    def __init__(self, message: str, fallback):
+        super().__init__(message)
+        self.fallback = fallback
+
+
+async def _as_async(items: Iterable) -> AsyncIterator:
+    """Wraps a plain iterable as an async iterator."""
+    for item in items:
+        yield item
+
+
+class TokenBucket:
+    """
+    An asyncio token bucket that refills continuously at `rate_per_minute`.
+
+    The bucket holds at most `capacity` tokens (one minute's worth by default), so
+    short bursts are allowed but the long-run rate never exceeds the limit.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        """Adds the tokens accrued since the last refill, up to the capacity."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_second)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        """Waits until `amount` tokens are available and takes them."""
+        # A single request larger than the bucket would otherwise wait forever.
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate_per_second)
+                self._refill()
+            self.tokens -= amount
+
+
+class AsyncRefiner:
+    """
+    Refines records concurrently: judges each docstring and regenerates low-quality ones.
+
+    At most `concurrency` LLM calls are in flight at once, requests and estimated tokens
+    are paced by optional per-minute token buckets, and calls that raise one of
+    `transient_exceptions` are retried with jittered exponential backoff. Results are
+    always produced in input order, whatever order the calls finish in.
+
+    If a `cache` is given, it is checked before any rate limit or concurrency slot is
+    taken, keyed by the judge/generator model names and `prompt_version`. Verdicts
+    from batched requests are cached apart, keyed by `batch_prompt_version` too.
+
+    If a `batch_judge` is given, records are judged `judge_batch_size` at a time in a
+    single request. Records whose verdict cannot be recovered from the batched
+    response are re-queued and judged on their own with `judge`.
+
+    A call raising MalformedLLMResponse yields its fallback, which is not cached.
+    """
+
+    def __init__(
+        self,
+        judge: JudgeFn,
+        generator: GeneratorFn,
+        concurrency: int = 8,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        transient_exceptions: Tuple[Type[BaseException], ...] = (TransientLLMError,),
+        seed: Optional[int] = None,
+        cache: Optional[ResponseCache] = None,
+        judge_model: str = "",
+        generator_model: str = "",
+        prompt_version: str = "",
+        batch_prompt_version: str = "",
+        batch_judge: Optional[BatchJudgeFn] = None,
+        judge_batch_size: int = 1,
+    ):
+        self.judge = judge
+        self.generator = generator
+        self.concurrency = max(1, concurrency)
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.transient_exceptions = transient_exceptions
+        self.rng = random.Random(seed)
+        self.cache = cache
+        self.models = {"judge": judge_model, "generator": generator_model, "batch_judge": judge_model}
+        self.prompt_versions = {
+            "judge": prompt_version,
+            "generator": prompt_version,
+            "batch_judge": f"{prompt_version}/{batch_prompt_version}",
+        }
+        self.batch_judge = batch_judge
+        self.judge_batch_size = max(1, judge_batch_size) if batch_judge is not None else 1
+        self.stats = {
+            "judge_calls": 0, "batch_judge_calls": 0, "requeued": 0,
+            "generator_calls": 0, "retries": 0, "regenerated": 0, "cache_hits": 0,
+            "malformed_responses": 0,
+        }
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Returns a 'full jitter' delay: uniform between 0 and the capped exponential backoff."""
+        return self.rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _call(self, kind: str, fn: Callable[..., Awaitable], estimated_tokens: int, *args):
+        """
+        Runs one LLM call under the concurrency limit and rate limits, retrying transient errors.
+        The latency of every attempt goes into the active stage's `llm.<kind>` histogram.
+        """
+        metrics = current_metrics()
+        attempt = 0
+        while True:
+            if self._request_bucket is not None:
+                await self._request_bucket.acquire(1)
+            if self._token_bucket is not None:
+                await self._token_bucket.acquire(estimated_tokens)
+            try:
+                async with self._semaphore:
+                    start = time.perf_counter()
+                    try:
+                        return await fn(*args)
+                    finally:
+                        if metrics is not None:
+                            metrics.observe(f"llm.{kind}", time.perf_counter() - start)
+            except self.transient_exceptions as e:
+                if metrics is not None:
+                    metrics.incr(f"llm.{kind}.transient_errors")
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                attempt += 1
+                self.stats["retries"] += 1
+                print(f"  [RETRY] {type(e).__name__}: retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    def _cache_key(self, kind: str, *args: str) -> Optional[str]:
+        """Returns the cache key for a call, or None when caching is disabled."""
+        if self.cache is None:
+            return None
+        return ResponseCache.make_key(kind, self.models[kind], self.prompt_versions[kind], *args)
+
+    def _cache_get(self, key: Optional[str], *fallbacks: str):
+        """Looks a key (or else the first cached of `fallbacks`) up in the cache, counting hits."""
+        if key is None:
+            return None
+        cached = self.cache.get(key, *fallbacks)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+        return cached
+
+    async def _cached_call(self, kind: str, fn: Callable[..., Awaitable], estimated_tokens: int, *args, lookup: bool = True):
+        """
+        Returns a cached response for the call if there is one, otherwise makes the call
+        and caches it, unless the response was malformed and replaced by a fallback.
+        `lookup=False` skips the lookup for a call already known to miss.
+        """
+        key = self._cache_key(kind, *args)
+        cached = self._cache_get(key) if lookup else None
+        if cached is not None:
+            return cached
+        self.stats[f"{kind}_calls"] += 1
+        try:
+            result = await self._call(kind, fn, estimated_tokens, *args)
+        except MalformedLLMResponse as e:
+            self.stats["malformed_responses"] += 1
+            return e.fallback
+        if key is not None:
+            self.cache.put(key, result)
+        return result
+
+    async def _judge_one(self, docstring: str, code: str, lookup: bool = True) -> Dict:
+        """Judges a single docstring."""
+        estimated_tokens = estimate_tokens(docstring) + estimate_tokens(code) + JUDGE_OVERHEAD_TOKENS
+        return await self._cached_call("judge", self.judge, estimated_tokens, docstring, code, lookup=lookup)
+
+    async def _judge_many(self, pairs: List[Tuple[str, str]]) -> List[Dict]:
+        """
+        Judges several docstrings, packing the ones not in the cache into one batched
+        request when a batch judge is configured, and re-judging any item the batched
+        response did not cover individually.
+        """
+        if self.batch_judge is None or len(pairs) == 1:
+            return list(await asyncio.gather(*(self._judge_one(docstring, code) for docstring, code in pairs)))
+
+        verdicts: List[Optional[Dict]] = [None] * len(pairs)
+        keys = [self._cache_key("batch_judge", docstring, code) for docstring, code in pairs]
+        misses = []
+        for i, key in enumerate(keys):
+            # A verdict cached from a single judge call (e.g. a re-queued item) serves here too.
+            verdicts[i] = self._cache_get(key, self._cache_key("judge", *pairs[i]))
+            if verdicts[i] is None:
+                misses.append(i)
+
+        requeued = misses if len(misses) == 1 else []
+        if len(misses) > 1:
+            batch = [pairs[i] for i in misses]
+            estimated_tokens = sum(estimate_tokens(d) + estimate_tokens(c) for d, c in batch) + JUDGE_OVERHEAD_TOKENS
+            self.stats["batch_judge_calls"] += 1
+            results = await self._call("batch_judge", self.batch_judge, estimated_tokens, batch)
+            for i, result in zip(misses, results):
+                if result is None:
+                    requeued.append(i)
+                    continue
+                verdicts[i] = result
+                if keys[i] is not None:
+                    self.cache.put(keys[i], result)
+            self.stats["requeued"] += len(requeued)
+
+        # Re-queued items already missed the cache above.
+        singles = await asyncio.gather(*(self._judge_one(*pairs[i], lookup=False) for i in requeued))
+        for i, verdict in zip(requeued, singles):
+            verdicts[i] = verdict
+        return verdicts
+
+    async def refine_record(self, record: Dict[str, str], judgement: Optional[Dict] = None) -> Dict[str, str]:
+        """Judges one record's docstring (unless a judgement is supplied) and replaces it if the score is low."""
+        docstring = record["prompt"]
+        code = record["completion"]
+
+        if judgement is None:
+            judgement = await self._judge_one(docstring, code)
+        if judgement.get("score", 0) <= LOW_SCORE_THRESHOLD:
+            self.stats["regenerated"] += 1
+            docstring = await self._cached_call("generator", self.generator, estimate_tokens(code) + GENERATOR_OVERHEAD_TOKENS, code)
+        return {"prompt": docstring, "completion": code}
+
+    async def refine_group(self, records: List[Dict[str, str]], judgements: List[Optional[Dict]]) -> List[Dict[str, str]]:
+        """Refines a group of records, judging together all of those without a supplied judgement."""
+        missing = [i for i, judgement in enumerate(judgements) if judgement is None]
+        if missing:
+            judgements = list(judgements)
+            verdicts = await self._judge_many([(records[i]["prompt"], records[i]["completion"]) for i in missing])
+            for i, verdict in zip(missing, verdicts):
+                judgements[i] = verdict
+        return list(await asyncio.gather(*(self.refine_record(r, j) for r, j in zip(records, judgements))))
+
+    async def iter_refined(
+        self,
+        records: Iterable[Dict[str, str]],
+        judgements: Optional[Iterable[Optional[Dict]]] = None,
+    ) -> AsyncIterator[Dict[str, str]]:
+        """
+        Yields refined records in input order.
+
+        `judgements`, if given, supplies a verdict (or None) per record, e.g. from an
+        offline batch job; those records skip the judge.
+        """
+        if judgements is None:
+            judgements = itertools.repeat(None)
+        async for refined in self.iter_refined_pairs(_as_async(zip(records, judgements))):
+            yield refined
+
+    async def iter_refined_pairs(
+        self,
+        pairs: AsyncIterable[Tuple[Dict[str, str], Optional[Dict]]],
+    ) -> AsyncIterator[Dict[str, str]]:
+        """
+        Yields refined records in input order from an async stream of (record, judgement) pairs.
+
+        Records are grouped `judge_batch_size` at a time and the groups are scheduled
+        through a sliding window a few times wider than the concurrency limit, so a
+        slow group at the head does not starve the others while the number of
+        pending results stays bounded. Because the input is consumed asynchronously,
+        a slow upstream producer never blocks the calls already in flight.
+        """
+        # Synchronization primitives must be created inside the running event loop.
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._request_bucket = TokenBucket(self.requests_per_minute) if self.requests_per_minute else None
+        self._token_bucket = TokenBucket(self.tokens_per_minute) if self.tokens_per_minute else None
+
+        window = 4 * self.concurrency
+        metrics = current_metrics()
+        done = 0
+        pending = deque()
+        group: List[Dict[str, str]] = []
+        group_judgements: List[Optional[Dict]] = []
+        try:
+            async for record, judgement in pairs:
+                group.append(record)
+                group_judgements.append(judgement)
+                if len(group) < self.judge_batch_size:
+                    continue
+                pending.append(asyncio.ensure_future(self.refine_group(group, group_judgements)))
+                group, group_judgements = [], []
+                if len(pending) >= window:
+                    refined_group = await pending.popleft()
+                    for refined in refined_group:
+                        yield refined
+                    done += len(refined_group)
+                    if metrics is not None:
+                        metrics.progress(done)
+            if group:
+                pending.append(asyncio.ensure_future(self.refine_group(group, group_judgements)))
+            while pending:
+                refined_group = await pending.popleft()
+                for refined in refined_group:
+                    yield refined
+                done += len(refined_group)
+                if metrics is not None:
+                    metrics.progress(done)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _collect(self, records, judgements=None) -> List[Dict[str, str]]:
+        """Gathers iter_refined into a list."""
+        return [record async for record in self.iter_refined(records, judgements)]
+
+    def run(
+        self,
+        records: Iterable[Dict[str, str]],
+        judgements: Optional[Iterable[Optional[Dict]]] = None,
+    ) -> List[Dict[str, str]]:
+        """Refines all records on a fresh event loop and returns them in input order."""
+        return asyncio.run(self._collect(records, judgements))
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import queue
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List
+
+_DONE = object()
+
+# How often a blocked producer wakes up to check whether the consumer has gone away.
+_POLL_SECONDS = 0.1
+
+
+class StageCancelled(Exception):
+    """Raised inside a producer whose consumer stopped reading, so its thread can exit."""
+
+
+class _StageFailure:
+    """Carries an exception from a producer thread to the consumer."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class StageQueue:
+    """
+    A bounded hand-off between two pipeline stages running in different threads.
+
+    Items are batches (lists of records or DataFrames). `put` blocks while the
+    queue holds `maxsize` items, so a fast producer is held back by a slow consumer
+    and memory stays bounded by the queue depth. The queue also implements the
+    `write_records`/`write_jsonl` writer interface, so code that streams records to
+    an output file can stream them to the next stage unchanged.
+    """
+
+    def __init__(self, name: str, maxsize: int = 8):
+        self.name = name
+        self._queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._cancelled = threading.Event()
+        self.items = 0
+
+    def _offer(self, item: Any) -> bool:
+        """Waits for room and enqueues `item`; returns False if the consumer went away first."""
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def put(self, item: Any):
+        """Hands an item to the consumer, waiting while the queue is full."""
+        if not self._offer(item):
+            raise StageCancelled(self.name)
+        self.items += 1
+
+    def write_records(self, records: List[Dict]):
+        """Hands a batch of records to the consumer (empty batches are dropped)."""
+        if records:
+            self.put(list(records))
+
+    def write_jsonl(self, text: str):
+        """Hands records given as JSONL text to the consumer."""
+        self.write_records([json.loads(line) for line in text.splitlines() if line])
+
+    def close(self):
+        """Signals the end of the stream."""
+        self._offer(_DONE)
+
+    def fail(self, error: BaseException):
+        """Ends the stream with an error that is re-raised in the consumer."""
+        self._offer(_StageFailure(error))
+
+    def cancel(self):
+        """Tells the producer to stop; called when the consumer gives up early."""
+        self._cancelled.set()
+
+    def get(self) -> Any:
+        """Returns the next item, `_DONE` at the end of the stream, or raises the producer's error."""
+        item = self._queue.get()
+        if isinstance(item, _StageFailure):
+            raise RuntimeError(f"Pipeline stage '{self.name}' failed: {item.error}") from item.error
+        return item
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            while True:
+                item = self.get()
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            self.cancel()
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        # Waiting happens on a worker thread so the event loop keeps serving the
+        # calls already in flight while the upstream stage catches up.
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                item = await loop.run_in_executor(None, self.get)
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            self.cancel()
+
+
+def start_stage(name: str, produce: Callable[[StageQueue], None], maxsize: int = 8) -> StageQueue:
+    """
+    Runs `produce(out)` on a background thread and returns the queue it writes to.
+
+    The stream is closed when `produce` returns. An exception ends the stream and
+    is re-raised in whichever stage consumes the queue.
+    """
+    out = StageQueue(name, maxsize=maxsize)
+
+    def target():
+        try:
+            produce(out)
+        except StageCancelled:
+            return
+        except BaseException as error:
+            out.fail(error)
+            return
+        out.close()
+
+    threading.Thread(target=target, name=f"stage-{name}", daemon=True).start()
+    return out
+
+
+class TeeWriter:
+    """Forwards every batch to the next stage and, optionally, to an intermediate file writer."""
+
+    def __init__(self, stage: StageQueue, writer=None):
+        self.stage = stage
+        self.writer = writer
+
+    def write_records(self, records: List[Dict]):
+        """Writes a batch of records to both sinks."""
+        if self.writer is not None:
+            self.writer.write_records(records)
+        self.stage.write_records(records)
+
+    def write_jsonl(self, text: str):
+        """Writes JSONL text to both sinks."""
+        if self.writer is not None:
+            self.writer.write_jsonl(text)
+        self.stage.write_jsonl(text)
+
+    def write_frame(self, df):
+        """Writes a DataFrame batch to both sinks."""
+        if self.writer is not None:
+            self.writer.write_frame(df)
+        if len(df) > 0:
+            self.stage.put(df)
+
+    def close(self):
+        """Closes the intermediate file, if any."""
+        if self.writer is not None:
+            self.writer.close()
+
+
+def rebatch(batches, batch_size: int) -> Iterator[List[Dict]]:
+    """Regroups a stream of record lists into lists of `batch_size` records (the last may be shorter)."""
+    pending: List[Dict] = []
+    for batch in batches:
+        pending.extend(batch)
+        while len(pending) >= batch_size:
+            yield pending[:batch_size]
+            pending = pending[batch_size:]
+    if pending:
+        yield pending
+
@@ -0,0 +1,176 @@
+import os
+import copy
+import json
+import hashlib
+import bisect
+import argparse
+import itertools
+from typing import Dict, Iterable, List, Optional
+
+from data_pipeline.checkpoint import atomic_write
+
+# Bump this when the plan layout changes; older plans are then rebuilt.
+PLAN_VERSION = 1
+
+# Config entries (section, key) that name a stage's own output or state. A sharded
+# run writes each of them to a per-shard path so concurrent shards never collide.
+# Shared caches (LLM responses, validation memo) stay shared: they are keyed by content.
+SHARDED_PATHS = (
+    ("data", "extracted_path"),
+    ("data", "deduped_path"),
+    ("data", "llm_refined_path"),
+    ("data", "final_alpaca_path"),
+    ("data", "tokenized_path"),
+    ("extraction", "manifest_path"),
+    ("refinement", "batch_job_request_path"),
+    ("refinement", "batch_job_result_path"),
+    ("processing", "rejected_path"),
+    ("processing", "overflow_path"),
+)
+
+
+def shard_name(index: int, count: int) -> str:
+    """Returns the suffix naming one shard, e.g. 'shard-00002-of-00008'."""
+    return f"shard-{index:05d}-of-{count:05d}"
+
+
+def shard_path(path: str, index: int, count: int) -> str:
+    """
+    Returns the per-shard version of a data path: 'extracted_pairs.jsonl' becomes
+    'extracted_pairs.shard-00002-of-00008.jsonl' and 'data/tokenized' becomes
+    'data/tokenized.shard-00002-of-00008'.
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}.{shard_name(index, count)}{ext}"
+
+
+def shard_config(config: Dict, index: int, count: int) -> Dict:
+    """
+    Returns a copy of the config whose stage outputs (SHARDED_PATHS) and metrics
+    directory belong to shard `index` of `count`, with the shard recorded under
+    'sharding'. Input paths derived from these (e.g. refinement reading the deduped
+    data) follow automatically.
+    """
+    if not 0 <= index < count:
+        raise ValueError(f"Shard index {index} is out of range for {count} shards.")
+    config = copy.deepcopy(config)
+    for section, key in SHARDED_PATHS:
+        values = config.get(section) or {}
+        if values.get(key):
+            values[key] = shard_path(values[key], index, count)
+    metrics_config = config.get("metrics") or {}
+    if metrics_config.get("metrics_dir"):
+        metrics_config["metrics_dir"] = os.path.join(metrics_config["metrics_dir"], shard_name(index, count))
+    config.setdefault("sharding", {}).update({"shard_index": index, "shard_count": count})
+    return config
+
+
+def balanced_partition(sizes: List[int], num_shards: int) -> List[int]:
+    """
+    Splits a sequence of items with the given byte sizes into `num_shards` contiguous,
+    non-empty ranges of about equal total size, and returns the start index of each.
+
+    Shard k starts at the first item whose preceding bytes reach k/num_shards of the
+    total, moved if needed so every shard keeps at least one item. Keeping shards
+    contiguous means concatenating their outputs in shard order gives the same record
+    order as an unsharded run.
+    """
+    num_shards = max(1, min(num_shards, len(sizes)))
+    before = list(itertools.accumulate(sizes, initial=0))
+    total = before[-1]
+    starts = [0]
+    for k in range(1, num_shards):
+        target = bisect.bisect_left(before, total * k / num_shards)
+        starts.append(min(max(target, starts[-1] + 1), len(sizes) - (num_shards - k)))
+    return starts
+
+
+def listing_digest(file_paths: Iterable[str]) -> str:
+    """Hashes an ordered file listing, so a plan can tell whether the repository's files changed."""
+    digest = hashlib.sha256()
+    for path in file_paths:
+        digest.update(path.encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+def build_plan(repo_path: str, file_paths: Iterable[str], num_shards: int) -> Dict:
+    """
+    Partitions the (sorted) Python files of a repository into byte-balanced shards.
+    There are fewer shards than requested when there are fewer files.
+    """
+    file_paths = list(file_paths)
+    sizes = [os.path.getsize(path) for path in file_paths]
+    starts = balanced_partition(sizes, num_shards) if file_paths else [0]
+    ends = starts[1:] + [len(file_paths)]
+    shards = [
+        {"index": index, "bytes": sum(sizes[start:end]), "files": file_paths[start:end]}
+        for index, (start, end) in enumerate(zip(starts, ends))
+    ]
+    return {
+        "version": PLAN_VERSION,
+        "repo_path": os.path.abspath(repo_path),
+        "requested_shards": num_shards,
+        "num_shards": len(shards),
+        "total_bytes": sum(sizes),
+        "listing_digest": listing_digest(file_paths),
+        "shards": shards,
+    }
+
+
+def write_plan(path: str, plan: Dict) -> Dict:
+    """Writes a shard plan atomically, so concurrent shards see it whole, and returns it."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    atomic_write(path, json.dumps(plan, indent=2))
+    return plan
+
+
+def load_plan(
+    path: str,
+    repo_path: Optional[str] = None,
+    num_shards: Optional[int] = None,
+    file_paths: Optional[Iterable[str]] = None,
+) -> Optional[Dict]:
+    """
+    Reads a shard plan, or returns None if there is none or it was made for another
+    repository, shard count or (when `file_paths` is given) file listing.
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        return None
+    if repo_path is not None and plan.get("repo_path") != os.path.abspath(repo_path):
+        return None
+    if num_shards is not None and num_shards not in (plan.get("requested_shards"), plan.get("num_shards")):
+        return None
+    if file_paths is not None and plan.get("listing_digest") != listing_digest(file_paths):
+        return None
+    return plan
+
+
+def shard_files(plan: Dict, index: int, count: int) -> List[str]:
+    """Returns the files of shard `index`, checking that the plan has `count` shards."""
+    if plan["num_shards"] != count:
+        raise ValueError(
+            f"The shard plan has {plan['num_shards']} shards (the repository has too few files for more), "
+            f"not {count}; run every stage with --shard-count {plan['num_shards']}."
+        )
+    return plan["shards"][index]["files"]
+
+
+def add_shard_arguments(parser: argparse.ArgumentParser):
+    """Adds the --shard-index/--shard-count options every stage script accepts."""
+    parser.add_argument("--shard-index", type=int, default=None,
+                        help="Run this stage on one shard of the plan (0-based).")
+    parser.add_argument("--shard-count", type=int, default=None,
+                        help="Number of shards in the plan (see scripts/plan_shards.py).")
+
+
+def apply_shard_arguments(config: Dict, args: argparse.Namespace) -> Dict:
+    """Returns the config for the shard selected on the command line, or the config itself if none is."""
+    if args.shard_index is None:
+        return config
+    if args.shard_count is None:
+        raise ValueError("--shard-index needs --shard-count.")
+    return shard_config(config, args.shard_index, args.shard_count)
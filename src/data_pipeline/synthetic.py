@@ -0,0 +1,115 @@
+import os
+import random
+from typing import Dict, List
+
+from data_pipeline.extraction import OVERSIZED_FUNCTION_BYTES
+
+_VERBS = ["Computes", "Returns", "Builds", "Parses", "Normalizes", "Merges", "Scales", "Validates"]
+_NOUNS = ["totals", "offsets", "records", "tokens", "weights", "paths", "scores", "buffers"]
+
+
+def _docstring(rng: random.Random, params: List[str]) -> str:
+    """Returns a docstring of varying quality: some are one word, some cover every parameter."""
+    kind = rng.random()
+    if kind < 0.2:
+        return f"{rng.choice(_VERBS)}."
+    if kind < 0.6:
+        return f"{rng.choice(_VERBS)} the {rng.choice(_NOUNS)}."
+    mentioned = " and ".join(params)
+    return (f"{rng.choice(_VERBS)} the {rng.choice(_NOUNS)} from {mentioned}, combining them step by step, "
+            f"and returns the resulting {rng.choice(_NOUNS)} to the caller.")
+
+
+def _function_lines(rng: random.Random, name: str, indent: str, body_lines: int, documented: bool) -> List[str]:
+    """Returns the source lines of one synthetic function."""
+    params = ["a", "b", "c"][:rng.randint(1, 3)]
+    lines = [f"{indent}def {name}({', '.join(params)}):"]
+    if documented:
+        lines.append(f'{indent}    """{_docstring(rng, params)}"""')
+    lines.append(f"{indent}    total = {params[0]}")
+    for step in range(body_lines):
+        op = rng.choice(["+", "-", "*"])
+        if step % 7 == 3:
+            lines.append(f"{indent}    if total > {rng.randint(10, 999)}:")
+            lines.append(f"{indent}        total = total % {rng.randint(2, 97)}")
+        else:
+            lines.append(f"{indent}    total = total {op} {params[step % len(params)]} {op} {rng.randint(1, 99)}")
+    lines.append(f"{indent}    return total")
+    return lines
+
+
+def _oversized_function_lines(rng: random.Random, name: str, target_bytes: int, block_statements: int = 2000) -> List[str]:
+    """
+    Returns a documented function whose source is at least `target_bytes` long.
+
+    The body is a few large loops, so chunking yields a realistic handful of chunks
+    rather than one per statement.
+    """
+    lines = [f"def {name}(a, b):", f'    """{_docstring(rng, ["a", "b"])}"""', "    total = 0"]
+    size = sum(len(line) + 1 for line in lines)
+    while size < target_bytes:
+        block_lines = [f"    for i in range({rng.randint(2, 9)}):"]
+        block_lines += [f"        total = (total + a * i - b) % {rng.randint(11, 997)}" for _ in range(block_statements)]
+        lines.extend(block_lines)
+        size += sum(len(line) + 1 for line in block_lines)
+    lines.append("    return total")
+    return lines
+
+
+def generate_synthetic_repo(
+    root: str,
+    num_files: int = 100,
+    functions_per_file: int = 50,
+    docstring_rate: float = 0.7,
+    oversized_functions: int = 0,
+    oversized_bytes: int = OVERSIZED_FUNCTION_BYTES + 512 * 1024,
+    broken_file_rate: float = 0.0,
+    body_lines: int = 8,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """
+    Writes a seeded, reproducible repository of Python files under `root`.
+
+    Each file has an import/constant context header and `functions_per_file`
+    functions (every tenth inside a class, every 25th with a nested helper), of which
+    about `docstring_rate` carry a docstring of varying quality. `oversized_functions`
+    files get one extra function of `oversized_bytes`, which the extractor must chunk,
+    and about `broken_file_rate` of the files contain a syntax error. Returns counts
+    of what was written.
+    """
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    counts = {"files": 0, "functions": 0, "documented": 0, "oversized": 0, "broken_files": 0, "bytes": 0}
+    for file_index in range(num_files):
+        package = os.path.join(root, f"package_{file_index % 10}")
+        os.makedirs(package, exist_ok=True)
+        lines = [f"import module_{i}" for i in range(rng.randint(1, 6))]
+        lines += [f"CONSTANT_{i} = {rng.randint(0, 1000)}" for i in range(rng.randint(0, 4))]
+        for function_index in range(functions_per_file):
+            name = f"function_{file_index}_{function_index}"
+            documented = rng.random() < docstring_rate
+            indent = ""
+            lines.append("")
+            if function_index % 10 == 0:
+                lines.append(f"class Helper{function_index}:")
+                indent = "    "
+            lines.extend(_function_lines(rng, name, indent, body_lines, documented))
+            if function_index % 25 == 0:
+                lines[-1:-1] = [f"{indent}    def inner_{function_index}(x):",
+                                f'{indent}        """Nested helper that increments x."""',
+                                f"{indent}        return x + 1"]
+            counts["functions"] += 1
+            counts["documented"] += documented
+        if file_index < oversized_functions:
+            lines.append("")
+            lines.extend(_oversized_function_lines(rng, f"oversized_{file_index}", oversized_bytes))
+            counts["oversized"] += 1
+        if rng.random() < broken_file_rate:
+            lines.extend(["", "def broken_function(:", "    pass"])
+            counts["broken_files"] += 1
+        source = "\n".join(lines) + "\n"
+        with open(os.path.join(package, f"module_{file_index}.py"), 'w', encoding='utf-8') as f:
+            f.write(source)
+        counts["files"] += 1
+        counts["bytes"] += len(source.encode('utf-8'))
+    return counts
@@ -0,0 +1,245 @@
+import time
+import bisect
+from typing import Callable, Dict, Iterator, List, Optional
+
+from data_pipeline.metrics import timed
+
+# The instruction-tuning prompt template. The two parts are joined around each
+# record's instruction and output with plain string concatenation per batch.
+PROMPT_PREFIX = "### Instruction:\n"
+RESPONSE_SEPARATOR = "\n\n### Response:\n"
+
+PACKING_STRATEGIES = ("first_fit", "best_fit")
+
+
+def format_prompts(instructions: List[str], outputs: List[str]) -> List[str]:
+    """Formats a batch of (instruction, output) pairs with the prompt template."""
+    return [PROMPT_PREFIX + instruction + RESPONSE_SEPARATOR + output for instruction, output in zip(instructions, outputs)]
+
+
+def make_batch_tokenizer(tokenizer, max_length: int = 512, padding: str = "max_length") -> Callable[[Dict[str, List]], Dict[str, List]]:
+    """
+    Returns a `datasets.map(batched=True)` function that formats and tokenizes a whole batch.
+
+    Besides `input_ids` and `attention_mask` it stores a `length` column with each
+    example's number of real (non-padding) tokens, so later stages can filter and
+    bucket by length without scanning `input_ids`.
+    """
+    def tokenize_batch(batch: Dict[str, List]) -> Dict[str, List]:
+        prompts = format_prompts(batch["instruction"], batch["output"])
+        encoded = tokenizer(prompts, truncation=True, max_length=max_length, padding=padding)
+        encoded["length"] = [sum(mask) for mask in encoded["attention_mask"]]
+        return encoded
+
+    return tokenize_batch
+
+
+@timed("dataset.map.tokenize")
+def tokenize_dataset(
+    dataset,
+    tokenizer,
+    max_length: int = 512,
+    batch_size: int = 1000,
+    num_proc: Optional[int] = None,
+    padding: str = "max_length",
+):
+    """Tokenizes a dataset with batched fast-tokenizer calls spread over `num_proc` processes."""
+    return dataset.map(
+        make_batch_tokenizer(tokenizer, max_length=max_length, padding=padding),
+        batched=True,
+        batch_size=batch_size,
+        num_proc=num_proc if num_proc and num_proc > 1 else None,
+        desc="Tokenizing",
+    )
+
+
+def make_packing_tokenizer(tokenizer, max_length: int) -> Callable[[Dict[str, List]], Dict[str, List]]:
+    """
+    Returns a `datasets.map(batched=True)` function that tokenizes a batch for packing:
+    no padding, each example truncated to `max_length - 1` tokens and terminated by EOS.
+    """
+    eos_token_id = tokenizer.eos_token_id
+
+    def tokenize_batch(batch: Dict[str, List]) -> Dict[str, List]:
+        prompts = format_prompts(batch["instruction"], batch["output"])
+        encoded = tokenizer(prompts, truncation=True, max_length=max_length - 1, padding=False)
+        input_ids = [ids + [eos_token_id] for ids in encoded["input_ids"]]
+        return {"input_ids": input_ids, "length": [len(ids) for ids in input_ids]}
+
+    return tokenize_batch
+
+
+def _first_fit(lengths: List[int], order: List[int], seq_len: int) -> List[List[int]]:
+    """
+    First-fit bin packing in O(n log n): a segment tree over bins holds the maximum
+    remaining capacity of each subtree, so the leftmost bin with room is found by a
+    single descent. Unused bins have full capacity, so a new bin opens automatically.
+    """
+    size = 1
+    while size < max(1, len(order)):
+        size *= 2
+    tree = [seq_len] * (2 * size)
+    bins: List[List[int]] = []
+    for index in order:
+        need = lengths[index]
+        node = 1
+        while node < size:
+            node = 2 * node if tree[2 * node] >= need else 2 * node + 1
+        leaf = node - size
+        if leaf == len(bins):
+            bins.append([])
+        bins[leaf].append(index)
+        tree[node] -= need
+        node //= 2
+        while node:
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+            node //= 2
+    return bins
+
+
+def _best_fit(lengths: List[int], order: List[int], seq_len: int) -> List[List[int]]:
+    """
+    Best-fit bin packing: open bins are bucketed by remaining capacity and a sorted
+    list of non-empty capacities finds the tightest bin with room by bisection.
+    """
+    bins: List[List[int]] = []
+    buckets: Dict[int, List[int]] = {}
+    capacities: List[int] = []
+    for index in order:
+        need = lengths[index]
+        position = bisect.bisect_left(capacities, need)
+        if position < len(capacities):
+            capacity = capacities[position]
+            bin_id = buckets[capacity].pop()
+            if not buckets[capacity]:
+                del buckets[capacity]
+                capacities.pop(position)
+        else:
+            capacity = seq_len
+            bin_id = len(bins)
+            bins.append([])
+        bins[bin_id].append(index)
+        remaining = capacity - need
+        if remaining > 0:
+            if remaining not in buckets:
+                buckets[remaining] = []
+                bisect.insort(capacities, remaining)
+            buckets[remaining].append(bin_id)
+    return bins
+
+
+def pack_lengths(lengths: List[int], seq_len: int, strategy: str = "best_fit", sort_decreasing: bool = True) -> List[List[int]]:
+    """
+    Groups example indices into bins whose total length is at most `seq_len`.
+
+    Examples are placed longest first by default (first-fit/best-fit decreasing),
+    which keeps the number of bins close to optimal. Every example must fit into
+    one sequence on its own.
+    """
+    if strategy not in PACKING_STRATEGIES:
+        raise ValueError(f"Unknown packing strategy '{strategy}'. Expected one of {PACKING_STRATEGIES}.")
+    if lengths and max(lengths) > seq_len:
+        raise ValueError(f"An example of {max(lengths)} tokens does not fit into a sequence of {seq_len} tokens.")
+    order = list(range(len(lengths)))
+    if sort_decreasing:
+        order.sort(key=lambda i: -lengths[i])
+    if strategy == "first_fit":
+        return _first_fit(lengths, order, seq_len)
+    return _best_fit(lengths, order, seq_len)
+
+
+def iter_packed_sequences(tokenized, bins: List[List[int]], seq_len: int, pad_token_id: int) -> Iterator[Dict[str, List[int]]]:
+    """
+    Yields one fixed-length packed sequence per bin.
+
+    Each sequence carries `input_ids` and `attention_mask` padded to `seq_len`,
+    `position_ids` that restart at 0 at every document boundary, and
+    `document_lengths` giving the length of each packed document in order.
+    Token ids are sliced from the Arrow buffers without materializing the column.
+    """
+    column = tokenized.data.column("input_ids").combine_chunks()
+    offsets = column.offsets.to_numpy()
+    values = column.values.to_numpy()
+    for bin_indices in bins:
+        input_ids: List[int] = []
+        position_ids: List[int] = []
+        document_lengths: List[int] = []
+        for index in bin_indices:
+            document = values[offsets[index]:offsets[index + 1]].tolist()
+            input_ids.extend(document)
+            position_ids.extend(range(len(document)))
+            document_lengths.append(len(document))
+        real = len(input_ids)
+        pad = seq_len - real
+        yield {
+            "input_ids": input_ids + [pad_token_id] * pad,
+            "attention_mask": [1] * real + [0] * pad,
+            "position_ids": position_ids + [0] * pad,
+            "document_lengths": document_lengths,
+            "length": real,
+        }
+
+
+def padding_ratio(real_tokens: int, sequences: int, seq_len: int) -> float:
+    """Returns the share of stored token slots that are padding."""
+    slots = sequences * seq_len
+    return 1.0 - real_tokens / slots if slots else 0.0
+
+
+@timed("pack_dataset")
+def pack_dataset(tokenized, seq_len: int, pad_token_id: int, strategy: str = "best_fit"):
+    """
+    Packs a dataset tokenized with make_packing_tokenizer into fixed-length sequences.
+
+    Returns (packed_dataset, stats) where stats compares the padding ratio of padding
+    every example to `seq_len` with the padding ratio after packing.
+    """
+    from datasets import Dataset
+
+    lengths = tokenized.data.column("length").to_pylist()
+    bins = pack_lengths(lengths, seq_len, strategy=strategy)
+    packed = Dataset.from_generator(
+        iter_packed_sequences,
+        gen_kwargs={"tokenized": tokenized, "bins": bins, "seq_len": seq_len, "pad_token_id": pad_token_id},
+    )
+    real_tokens = sum(lengths)
+    stats = {
+        "examples": len(lengths),
+        "sequences": len(bins),
+        "real_tokens": real_tokens,
+        "padding_ratio_before": padding_ratio(real_tokens, len(lengths), seq_len),
+        "padding_ratio_after": padding_ratio(real_tokens, len(bins), seq_len),
+    }
+    return packed, stats
+
+
+def column_sum(dataset, column: str) -> int:
+    """Sums an integer column straight from the dataset's Arrow table."""
+    import pyarrow.compute as pc
+
+    total = pc.sum(dataset.data.column(column)).as_py()
+    return int(total or 0)
+
+
+class ThroughputReport:
+    """Measures a stage's wall time and reports records/sec and tokens/sec."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self, records: int, tokens: int) -> Dict[str, float]:
+        """Stops the clock, prints the throughput line and returns the figures."""
+        self.elapsed = time.perf_counter() - self.start
+        seconds = max(self.elapsed, 1e-9)
+        report = {
+            "records": records,
+            "tokens": tokens,
+            "seconds": self.elapsed,
+            "records_per_sec": records / seconds,
+            "tokens_per_sec": tokens / seconds,
+        }
+        print(f"[{self.stage}] {records} records, {tokens} tokens in {self.elapsed:.2f}s "
+              f"({report['records_per_sec']:.0f} records/sec, {report['tokens_per_sec']:.0f} tokens/sec)")
+        return report
@@ -0,0 +1,145 @@
+import ast
+import re
+from typing import Dict, List, Optional, Tuple
+
+GOOD = "good"
+BAD = "bad"
+UNCERTAIN = "uncertain"
+
+# Judgements recorded for records the triage decides on its own. They use the judge's
+# score scale so the rest of the refinement stage treats them like a real verdict.
+GOOD_JUDGEMENT_SCORE = 5
+BAD_JUDGEMENT_SCORE = 1
+
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_RETURN_WORDS = {"return", "returns", "returned", "returning", "yield", "yields"}
+_IMPLICIT_PARAMS = {"self", "cls"}
+
+
+def _find_function(code: str, docstring: str) -> Optional[ast.AST]:
+    """Returns the function in `code` whose docstring is `docstring`, or None."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            own = ast.get_docstring(node)
+            if own is not None and own.strip() == docstring.strip():
+                return node
+    return None
+
+
+def _parameter_names(node: ast.AST) -> List[str]:
+    """Returns the function's explicit parameter names, without self/cls."""
+    args = node.args
+    params = args.posonlyargs + args.args + args.kwonlyargs
+    names = [a.arg for a in params]
+    if args.vararg:
+        names.append(args.vararg.arg)
+    if args.kwarg:
+        names.append(args.kwarg.arg)
+    return [name for name in names if name not in _IMPLICIT_PARAMS]
+
+
+def _returns_value(node: ast.AST) -> bool:
+    """Checks whether the function itself (not a nested function) returns or yields a value."""
+    stack = list(node.body)
+    while stack:
+        child = stack.pop()
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            continue
+        if isinstance(child, ast.Return) and child.value is not None:
+            if not (isinstance(child.value, ast.Constant) and child.value.value is None):
+                return True
+        if isinstance(child, (ast.Yield, ast.YieldFrom)):
+            return True
+        stack.extend(ast.iter_child_nodes(child))
+    return False
+
+
+class DocstringTriage:
+    """
+    Cheap, local pre-scoring of docstrings before the LLM judge.
+
+    Each docstring gets a score in [0, 1] from three signals weighed against the
+    function's signature: its length (relative to `good_word_count`), the share of
+    parameter names it mentions, and whether it describes the return value when the
+    function returns one. Docstrings shorter than `min_words` always score 0.
+    Scores at or above `good_threshold` are confidently good, scores at or below
+    `bad_threshold` are confidently bad, and everything in between - or any record
+    whose function cannot be found, such as a chunk - is left to the judge.
+    """
+
+    def __init__(
+        self,
+        min_words: int = 3,
+        good_word_count: int = 20,
+        good_threshold: float = 0.85,
+        bad_threshold: float = 0.3,
+        length_weight: float = 0.4,
+        param_weight: float = 0.4,
+        return_weight: float = 0.2,
+    ):
+        self.min_words = min_words
+        self.good_word_count = good_word_count
+        self.good_threshold = good_threshold
+        self.bad_threshold = bad_threshold
+        self.length_weight = length_weight
+        self.param_weight = param_weight
+        self.return_weight = return_weight
+        self.stats = {GOOD: 0, BAD: 0, UNCERTAIN: 0}
+
+    def score(self, docstring: str, code: str) -> Optional[Tuple[float, Dict]]:
+        """Returns (score, signals) for a docstring, or None if its function cannot be analysed."""
+        node = _find_function(code, docstring)
+        if node is None:
+            return None
+        words = _WORD.findall(docstring)
+        vocabulary = {word.lower() for word in words}
+        params = _parameter_names(node)
+        mentioned = [name for name in params if name.lower() in vocabulary]
+        returns_value = _returns_value(node)
+        mentions_return = bool(vocabulary & _RETURN_WORDS)
+
+        signals = {
+            "words": len(words),
+            "param_coverage": len(mentioned) / len(params) if params else 1.0,
+            "return_covered": mentions_return or not returns_value,
+        }
+        if len(words) < self.min_words:
+            return 0.0, signals
+        score = (
+            self.length_weight * min(1.0, len(words) / self.good_word_count)
+            + self.param_weight * signals["param_coverage"]
+            + self.return_weight * (1.0 if signals["return_covered"] else 0.0)
+        )
+        return score, signals
+
+    def classify(self, docstring: str, code: str) -> str:
+        """Classifies a docstring as GOOD, BAD or UNCERTAIN."""
+        scored = self.score(docstring, code)
+        if scored is None:
+            verdict = UNCERTAIN
+        elif scored[0] >= self.good_threshold:
+            verdict = GOOD
+        elif scored[0] <= self.bad_threshold:
+            verdict = BAD
+        else:
+            verdict = UNCERTAIN
+        self.stats[verdict] += 1
+        return verdict
+
+    def judgement(self, docstring: str, code: str) -> Optional[Dict]:
+        """Returns a judge-style verdict for a confident classification, or None to send it to the judge."""
+        verdict = self.classify(docstring, code)
+        if verdict == GOOD:
+            return {"score": GOOD_JUDGEMENT_SCORE, "reason": "Local triage: docstring covers the signature."}
+        if verdict == BAD:
+            return {"score": BAD_JUDGEMENT_SCORE, "reason": "Local triage: docstring is too short or misses the signature."}
+        return None
+
+    @property
+    def judge_calls_avoided(self) -> int:
+        """The number of records decided locally, each of which would otherwise cost a judge call."""
+        return self.stats[GOOD] + self.stats[BAD]
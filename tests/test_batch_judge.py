@@ -0,0 +1,156 @@
+import json
+import sys
+import os
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.batch_judge import (
+    batch_digest,
+    build_batch_judge_prompt,
+    extract_batch_items,
+    parse_batch_judge_response,
+    read_batch_job_results,
+    run_local_batch_job,
+    write_batch_job_requests,
+)
+from data_pipeline.llm_cache import ResponseCache
+from data_pipeline.refinement import AsyncRefiner
+
+PAIRS = [(f'doc {i}', f'def f{i}(): pass') for i in range(5)]
+
+def test_prompt_round_trips_items():
+    """Tests that the packed items can be recovered from the prompt."""
+    prompt = build_batch_judge_prompt(PAIRS)
+    assert prompt.count('You are an expert Python code reviewer') == 1
+    assert extract_batch_items(prompt) == PAIRS
+
+def test_parse_maps_by_id_and_tolerates_wrapping():
+    """Tests that verdicts are matched by id even when out of order and wrapped in prose and a code fence."""
+    content = 'Here you go:\n```json\n[{"id": 1, "score": 2, "reason": "r1"}, {"id": 0, "score": 5, "reason": "r0"}]\n```'
+    assert parse_batch_judge_response(content, 2) == [{'score': 5, 'reason': 'r0'}, {'score': 2, 'reason': 'r1'}]
+
+def test_parse_drops_missing_invalid_and_duplicate_items():
+    """Tests that missing, out-of-range, malformed and conflicting entries map to None."""
+    content = json.dumps([
+        {'id': 0, 'score': 4},
+        {'id': 1, 'score': 9},
+        {'id': 2, 'score': 3}, {'id': 2, 'score': 5},
+        {'id': 7, 'score': 3},
+        {'id': '3', 'score': 3},
+    ])
+    assert parse_batch_judge_response(content, 5) == [{'score': 4, 'reason': ''}, None, None, None, None]
+    assert parse_batch_judge_response('not json', 2) == [None, None]
+    assert parse_batch_judge_response('{"results": [{"id": 0, "score": 1}]}', 1) == [{'score': 1, 'reason': ''}]
+
+def test_offline_batch_job_round_trip(tmp_path):
+    """Tests writing a request file, answering it with the local stand-in and reading the results back."""
+    request_path = str(tmp_path / 'requests.jsonl')
+    result_path = str(tmp_path / 'results.jsonl')
+    assert write_batch_job_requests(request_path, PAIRS, 'model', batch_size=2) == 3
+
+    judge = lambda docstring, code: {'score': 1 if 'f3' in code else 5, 'reason': docstring}
+    assert run_local_batch_job(request_path, result_path, judge) == 3
+
+    verdicts = read_batch_job_results(result_path, PAIRS)
+    assert [v['score'] for v in verdicts] == [5, 5, 5, 1, 5]
+    assert [v['reason'] for v in verdicts] == [doc for doc, _ in PAIRS]
+
+def test_failed_batch_requests_leave_records_unjudged(tmp_path):
+    """Tests that records covered by a failed request come back as None."""
+    result_path = tmp_path / 'results.jsonl'
+    custom_id = f'records-0-2-{batch_digest(PAIRS[:2])}'
+    result_path.write_text(json.dumps({'custom_id': custom_id, 'response': {'status_code': 500, 'body': {}}}) + '\n')
+    assert read_batch_job_results(str(result_path), PAIRS[:3]) == [None, None, None]
+
+def test_batch_results_only_apply_to_the_records_they_were_written_for(tmp_path):
+    """Tests that reordered results still match, and that results for other records are not applied."""
+    request_path = str(tmp_path / 'requests.jsonl')
+    result_path = tmp_path / 'results.jsonl'
+    write_batch_job_requests(request_path, PAIRS, 'model', batch_size=2)
+    run_local_batch_job(request_path, str(result_path), lambda docstring, code: {'score': 4, 'reason': code})
+    lines = result_path.read_text().splitlines()
+    result_path.write_text('\n'.join(reversed(lines[:2])) + '\n')
+
+    assert [v and v['reason'] for v in read_batch_job_results(str(result_path), PAIRS)] == [code for _, code in PAIRS[:4]] + [None]
+    # A record removed before collecting shifts the others: nothing may be applied to them.
+    stats = {}
+    assert read_batch_job_results(str(result_path), PAIRS[1:], stats) == [None] * 4
+    assert stats == {'mismatched_requests': 2}
+
+def test_refiner_requeues_unparsed_items():
+    """Tests that items missing from a batched response are judged individually."""
+    single_calls = []
+
+    async def batch_judge(pairs):
+        # Drop the verdict for the last item to force a re-queue.
+        return [{'score': 5}] * (len(pairs) - 1) + [None]
+
+    async def judge(docstring, code):
+        single_calls.append(code)
+        return {'score': 1}
+
+    async def generator(code):
+        return 'generated'
+
+    records = [{'prompt': doc, 'completion': code} for doc, code in PAIRS]
+    refiner = AsyncRefiner(judge, generator, batch_judge=batch_judge, judge_batch_size=3)
+    refined = refiner.run(records)
+
+    assert [r['prompt'] for r in refined] == ['doc 0', 'doc 1', 'generated', 'doc 3', 'generated']
+    assert single_calls == ['def f2(): pass', 'def f4(): pass']
+    assert refiner.stats['batch_judge_calls'] == 2
+    assert refiner.stats['requeued'] == 2
+
+def test_refiner_uses_supplied_judgements():
+    """Tests that records with a judgement from an offline batch job skip the judge."""
+    async def judge(docstring, code):
+        return {'score': 1}
+
+    async def generator(code):
+        return 'generated'
+
+    records = [{'prompt': doc, 'completion': code} for doc, code in PAIRS[:2]]
+    refined = AsyncRefiner(judge, generator).run(records, [{'score': 5}, None])
+    assert [r['prompt'] for r in refined] == ['doc 0', 'generated']
+
+def test_batched_verdicts_are_cached_by_batch_prompt_version(tmp_path):
+    """Tests that changing the batch prompt version invalidates cached batched verdicts."""
+    calls = []
+
+    async def batch_judge(pairs):
+        calls.append(len(pairs))
+        return [{'score': 5}] * len(pairs)
+
+    async def judge(docstring, code):
+        return {'score': 5}
+
+    async def generator(code):
+        return 'generated'
+
+    records = [{'prompt': doc, 'completion': code} for doc, code in PAIRS[:2]]
+    for version in ('batch-1', 'batch-1', 'batch-2'):
+        with ResponseCache(str(tmp_path / 'cache.sqlite')) as cache:
+            AsyncRefiner(judge, generator, cache=cache, judge_model='m', prompt_version='1', batch_prompt_version=version,
+                         batch_judge=batch_judge, judge_batch_size=2).run(records)
+    assert calls == [2, 2]
+
+def test_batched_run_counts_one_cache_lookup_per_record(tmp_path):
+    """Tests that a batched run counts each record's cache lookup once, including re-queued items."""
+    async def batch_judge(pairs):
+        return [{'score': 5}] * (len(pairs) - 1) + [None]
+
+    async def judge(docstring, code):
+        return {'score': 5}
+
+    async def generator(code):
+        return 'generated'
+
+    records = [{'prompt': doc, 'completion': code} for doc, code in PAIRS]
+    for expected in ({'hits': 0, 'misses': 5}, {'hits': 5, 'misses': 0}):
+        with ResponseCache(str(tmp_path / 'cache.sqlite')) as cache:
+            refiner = AsyncRefiner(judge, generator, cache=cache, judge_model='m', prompt_version='1',
+                                   batch_judge=batch_judge, judge_batch_size=3)
+            refiner.run(records)
+            assert {name: cache.stats[name] for name in expected} == expected
+            assert refiner.stats['cache_hits'] == expected['hits']
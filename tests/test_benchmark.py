@@ -0,0 +1,68 @@
+import pytest
+import sys
+import os
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.benchmark import find_regressions, measure_stage, load_baseline, save_baseline
+from data_pipeline.synthetic import generate_synthetic_repo
+from data_pipeline.extraction import extract_functions_from_file
+
+def read_tree(root):
+    """Returns {relative path: content} for every file under root."""
+    tree = {}
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            with open(path, encoding='utf-8') as f:
+                tree[os.path.relpath(path, root)] = f.read()
+    return tree
+
+def test_synthetic_repo_is_seeded_and_extractable(tmp_path):
+    """Tests that the same seed gives the same repository and the documented functions are extracted."""
+    counts = generate_synthetic_repo(str(tmp_path / 'a'), num_files=3, functions_per_file=20, docstring_rate=0.5, seed=7)
+    generate_synthetic_repo(str(tmp_path / 'b'), num_files=3, functions_per_file=20, docstring_rate=0.5, seed=7)
+    assert read_tree(tmp_path / 'a') == read_tree(tmp_path / 'b')
+    assert counts['files'] == 3 and counts['functions'] == 60
+    assert 0 < counts['documented'] < 60
+
+    tree = read_tree(tmp_path / 'a')
+    records = [r for path in tree for r in extract_functions_from_file(str(tmp_path / 'a' / path))]
+    # Every documented function is extracted, plus the documented nested helpers.
+    assert len(records) == counts['documented'] + 3
+
+def test_oversized_and_broken_files(tmp_path):
+    """Tests that oversized functions reach the requested size and broken files fail to parse."""
+    counts = generate_synthetic_repo(str(tmp_path), num_files=2, functions_per_file=2, oversized_functions=1,
+                                     oversized_bytes=100_000, broken_file_rate=1.0)
+    assert counts['oversized'] == 1 and counts['broken_files'] == 2
+    assert counts['bytes'] > 100_000
+    assert all('def broken_function(:' in source for source in read_tree(tmp_path).values())
+
+def test_measure_stage():
+    """Tests that a stage's record count and rates are reported."""
+    metrics = measure_stage(lambda: 1000, input_bytes=1024 * 1024, repeats=2)
+    assert metrics['records'] == 1000
+    assert metrics['records_per_sec'] == pytest.approx(1000 * metrics['mb_per_sec'])
+    assert metrics['peak_rss_mb'] > 0
+
+def test_find_regressions():
+    """Tests that only changes for the worse beyond the threshold are flagged."""
+    baseline = {'extract': {'records_per_sec': 100.0, 'mb_per_sec': 10.0, 'peak_rss_mb': 100.0}}
+    better = {'extract': {'records_per_sec': 150.0, 'mb_per_sec': 9.0, 'peak_rss_mb': 80.0}}
+    worse = {'extract': {'records_per_sec': 70.0, 'mb_per_sec': 10.0, 'peak_rss_mb': 130.0}, 'new_stage': {'records_per_sec': 1.0}}
+    assert find_regressions(better, baseline, threshold=0.2) == []
+    assert find_regressions(worse, baseline, threshold=0.2) == [
+        ('extract', 'records_per_sec', 100.0, 70.0),
+        ('extract', 'peak_rss_mb', 100.0, 130.0),
+    ]
+
+def test_baseline_round_trip(tmp_path):
+    """Tests that a saved baseline is loaded back with its spec."""
+    path = str(tmp_path / 'bench' / 'baseline.json')
+    assert load_baseline(path) == {}
+    save_baseline(path, {'extract': {'records_per_sec': 1.0}}, {'seed': 0})
+    baseline = load_baseline(path)
+    assert baseline['spec'] == {'seed': 0}
+    assert baseline['stages'] == {'extract': {'records_per_sec': 1.0}}
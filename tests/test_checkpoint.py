@@ -0,0 +1,97 @@
+import pytest
+import sys
+import os
+import json
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.checkpoint import StageCheckpoint, open_stage_output, run_key, PROGRESS_NAME
+from data_pipeline.columnar import JsonlWriter, read_frame
+
+RECORDS = [{'prompt': f'p{i}', 'completion': f'c{i}'} for i in range(10)]
+
+def read_jsonl(path):
+    """Reads a JSONL file into a list of records."""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def crash_after(output, items, key='run', **kwargs):
+    """Writes `items` records one item at a time, then fails like a crashed stage."""
+    with pytest.raises(RuntimeError):
+        with StageCheckpoint(output, key=key, **kwargs) as checkpoint:
+            for record in RECORDS[checkpoint.position:items]:
+                checkpoint.write_records([record])
+                checkpoint.advance()
+            # The next item's output is half written when the stage dies.
+            checkpoint.write_records([{'prompt': 'partial', 'completion': 'partial'}])
+            raise RuntimeError("crash")
+
+def test_resume_after_crash(tmp_path):
+    """Tests that finished items survive a crash, the item in progress is redone and the output is complete."""
+    output = str(tmp_path / 'out.jsonl')
+    crash_after(output, 4, rows_per_commit=100, commit_interval=3600)
+    assert not os.path.exists(output)
+
+    with StageCheckpoint(output, key='run') as checkpoint:
+        assert checkpoint.resumed_from == 4
+        for record in RECORDS[checkpoint.position:]:
+            checkpoint.write_records([record])
+            checkpoint.advance()
+    assert read_jsonl(output) == RECORDS
+    assert not os.path.exists(output + '.checkpoint')
+
+def test_uncommitted_output_is_discarded(tmp_path):
+    """Tests that a run killed outright resumes from the last commit and ignores shards written after it."""
+    output = str(tmp_path / 'out.jsonl')
+    checkpoint = StageCheckpoint(output, key='run', rows_per_commit=3, commit_interval=3600)
+    for record in RECORDS[:5]:
+        checkpoint.write_records([record])
+        checkpoint.advance()
+    # Killed without unwinding: a shard landed on disk, but the marker was never updated.
+    with open(os.path.join(checkpoint.directory, 'part-00001.jsonl'), 'w') as f:
+        f.write(json.dumps(RECORDS[3]) + '\n')
+
+    resumed = StageCheckpoint(output, key='run')
+    assert resumed.position == 3 and resumed.num_rows == 3
+    assert sorted(os.listdir(resumed.directory)) == sorted(['part-00000.jsonl', PROGRESS_NAME])
+
+def test_changed_run_key_starts_over(tmp_path):
+    """Tests that a checkpoint from a run with different inputs or settings is discarded."""
+    output = str(tmp_path / 'out.jsonl')
+    crash_after(output, 4, key=run_key(stage='refine', input='a'), rows_per_commit=1)
+    checkpoint = StageCheckpoint(output, key=run_key(stage='refine', input='b'))
+    assert checkpoint.position == 0 and checkpoint.shards == []
+
+def test_named_items_are_checked_on_resume(tmp_path):
+    """Tests that a checkpoint remembers which items it covers, and that restart discards it."""
+    output = str(tmp_path / 'out.jsonl')
+    with pytest.raises(RuntimeError):
+        with StageCheckpoint(output, key='run', rows_per_commit=1) as checkpoint:
+            for name in ('a.py', 'b.py', 'c.py'):
+                checkpoint.write_records([{'prompt': name, 'completion': ''}])
+                checkpoint.advance(item=name)
+            raise RuntimeError("crash")
+
+    checkpoint = StageCheckpoint(output, key='run')
+    assert checkpoint.matches_items(['a.py', 'b.py', 'c.py'])
+    assert not checkpoint.matches_items(['a.py', 'aa.py', 'b.py'])
+    assert not checkpoint.matches_items(['a.py', 'b.py'])
+    checkpoint.restart()
+    assert checkpoint.position == 0 and checkpoint.rows_written == 0
+    assert StageCheckpoint(output, key='run').position == 0
+
+def test_finalize_to_columnar_output(tmp_path):
+    """Tests that the checkpoint becomes a columnar dataset when that is the configured format."""
+    output = str(tmp_path / 'out.jsonl')
+    with open_stage_output(output, 'arrow', rows_per_shard=4, key='run', checkpoint_config={'enabled': True, 'rows_per_commit': 3}) as out:
+        for record in RECORDS:
+            out.write_records([record])
+            out.advance()
+    assert read_frame(output).to_dict('records') == RECORDS
+    assert not os.path.exists(str(tmp_path / 'out.arrow.checkpoint'))
+
+def test_checkpointing_disabled(tmp_path):
+    """Tests that a plain writer is used when checkpointing is off."""
+    with open_stage_output(str(tmp_path / 'out.jsonl'), 'jsonl', checkpoint_config={'enabled': False}) as out:
+        assert isinstance(out, JsonlWriter)
@@ -0,0 +1,142 @@
+import pytest
+import ast
+import sys
+import os
+from collections import Counter
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.chunking import TokenBudgetChunker, estimate_tokens, make_token_counter, statement_lists
+from data_pipeline.extraction import SourceIndex, extract_functions_from_source
+
+def big_function(loops=3, statements=40):
+    """Returns the source of a documented function with several large nested loops and an if/else."""
+    lines = ['import math', '', 'def big(a, b):', '    """Does a lot."""', '    total = 0']
+    for loop in range(loops):
+        lines.append(f'    for i in range({loop + 2}):')
+        lines.append('        if i % 2:')
+        lines += [f'            total += math.floor(a * i + {n})' for n in range(statements)]
+        lines.append('        else:')
+        lines += [f'            total -= b * {n}' for n in range(statements)]
+    lines.append('    return total')
+    return "\n".join(lines) + "\n"
+
+def nested_function():
+    """Returns a decorated function whose first body statements are each larger than a small budget."""
+    lines = ['@cache', 'def nested(a, b):', '    """Does a lot, deeply."""', '    for i in range(a):', '        if i:',
+             '            with open(b) as f:']
+    lines += [f'                total = math.floor(a * i + {n}) + f.read({n})' for n in range(12)]
+    lines += ['        elif b:', '            match b:', '                case 1:']
+    lines += [f'                    total -= b * {n} + math.ceil(a / {n + 1})' for n in range(12)]
+    lines += ['    try:', '        names = [' + ', '.join(f'"name_{n}"' for n in range(40)) + ']',
+              '    except ValueError:', '        names = []', '    return total']
+    return "\n".join(lines) + "\n"
+
+def leaf_statements(tree):
+    """Returns a multiset of the simple (non-compound) statements below a node."""
+    return Counter(ast.dump(node) for node in ast.walk(tree)
+                   if isinstance(node, ast.stmt) and not statement_lists(node))
+
+def first_line(node):
+    """Returns the first line of a statement, its decorators included."""
+    return min([node.lineno] + [decorator.lineno for decorator in getattr(node, 'decorator_list', [])])
+
+def statement_lines(function):
+    """Returns the lines of every simple statement and every compound statement's header (up to its first nested statement)."""
+    lines = set()
+    for node in ast.walk(function):
+        if not isinstance(node, ast.stmt):
+            continue
+        lists = statement_lists(node)
+        end = lists[0][1][0].lineno - 1 if lists else node.end_lineno
+        lines.update(range(first_line(node), end + 1))
+    return lines
+
+def check_pieces(source, function, budget):
+    """Checks that the pieces cover every statement and header line once and parse; returns the pieces over the budget."""
+    index = SourceIndex(source)
+    pieces = TokenBudgetChunker(index, estimate_tokens, budget=budget).split(function)
+    covered = Counter()
+    lines = set()
+    over = []
+    for piece in pieces:
+        first = piece.node if piece.kind == 'prefix' else piece.statements[0]
+        text = index.segment_range(first, piece.statements[-1])
+        if estimate_tokens(text) > budget:
+            over.append(piece)
+        if isinstance(first, ast.Try):
+            # The start of a try block comes without its handlers, which follow in later pieces.
+            tree = ast.parse(text + '\nexcept Exception:\n    pass')
+            tree.body[0].handlers = []
+        else:
+            tree = ast.parse(text)
+        covered += leaf_statements(tree)
+        lines.update(range(first_line(first), piece.statements[-1].end_lineno + 1))
+    assert covered == leaf_statements(function)
+    assert statement_lines(function) <= lines
+    return over
+
+def test_pieces_cover_the_whole_function_within_budget():
+    """Tests that every statement and header line lands in a piece and every piece fits and parses."""
+    source = big_function()
+    assert check_pieces(source, ast.parse(source).body[1], budget=120) == []
+
+def test_headers_are_kept_when_the_first_statement_does_not_fit():
+    """Tests that headers are carried into the first nested piece, or kept with an oversized simple statement."""
+    source = nested_function()
+    function = ast.parse(source).body[0]
+    over = check_pieces(source, function, budget=60)
+    # Only the try block's first statement, a long list, cannot fit beside its header.
+    assert [piece.statements for piece in over] == [(function.body[2].body[0],)]
+    index = SourceIndex(source)
+    pieces = TokenBudgetChunker(index, estimate_tokens, budget=60).split(function)
+    assert index.segment_range(pieces[0].node, pieces[0].statements[-1]) == '@cache\ndef nested(a, b):\n    """Does a lot, deeply."""'
+    assert pieces[1].node is function.body[1] and pieces[1].path == ()
+    text = index.segment_range(pieces[1].node, pieces[1].statements[-1])
+    assert text.startswith('for i in range(a):\n    if i:\n        with open(b) as f:\n            total = ')
+
+def test_prefix_keeps_the_signature_and_nested_blocks_are_labelled():
+    """Tests that the first piece starts with the signature and nested pieces know where they come from."""
+    source = big_function(loops=1)
+    index = SourceIndex(source)
+    pieces = TokenBudgetChunker(index, estimate_tokens, budget=120).split(ast.parse(source).body[1])
+    assert pieces[0].kind == 'prefix'
+    assert index.segment_range(pieces[0].node, pieces[0].statements[-1]).startswith('def big(a, b):\n    """Does a lot."""')
+    assert ("'For' block", "'If' block (else branch)") in {piece.path for piece in pieces}
+
+def test_small_statements_are_grouped():
+    """Tests that adjacent small statements share a piece instead of one piece each."""
+    source = big_function(loops=1, statements=200)
+    index = SourceIndex(source)
+    pieces = TokenBudgetChunker(index, estimate_tokens, budget=200).split(ast.parse(source).body[1])
+    assert len(pieces) < 40
+    assert max(len(piece.statements) for piece in pieces) > 10
+
+def test_extraction_with_token_budget():
+    """Tests that only functions over the budget are chunked and the chunk prompts keep the docstring and number the parts."""
+    source = big_function() + '\ndef small(x):\n    """Returns x."""\n    return x\n'
+    records = list(extract_functions_from_source(source, token_budget=150))
+    assert records[-1] == {'prompt': 'Returns x.', 'completion': 'import math\n\ndef small(x):\n    """Returns x."""\n    return x'}
+    chunks = records[:-1]
+    assert len(chunks) > 3
+    assert chunks[0]['prompt'].startswith(f"Does a lot.\n\nThis is part 1 of {len(chunks)} of the function 'big'.")
+    assert all(chunk['prompt'].startswith("Does a lot.\n\n") for chunk in chunks)
+    assert all(estimate_tokens(chunk['completion']) <= 150 for chunk in chunks)
+    assert sum("the signature of 'big'" in chunk['prompt'] for chunk in chunks) == 1
+
+def test_chunking_stats():
+    """Tests that chunked functions and chunks over the budget are counted."""
+    source = 'def huge():\n    """Doc."""\n    return ' + ' + '.join(['1'] * 400) + '\n'
+    stats = {}
+    records = list(extract_functions_from_source(source, token_budget=50, stats=stats))
+    # A single statement larger than the budget cannot be split further.
+    assert len(records) == 2
+    assert stats['chunked_functions'] == 1 and stats['chunks'] == 2 and stats['chunks_over_budget'] == 1
+
+def test_unknown_token_counter():
+    """Tests that an unknown counter or a tokenizer counter without a name is rejected."""
+    with pytest.raises(ValueError):
+        make_token_counter('words')
+    with pytest.raises(ValueError):
+        make_token_counter('tokenizer')
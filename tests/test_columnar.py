@@ -0,0 +1,105 @@
+import pytest
+import pandas as pd
+import sys
+import os
+import json
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.columnar import (
+    open_writer,
+    read_frame,
+    read_manifest,
+    read_table,
+    iter_frames,
+    stage_path,
+    write_frame,
+    is_columnar,
+)
+
+RECORDS = [{'prompt': f'doc {i}', 'completion': f'def f{i}(): pass'} for i in range(7)]
+
+def test_stage_path():
+    """Tests that columnar datasets live next to the configured JSONL path."""
+    assert stage_path('data/x.jsonl', 'jsonl') == 'data/x.jsonl'
+    assert stage_path('data/x.jsonl', 'arrow') == 'data/x.arrow'
+    with pytest.raises(ValueError):
+        stage_path('data/x.jsonl', 'csv')
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_sharded_round_trip(tmp_path, fmt):
+    """Tests that records are split into shards, listed in the manifest and read back in order."""
+    path = str(tmp_path / 'pairs.jsonl')
+    with open_writer(path, fmt, rows_per_shard=3) as writer:
+        writer.write_records(RECORDS[:2])
+        writer.write_jsonl(''.join(pd.DataFrame(RECORDS[2:5]).to_json(orient='records', lines=True)))
+        writer.write_frame(pd.DataFrame(RECORDS[5:]))
+
+    manifest = read_manifest(stage_path(path, fmt))
+    assert manifest['num_rows'] == 7
+    assert [shard['num_rows'] for shard in manifest['shards']] == [3, 3, 1]
+    assert read_frame(path).to_dict('records') == RECORDS
+    assert list(read_frame(path, columns=['completion']).columns) == ['completion']
+    assert [len(df) for df in iter_frames(path, batch_size=2)] == [2, 1, 2, 1, 1]
+
+def test_failed_write_leaves_no_manifest(tmp_path):
+    """Tests that a write interrupted by an error is not mistaken for a complete dataset."""
+    path = str(tmp_path / 'pairs.jsonl')
+    with pytest.raises(RuntimeError):
+        with open_writer(path, 'arrow', rows_per_shard=3) as writer:
+            writer.write_records(RECORDS)
+            raise RuntimeError("crash")
+    assert not is_columnar(stage_path(path, 'arrow'))
+
+def test_readers_find_the_latest_format(tmp_path):
+    """Tests that a stage reads whichever format the upstream stage wrote most recently."""
+    path = str(tmp_path / 'pairs.jsonl')
+    write_frame(pd.DataFrame(RECORDS[:1]), path, 'jsonl')
+    assert len(read_frame(path)) == 1
+    os.utime(path, (0, 0))
+    write_frame(pd.DataFrame(RECORDS), path, 'arrow')
+    assert len(read_frame(path)) == 7
+
+@pytest.mark.parametrize("fmt", ["jsonl", "arrow", "parquet"])
+def test_empty_stage_output(tmp_path, fmt):
+    """Tests that a stage that wrote no records reads back as an empty frame with the requested columns."""
+    path = str(tmp_path / 'pairs.jsonl')
+    with open_writer(path, fmt):
+        pass
+    df = read_frame(path, columns=['prompt', 'completion'])
+    assert len(df) == 0 and list(df.columns) == ['prompt', 'completion']
+    assert list(iter_frames(path, batch_size=2, columns=['prompt'])) == []
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_later_tables_widen_the_schema(tmp_path, fmt):
+    """Tests that all-null and missing columns in some tables are unified rather than failing the write."""
+    path = str(tmp_path / 'pairs.jsonl')
+    with open_writer(path, fmt, rows_per_shard=2) as writer:
+        writer.write_records([{'prompt': 'a', 'note': None, 'lines': 1}] * 2)
+        writer.write_records([{'prompt': 'b', 'note': 'kept', 'lines': 2}])
+        writer.write_records([{'prompt': 'c', 'note': 'x'}])
+        writer.write_records([{'prompt': 'd', 'extra': 1.5}])
+
+    manifest = read_manifest(stage_path(path, fmt))
+    assert manifest['columns'] == {'prompt': 'string', 'note': 'string', 'lines': 'int64', 'extra': 'double'}
+    table = read_table(stage_path(path, fmt))
+    assert table.column('prompt').to_pylist() == ['a', 'a', 'b', 'c', 'd']
+    assert table.column('note').to_pylist() == [None, None, 'kept', 'x', None]
+    assert table.column('lines').to_pylist() == [1, 1, 2, None, None]
+    assert table.column('extra').to_pylist() == [None, None, None, None, 1.5]
+    assert len(read_frame(path, columns=['prompt', 'note'])) == 5
+
+def test_empty_dataset_keeps_the_manifest_types(tmp_path):
+    """Tests that an empty columnar dataset reads with the column types its manifest records."""
+    path = str(tmp_path / 'pairs.jsonl')
+    with open_writer(path, 'arrow') as writer:
+        writer.write_records([{'prompt': 'a', 'lines': 1, 'ids': [1, 2]}])
+    target = stage_path(path, 'arrow')
+    manifest = read_manifest(target)
+    manifest['shards'] = []
+    with open(os.path.join(target, '_manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    table = read_table(target)
+    assert table.num_rows == 0
+    assert [str(field.type) for field in table.schema] == ['string', 'int64', 'list<item: int64>']
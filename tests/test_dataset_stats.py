@@ -0,0 +1,72 @@
+import pytest
+import sys
+import os
+import pyarrow as pa
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.columnar import ShardedWriter
+from data_pipeline.dataset_stats import DatasetStats, dataset_statistics, sequence_hashes
+
+def padded_table(rows, max_length=8):
+    """Builds a padded tokenized table from lists of real token ids."""
+    return pa.table({
+        'input_ids': [ids[:max_length] + [0] * (max_length - len(ids[:max_length])) for ids in rows],
+        'attention_mask': pa.array([[1] * len(ids[:max_length]) + [0] * (max_length - len(ids[:max_length])) for ids in rows],
+                                   type=pa.list_(pa.int8())),
+        'length': [len(ids[:max_length]) for ids in rows],
+    })
+
+def dataset_statistics_from(table, max_length):
+    """Computes the statistics of a single in-memory table."""
+    stats = DatasetStats(max_length=max_length)
+    for batch in table.to_batches():
+        stats.add(batch)
+    return stats.report()
+
+def test_sequence_hashes_find_equal_rows():
+    """Tests that equal token lists hash equally and that order, length and padding matter."""
+    ragged = sequence_hashes(pa.array([[1, 2, 3], [3, 2, 1], [1, 2, 3], [1, 2], [], [1, 2, 3, 0]]))
+    assert ragged[0] == ragged[2]
+    assert len(set(ragged.tolist())) == 5
+    fixed = sequence_hashes(pa.array([[1, 2, 3], [3, 2, 1], [1, 2, 3]]))
+    assert fixed.tolist() == [ragged[0], ragged[1], ragged[0]]
+
+def test_dataset_stats_report():
+    """Tests lengths, padding, truncation and duplicates on a small padded table."""
+    rows = [[5, 6], [5, 6], [1, 2, 3, 4], list(range(10)), [7]]
+    stats = DatasetStats(max_length=8, bin_width=4)
+    stats.start_shard(__file__)
+    for batch in padded_table(rows).to_batches(max_chunksize=2):
+        stats.add(batch)
+    report = stats.report()
+    assert report['rows'] == 5 and report['shards'][0]['rows'] == 5 and report['shards'][0]['tokens'] == 17
+    assert report['lengths']['min'] == 1 and report['lengths']['max'] == 8 and report['lengths']['p50'] == 2
+    assert report['lengths']['histogram'] == {'bin_width': 4, 'counts': [3, 1, 1]}
+    assert report['padding_ratio'] == pytest.approx(1 - 17 / 40)
+    assert report['truncation'] == {'max_length': 8, 'truncated': 1, 'rate': 0.2}
+    assert report['duplicates'] == {'duplicate_rows': 1, 'rate': 0.2}
+
+def test_packed_lengths_count_documents():
+    """Tests that a packed dataset's lengths and truncation are counted per packed document."""
+    table = pa.table({'input_ids': [[1, 2, 3, 4, 5, 6], [7, 8, 9, 0, 0, 0]], 'document_lengths': [[2, 4], [6]], 'length': [6, 3]})
+    report = dataset_statistics_from(table, max_length=6)
+    assert report['lengths']['unit'] == 'documents' and report['lengths']['count'] == 3
+    assert report['truncation']['truncated'] == 1
+
+def test_dataset_statistics_reads_shards(tmp_path):
+    """Tests per-shard sizes over a columnar dataset, and that saved `datasets` directories are read the same way."""
+    table = padded_table([[i, i + 1] for i in range(10)])
+    path = str(tmp_path / 'ordered')
+    with ShardedWriter(path, 'arrow', rows_per_shard=4) as writer:
+        writer.write_table(table.append_column('text', pa.array(['x'] * 10)))
+    report = dataset_statistics(path, max_length=8)
+    assert [shard['rows'] for shard in report['shards']] == [4, 4, 2]
+    assert all(shard['bytes'] > 0 for shard in report['shards'])
+    assert report['duplicates']['duplicate_rows'] == 0
+
+    datasets = pytest.importorskip("datasets")
+    saved = str(tmp_path / 'tokenized')
+    datasets.Dataset(table).save_to_disk(saved)
+    assert dataset_statistics(saved, max_length=8)['lengths'] == report['lengths']
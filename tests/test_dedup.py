@@ -0,0 +1,83 @@
+import sys
+import os
+import numpy as np
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.dedup import Deduplicator, MinHasher, SortedKeySet, code_tokens, content_hash, lsh_params
+from data_pipeline.extraction import extract_functions_from_source, strip_context_header
+
+BASE = (
+    "def total_price(items, tax_rate):\n"
+    "    subtotal = 0\n"
+    "    for item in items:\n"
+    "        subtotal += item.price * item.quantity\n"
+    "        if item.discount:\n"
+    "            subtotal -= item.discount\n"
+    "    tax = subtotal * tax_rate\n"
+    "    shipping = 5 if subtotal < 50 else 0\n"
+    "    return subtotal + tax + shipping\n"
+)
+
+def test_normalized_content_hash_ignores_layout_and_comments():
+    """Tests that comments and whitespace do not change the content hash, but code and strings do."""
+    reformatted = BASE.replace("    tax = ", "    # apply the tax\n    tax  =  ")
+    assert content_hash(code_tokens(reformatted)) == content_hash(code_tokens(BASE))
+    assert code_tokens("x = '# not a comment'  # a comment") == ['x', '=', "'# not a comment'"]
+    assert content_hash(code_tokens(BASE.replace("50", "60"))) != content_hash(code_tokens(BASE))
+
+def test_lsh_params_follow_the_threshold():
+    """Tests that a higher threshold gives fewer, longer bands."""
+    low_bands, low_rows = lsh_params(0.5, 128)
+    high_bands, high_rows = lsh_params(0.9, 128)
+    assert low_bands * low_rows <= 128 and high_bands * high_rows <= 128
+    assert high_rows > low_rows and high_bands < low_bands
+
+def test_signature_similarity_tracks_jaccard():
+    """Tests that near-identical code gets mostly equal MinHash values and unrelated code does not."""
+    hasher = MinHasher(num_perm=256)
+    near = BASE.replace("total_price", "order_total")
+    other = "class Cache:\n    def get(self, key):\n        return self.store.get(key, None)\n"
+    signatures = hasher.signatures([code_tokens(BASE), code_tokens(near), code_tokens(other)])
+    assert (signatures[0] == signatures[1]).mean() > 0.7
+    assert (signatures[0] == signatures[2]).mean() < 0.1
+
+def test_sorted_key_set():
+    """Tests membership across merged runs."""
+    keys = SortedKeySet()
+    for start in range(0, 1000, 100):
+        keys.add(np.arange(start, start + 100, dtype=np.uint64) * np.uint64(3))
+    assert len(keys) == 1000 and len(keys.runs) <= 4
+    assert keys.contains(np.array([0, 3, 2997, 1, 3000], dtype=np.uint64)).tolist() == [True, True, True, False, False]
+
+def test_deduplicator_keeps_first_occurrences():
+    """Tests that exact and near duplicates are dropped, counted, and batching does not matter."""
+    near = BASE.replace("total_price", "order_total")
+    other = "def greet(name):\n    return f'Hello, {name}!'\n"
+    texts = [BASE, other, BASE + "# trailing comment\n", near, other]
+
+    deduplicator = Deduplicator(MinHasher(threshold=0.7))
+    assert deduplicator.keep_mask(texts).tolist() == [True, True, False, False, False]
+    assert deduplicator.summary()['exact_duplicates'] == 2
+    assert deduplicator.summary()['near_duplicates'] == 1
+
+    batched = Deduplicator(MinHasher(threshold=0.7))
+    masks = [batched.keep_mask(texts[:2]), batched.keep_mask(texts[2:4]), batched.keep_mask(texts[4:])]
+    assert np.concatenate(masks).tolist() == [True, True, False, False, False]
+
+    exact_only = Deduplicator(MinHasher(threshold=0.7), near_duplicates=False)
+    assert exact_only.keep_mask(texts).tolist() == [True, True, False, True, False]
+
+def test_vendored_copies_match_without_their_context_headers():
+    """Tests that copies of a function in files with different imports are exact duplicates once the header is stripped."""
+    function = '@cached\n' + BASE.replace("    tax = ", "\n    tax = ")
+    first = extract_functions_from_source('import os\nfrom cache import cached\n\n' + function.replace(':\n', ':\n    """Doc."""\n', 1))
+    second = extract_functions_from_source('import sys\nRATE = 2\n\n' + function.replace(':\n', ':\n    """Doc."""\n', 1))
+    completions = [record['completion'] for record in (*first, *second)]
+    assert completions[0] != completions[1]
+    bodies = [strip_context_header(completion) for completion in completions]
+    assert bodies[0] == bodies[1] and bodies[0].startswith('@cached\n')
+    # A function without a header is left as is, even across the blank lines in its body.
+    assert strip_context_header(bodies[0]) == bodies[0]
+    assert content_hash(code_tokens(bodies[0])) == content_hash(code_tokens(bodies[1]))
@@ -0,0 +1,184 @@
+import pytest
+import sys
+import os
+import json
+import shutil
+import subprocess
+
+# Add the src directory to the Python path to allow for package imports, and the
+# scripts directory for the extraction entry points
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+
+import extract_from_repo
+from data_pipeline.columnar import open_writer
+from data_pipeline.manifest import ExtractionManifest
+from extract_from_repo import (
+    extraction_inputs,
+    iter_extracted_files,
+    iter_python_files,
+    write_full_extraction,
+    write_incremental_extraction,
+)
+
+def module_source(name, functions=3):
+    """Returns the source of a module with a few documented functions."""
+    return "import math\n\n" + "".join(
+        f'def {name}_{i}(x):\n    """Returns {name} {i}."""\n    return math.floor(x) + {i}\n\n' for i in range(functions))
+
+def make_tree(root, modules):
+    """Writes {relative path: source} into a directory tree and returns its path."""
+    for path, source in modules.items():
+        os.makedirs(os.path.dirname(os.path.join(root, path)) or str(root), exist_ok=True)
+        with open(os.path.join(root, path), 'w', encoding='utf-8') as f:
+            f.write(source)
+    return str(root)
+
+def git(cwd, *args):
+    """Runs git with a fixed identity."""
+    subprocess.run(['git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com', *args],
+                   cwd=cwd, check=True, capture_output=True)
+
+def read_jsonl(path):
+    """Reads a JSONL file into a list of records."""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def extract_incrementally(file_paths, manifest_path, output_path):
+    """Runs one incremental extraction and returns its records and manifest stats."""
+    with ExtractionManifest(manifest_path, 'test') as manifest, open_writer(output_path) as out:
+        count = write_incremental_extraction(out, file_paths, manifest, 1, 4, 'single_pass')
+        stats = manifest.stats
+    records = read_jsonl(output_path)
+    assert count == len(records)
+    return records, stats
+
+def extract_fully(file_paths, output_path):
+    """Runs a full extraction and returns its records."""
+    with open_writer(output_path) as out:
+        write_full_extraction(out, file_paths, 1, 4, 'single_pass')
+    return read_jsonl(output_path)
+
+def test_parallel_extraction_matches_in_process_order(tmp_path):
+    """Tests that a process pool yields the same records in the same order, with a bounded number of batches in flight."""
+    repo = make_tree(tmp_path / 'repo', {f'pkg{i % 3}/mod_{i:02d}.py': module_source(f'f{i}') for i in range(40)})
+    files = list(iter_python_files(repo))
+    serial = list(iter_extracted_files(files, num_workers=1))
+
+    pulled = []
+
+    def listing():
+        for path in files:
+            pulled.append(path)
+            yield path
+
+    parallel = []
+    ahead = []
+    for result in iter_extracted_files(listing(), num_workers=2, chunk_size=3):
+        parallel.append(result)
+        ahead.append(len(pulled) - len(parallel))
+    assert parallel == serial
+    assert [path for path, _, _, _, _ in parallel] == files
+    assert sum(len(records) for _, records, _, _, _ in parallel) == 120
+    # At most 2 * num_workers batches of chunk_size files are read ahead of the output.
+    assert max(ahead) <= 2 * 2 * 3
+
+def test_incremental_extraction_carries_unchanged_files_forward(tmp_path, monkeypatch):
+    """Tests that a second incremental run re-extracts only new and changed files and matches a full extraction."""
+    repo = make_tree(tmp_path / 'repo', {f'mod_{i}.py': module_source(f'f{i}') for i in range(5)})
+    manifest_path = str(tmp_path / 'manifest.sqlite')
+    records, stats = extract_incrementally(iter_python_files(repo), manifest_path, str(tmp_path / 'first.jsonl'))
+    assert len(records) == 15 and stats['new'] == 5
+
+    make_tree(repo, {'mod_1.py': module_source('changed', functions=2), 'mod_5.py': module_source('added')})
+    os.utime(os.path.join(repo, 'mod_2.py'), ns=(1, 1))
+    os.remove(os.path.join(repo, 'mod_3.py'))
+    extracted = []
+    extract_file = extract_from_repo.extract_file_records
+    monkeypatch.setattr(extract_from_repo, 'extract_file_records',
+                        lambda path, *args: extracted.append(os.path.basename(path)) or extract_file(path, *args))
+
+    records, stats = extract_incrementally(iter_python_files(repo), manifest_path, str(tmp_path / 'second.jsonl'))
+    assert extracted == ['mod_1.py', 'mod_5.py']
+    assert stats == {'unchanged': 2, 'touched': 1, 'changed': 1, 'new': 1, 'deleted': 1}
+    assert records == extract_fully(iter_python_files(repo), str(tmp_path / 'full.jsonl'))
+    assert [record['prompt'] for record in records[3:5]] == ['Returns changed 0.', 'Returns changed 1.']
+
+def test_manifest_stores_the_identity_of_the_extracted_bytes(tmp_path, monkeypatch):
+    """Tests that a file changed between classification and extraction is not carried forward under its old hash."""
+    repo = make_tree(tmp_path / 'repo', {f'mod_{i}.py': module_source(f'f{i}') for i in range(3)})
+    target = os.path.join(repo, 'mod_1.py')
+    original = os.stat(target).st_mtime_ns
+    extract_file = extract_from_repo.extract_file_records
+
+    def edit_then_extract(path, *args):
+        # Another writer edits the file after it was classified but before it is read.
+        if path == target:
+            make_tree(repo, {'mod_1.py': module_source('edited')})
+            os.utime(target, ns=(original + 10**9, original + 10**9))
+        return extract_file(path, *args)
+
+    monkeypatch.setattr(extract_from_repo, 'extract_file_records', edit_then_extract)
+    records, _ = extract_incrementally(iter_python_files(repo), str(tmp_path / 'manifest.sqlite'), str(tmp_path / 'first.jsonl'))
+    assert [record['prompt'] for record in records[3:6]] == ['Returns edited 0.', 'Returns edited 1.', 'Returns edited 2.']
+
+    # The edit is reverted, stat-identical to the file the first run classified.
+    monkeypatch.setattr(extract_from_repo, 'extract_file_records', extract_file)
+    make_tree(repo, {'mod_1.py': module_source('f1')})
+    os.utime(target, ns=(original, original))
+    records, stats = extract_incrementally(iter_python_files(repo), str(tmp_path / 'manifest.sqlite'), str(tmp_path / 'second.jsonl'))
+    assert stats['changed'] == 1 and stats['unchanged'] == 2
+    assert records == extract_fully(iter_python_files(repo), str(tmp_path / 'full.jsonl'))
+
+@pytest.mark.skipif(shutil.which('git') is None, reason="needs the git CLI")
+def test_git_source_extracts_revisions_incrementally(tmp_path, monkeypatch):
+    """Tests the git source end to end: revisions match worktree extraction, blobs carry forward by object id and are pruned."""
+    work = make_tree(tmp_path / 'work', {'pkg/a.py': module_source('a'), 'b.py': module_source('b'), 'README.md': '# docs\n'})
+    git(work, 'init', '-q')
+    git(work, 'add', '-A')
+    git(work, 'commit', '-q', '-m', 'one')
+    git(work, 'tag', 'v1')
+    v1_records = extract_fully(iter_python_files(work), str(tmp_path / 'v1.jsonl'))
+    make_tree(work, {'b.py': module_source('b2'), 'c.py': module_source('c')})
+    git(work, 'add', '-A')
+    git(work, 'commit', '-q', '-m', 'two')
+    head_records = extract_fully(iter_python_files(work), str(tmp_path / 'head.jsonl'))
+    bare = str(tmp_path / 'repo.git')
+    git(str(tmp_path), 'clone', '-q', '--bare', work, bare)
+
+    def config(revisions, **extraction):
+        return {'data': {'raw_repo_path': work},
+                'extraction': {'source': 'git', 'git': {'repositories': [{'path': bare, 'revisions': revisions}]}, **extraction}}
+
+    extracted = []
+    extract_file = extract_from_repo.extract_file_records
+    monkeypatch.setattr(extract_from_repo, 'extract_file_records',
+                        lambda blob, *args: extracted.append(blob.path) or extract_file(blob, *args))
+    manifest_path = str(tmp_path / 'manifest.sqlite')
+
+    git_stats = {}
+    _, blobs = extraction_inputs(config('v1'), git_stats)
+    records, stats = extract_incrementally(blobs, manifest_path, str(tmp_path / 'first.jsonl'))
+    assert records == v1_records and stats['new'] == 2 and git_stats == {'blobs': 2, 'duplicate_blobs': 0}
+
+    extracted.clear()
+    git_stats = {}
+    _, blobs = extraction_inputs(config(['v1', 'HEAD']), git_stats)
+    records, stats = extract_incrementally(blobs, manifest_path, str(tmp_path / 'second.jsonl'))
+    assert extracted == ['b.py', 'c.py'] and git_stats == {'blobs': 5, 'duplicate_blobs': 1}
+    assert stats == {'unchanged': 2, 'touched': 0, 'changed': 0, 'new': 2, 'deleted': 0}
+    assert records == v1_records + head_records[:6]
+
+    extracted.clear()
+    _, blobs = extraction_inputs(config('HEAD'))
+    records, stats = extract_incrementally(blobs, manifest_path, str(tmp_path / 'third.jsonl'))
+    assert extracted == [] and records == head_records
+    assert stats == {'unchanged': 3, 'touched': 0, 'changed': 0, 'new': 0, 'deleted': 1}
+
+    sharded = config('HEAD')
+    sharded['sharding'] = {'shard_index': 0, 'shard_count': 2}
+    for bad in (sharded, config('HEAD', engine='legacy'), config('no-such-tag')):
+        with pytest.raises(ValueError):
+            extraction_inputs(bad)
+    with pytest.raises(ValueError):
+        extraction_inputs({'data': {}, 'extraction': {'source': 'git'}})
@@ -0,0 +1,148 @@
+import pytest
+import ast
+import sys
+import os
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.extraction import (
+    SourceIndex,
+    extract_functions_from_source,
+    extract_functions_from_file,
+)
+
+SAMPLE_SOURCE = '''import math
+from os import path
+
+SCALE = 2  # module constant
+
+def area(r):
+    """Computes the area of a circle."""
+    # comments are kept verbatim
+    return math.pi * r ** 2 * SCALE
+
+class Shape:
+    @staticmethod
+    def describe(name):
+        """Describes a shape."""
+        def helper(x):
+            """Nested helper."""
+            return x.upper()
+        return helper(name)
+
+def undocumented():
+    return None
+'''
+
+@pytest.fixture
+def records():
+    """Returns the records extracted from the sample source."""
+    return list(extract_functions_from_source(SAMPLE_SOURCE))
+
+def test_extracts_documented_functions_in_source_order(records):
+    """Tests that top-level functions, methods and nested defs are extracted once each, in order."""
+    assert [r['prompt'] for r in records] == [
+        'Computes the area of a circle.',
+        'Describes a shape.',
+        'Nested helper.',
+    ]
+
+def test_completion_is_verbatim_source_with_context(records):
+    """Tests that the completion is sliced from the source instead of being regenerated."""
+    completion = records[0]['completion']
+    assert completion.startswith("import math\nfrom os import path\nSCALE = 2\n\ndef area(r):")
+    assert "# comments are kept verbatim" in completion
+    assert "math.pi * r ** 2 * SCALE" in completion
+
+def test_methods_are_dedented_and_keep_decorators(records):
+    """Tests that methods are dedented to column zero, including their decorators."""
+    method_source = records[1]['completion'].split("\n\n", 1)[1]
+    assert method_source.startswith("@staticmethod\ndef describe(name):")
+    ast.parse(method_source)
+
+def test_nested_functions_can_be_excluded():
+    """Tests that include_nested=False skips functions defined inside other functions."""
+    prompts = [r['prompt'] for r in extract_functions_from_source(SAMPLE_SOURCE, include_nested=False)]
+    assert prompts == ['Computes the area of a circle.', 'Describes a shape.']
+
+def test_size_is_measured_in_bytes():
+    """Tests that the oversized threshold applies to the UTF-8 byte span, not the character count."""
+    source = 'def f():\n    """Doc."""\n    for c in "éééé":\n        pass\n'
+    index = SourceIndex(source)
+    node = ast.parse(source).body[0]
+    assert index.span_size(node) == len(source.rstrip("\n").encode("utf-8"))
+
+    chunked = list(extract_functions_from_source(source, max_function_bytes=index.span_size(node) - 1))
+    assert len(chunked) == 1
+    assert "'For' block" in chunked[0]['prompt']
+    assert chunked[0]['completion'] == 'for c in "éééé":\n    pass'
+
+def test_unparsable_file_falls_back_to_per_definition_parsing():
+    """Tests that a syntax error in one function does not drop the rest of the file."""
+    source = 'import os\n\ndef broken(:\n    pass\n\ndef ok():\n    """Still extracted."""\n    return 1\n'
+    records = list(extract_functions_from_source(source))
+    assert records == [{'prompt': 'Still extracted.', 'completion': 'def ok():\n    """Still extracted."""\n    return 1'}]
+
+def test_extract_functions_from_file(tmp_path):
+    """Tests extraction from a file on disk with CRLF line endings."""
+    file_path = tmp_path / "module.py"
+    file_path.write_bytes(b'def f():\r\n    """Doc."""\r\n    return 1\r\n')
+    records = list(extract_functions_from_file(str(file_path)))
+    assert records == [{'prompt': 'Doc.', 'completion': 'def f():\n    """Doc."""\n    return 1'}]
+
+PRUNING_SOURCE = '''import os
+import numpy as np
+from collections import OrderedDict as OD
+from helpers import *
+
+BASE = 10
+LIMIT = BASE * 2
+TABLE = {"a": 1, "b": 2}
+TABLE["c"] = 3
+UNUSED = [1, 2, 3]
+
+def scaled(x):
+    """Scales x up to the limit."""
+    return min(np.asarray(x) * LIMIT, os.sep)
+
+def lookup(key):
+    """Looks a key up in the table."""
+    return OD(TABLE)[key]
+
+def standalone():
+    """Uses no globals."""
+    return 1
+'''
+
+def test_pruned_context_keeps_only_referenced_globals_transitively():
+    """Tests that each header keeps the globals a function reads and the ones those depend on."""
+    records = list(extract_functions_from_source(PRUNING_SOURCE, prune_context=True))
+    headers = [r['completion'].split("\n\ndef ", 1)[0] for r in records]
+    assert headers[0] == "import os\nimport numpy as np\nfrom helpers import *\nBASE = 10\nLIMIT = BASE * 2"
+    assert headers[1] == 'from collections import OrderedDict as OD\nfrom helpers import *\nTABLE = {"a": 1, "b": 2}\nTABLE["c"] = 3'
+    # Star imports cannot be resolved, so they are always kept.
+    assert records[2]['completion'].startswith("from helpers import *\n\ndef standalone():")
+
+def test_pruned_chunks_keep_only_what_the_chunk_reads():
+    """Tests that each chunk of an oversized function gets its own pruned header."""
+    source = ('import os\nimport sys\n\ndef big():\n    """Doc."""\n'
+              '    for p in sys.path:\n        pass\n    with open(os.devnull) as f:\n        pass\n')
+    chunks = list(extract_functions_from_source(source, max_function_bytes=10, prune_context=True))
+    assert [c['completion'].split("\n\n", 1)[0] for c in chunks] == ["import sys", "import os"]
+
+def test_context_stats_report_bytes_saved():
+    """Tests that the header bytes with and without pruning are accumulated and summarized."""
+    from data_pipeline.extraction import context_savings
+
+    full_stats, pruned_stats = {}, {}
+    full = list(extract_functions_from_source(PRUNING_SOURCE, stats=full_stats))
+    pruned = list(extract_functions_from_source(PRUNING_SOURCE, prune_context=True, stats=pruned_stats))
+    full_bytes = sum(len(r['completion'].encode('utf-8')) for r in full)
+    pruned_bytes = sum(len(r['completion'].encode('utf-8')) for r in pruned)
+
+    savings = context_savings(pruned_stats)
+    assert savings['records'] == 3
+    assert savings['bytes_full'] == full_stats['context_bytes_kept']
+    assert savings['bytes_saved'] == full_bytes - pruned_bytes > 0
+    assert savings['tokens_saved'] == savings['bytes_saved'] // 4
@@ -0,0 +1,82 @@
+import pytest
+import sys
+import os
+import json
+import random
+import http.client
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.batch_judge import build_batch_judge_prompt, parse_batch_judge_response
+from data_pipeline.fake_llm_server import FakeLLM, FakeLLMServer, LatencyModel
+
+FAST = LatencyModel(distribution='constant', seconds=0.0)
+CODE = "def add(a, b):\n    return a + b"
+
+def judge_prompt(code):
+    """A judge prompt shaped like the refinement stage's."""
+    return f'Respond ONLY with a JSON object with "score" and "reason".\n```python\n{code}\n```\n```\nAdds.\n```'
+
+def post(connection, prompt, model='gpt-3.5-turbo'):
+    """Sends one chat completion over an open connection and returns (status, headers, body)."""
+    body = json.dumps({'model': model, 'messages': [{'role': 'user', 'content': prompt}]})
+    connection.request('POST', '/v1/chat/completions', body, {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    return response.status, dict(response.getheaders()), json.loads(response.read())
+
+@pytest.fixture
+def server():
+    """A fake server without latency or faults, on a free port."""
+    with FakeLLMServer(FakeLLM(FAST, FAST, bad_docstring_rate=0.5)) as server:
+        yield server
+
+def test_answers_are_openai_shaped_and_deterministic(server):
+    """Tests judge, batch judge and generator answers, and that they repeat for the same input."""
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    status, _, body = post(connection, judge_prompt(CODE))
+    assert status == 200 and body['object'] == 'chat.completion' and body['usage']['total_tokens'] > 0
+    verdict = json.loads(body['choices'][0]['message']['content'])
+    assert verdict['score'] in (2, 5)
+    assert post(connection, judge_prompt(CODE))[2]['choices'] == body['choices']
+
+    pairs = [('Adds.', CODE), ('Does things.', "def mul(a, b):\n    return a * b")]
+    content = post(connection, build_batch_judge_prompt(pairs))[2]['choices'][0]['message']['content']
+    verdicts = parse_batch_judge_response(content, 2)
+    assert verdicts[0]['score'] == verdict['score'] and verdicts[1] is not None
+
+    generated = post(connection, f"Write a docstring.\n```python\n{CODE}\n```")[2]['choices'][0]['message']['content']
+    assert '`add`' in generated
+
+def test_keep_alive_reuses_one_connection(server):
+    """Tests that several requests on one HTTP/1.1 connection count as one connection."""
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    for i in range(5):
+        assert post(connection, judge_prompt(f"def f{i}(): pass"))[0] == 200
+    stats = server.snapshot()
+    assert stats['connections'] == 1 and stats['requests'] == 5 and stats['requests.judge'] == 5
+
+def test_fault_injection_is_per_prompt_attempt():
+    """Tests 429s with Retry-After and 500s, decided the same way in every run."""
+    def statuses():
+        llm = FakeLLM(FAST, FAST, rate_limit_rate=0.3, error_rate=0.2, retry_after_seconds=2, seed=7)
+        with FakeLLMServer(llm) as server:
+            connection = http.client.HTTPConnection(*server.server_address[:2])
+            results = [post(connection, judge_prompt(f"def f{i % 10}(): pass"))[:2] for i in range(40)]
+            return [status for status, _ in results], server.snapshot(), results
+
+    first, stats, results = statuses()
+    assert statuses()[0] == first
+    assert {429, 500, 200} <= set(first)
+    assert stats['rate_limited'] == first.count(429) and stats['server_errors'] == first.count(500)
+    assert all(headers['Retry-After'] == '2' for status, headers in results if status == 429)
+
+def test_latency_models():
+    """Tests that each distribution stays in its bounds."""
+    rng = random.Random(0)
+    assert LatencyModel('constant', seconds=0.25).sample(rng) == 0.25
+    assert all(0.1 <= LatencyModel('uniform', low_seconds=0.1, high_seconds=0.2).sample(rng) <= 0.2 for _ in range(100))
+    samples = [LatencyModel('lognormal', seconds=1.0, sigma=1.0, max_seconds=5.0).sample(rng) for _ in range(1000)]
+    assert max(samples) <= 5.0 and 0.8 < sorted(samples)[500] < 1.25
+    with pytest.raises(ValueError):
+        LatencyModel('gamma')
@@ -0,0 +1,83 @@
+import pytest
+import sys
+import os
+import shutil
+import subprocess
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.extraction import extract_functions_from_bytes
+from data_pipeline.git_source import GitBlobReader, iter_git_blobs, list_python_blobs, resolve_sources, with_contents
+from data_pipeline.manifest import ExtractionManifest
+
+pytestmark = pytest.mark.skipif(shutil.which('git') is None, reason="needs the git CLI")
+
+def git(cwd, *args):
+    """Runs git with a fixed identity and returns its output."""
+    return subprocess.run(['git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com', *args],
+                          cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+def commit(work, files, message):
+    """Writes files into the working copy and commits them."""
+    for path, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(work, path)) or work, exist_ok=True)
+        with open(os.path.join(work, path), 'w') as f:
+            f.write(content)
+    git(work, 'add', '-A')
+    git(work, 'commit', '-q', '-m', message)
+
+def function(name, doc):
+    """Returns the source of a documented function."""
+    return f'def {name}(a):\n    """{doc}"""\n    return a\n'
+
+@pytest.fixture
+def bare_repo(tmp_path):
+    """Returns a bare repository with tag v1 (two .py files) and a second commit changing one of them."""
+    work = str(tmp_path / 'work')
+    os.makedirs(work)
+    git(work, 'init', '-q')
+    commit(work, {'pkg/a.py': function('a', 'Returns a unchanged.'), 'b.py': function('b', 'Returns b as given.'),
+                  'README.md': '# not python\n'}, 'one')
+    git(work, 'tag', 'v1')
+    commit(work, {'b.py': function('b', 'Returns b, documented better.'), 'c.py': function('c', 'Returns c.')}, 'two')
+    bare = str(tmp_path / 'repo.git')
+    git(str(tmp_path), 'clone', '-q', '--bare', work, bare)
+    return bare
+
+def test_lists_python_blobs_without_checkout(bare_repo):
+    """Tests that a revision's .py files are listed from the object database and read by object id."""
+    [(repo, [commit_id])] = resolve_sources([{'path': bare_repo, 'revisions': 'v1'}])
+    blobs = list(list_python_blobs(repo, commit_id))
+    assert [blob.path for blob in blobs] == ['b.py', 'pkg/a.py']
+    with GitBlobReader(repo) as reader:
+        assert reader.read(blobs[1].oid).decode() == function('a', 'Returns a unchanged.')
+    assert str(blobs[1]) == f"{repo}@{commit_id[:12]}:pkg/a.py"
+    with pytest.raises(ValueError):
+        resolve_sources([{'path': bare_repo, 'revisions': ['no-such-tag']}])
+
+def test_blobs_are_deduplicated_across_revisions_and_repositories(bare_repo, tmp_path):
+    """Tests that a blob shared by revisions or repositories is yielded once, at its first occurrence."""
+    copy = str(tmp_path / 'copy.git')
+    git(str(tmp_path), 'clone', '-q', '--bare', bare_repo, copy)
+    sources = resolve_sources([{'path': bare_repo, 'revisions': ['v1', 'HEAD']}, {'path': copy}])
+    stats = {}
+    blobs = list(with_contents(iter_git_blobs(sources, stats)))
+    assert [blob.path for blob in blobs] == ['b.py', 'pkg/a.py', 'b.py', 'c.py']
+    assert stats == {'blobs': 8, 'duplicate_blobs': 4}
+    assert b'documented better' in blobs[2].content
+
+def test_blobs_are_extracted_and_kept_in_the_manifest_by_object_id(bare_repo, tmp_path):
+    """Tests extraction from blob contents, and that the manifest knows a blob from any revision by its object id."""
+    sources = resolve_sources([{'path': bare_repo, 'revisions': 'v1'}])
+    with ExtractionManifest(str(tmp_path / 'manifest.sqlite'), 'test') as manifest:
+        for blob in with_contents(iter_git_blobs(sources)):
+            unchanged, state = manifest.classify_blob(blob.key, blob.size)
+            assert not unchanged and state.path == f"git:{blob.oid}"
+            manifest.put(state, list(extract_functions_from_bytes(blob.content)))
+        assert manifest.get_records('git:' + next(iter_git_blobs(sources)).oid)[0] == 1
+
+        later = resolve_sources([{'path': bare_repo, 'revisions': 'HEAD'}])
+        seen = [manifest.classify_blob(blob.key, blob.size)[0] for blob in iter_git_blobs(later)]
+        assert seen == [False, False, True]
+        assert manifest.stats == {'unchanged': 1, 'touched': 0, 'changed': 0, 'new': 4, 'deleted': 0}
@@ -0,0 +1,93 @@
+import pytest
+import sys
+import os
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.llm_cache import ResponseCache
+from data_pipeline.refinement import AsyncRefiner, MalformedLLMResponse
+
+@pytest.fixture
+def cache_path(tmp_path):
+    """Returns the path of a fresh cache database."""
+    return str(tmp_path / "cache.sqlite")
+
+def test_values_persist_across_instances(cache_path):
+    """Tests that a stored response is returned by a later cache instance and counted as a hit."""
+    key = ResponseCache.make_key('judge', 'model', '1', 'doc', 'code')
+    with ResponseCache(cache_path) as cache:
+        assert cache.get(key) is None
+        cache.put(key, {'score': 5})
+    with ResponseCache(cache_path) as cache:
+        assert cache.get(key) == {'score': 5}
+        assert cache.stats == {'hits': 1, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+def test_key_depends_on_every_part():
+    """Tests that the model, template version and inputs all change the key."""
+    base = ResponseCache.make_key('judge', 'model', '1', 'doc', 'code')
+    assert base != ResponseCache.make_key('judge', 'other-model', '1', 'doc', 'code')
+    assert base != ResponseCache.make_key('judge', 'model', '2', 'doc', 'code')
+    assert base != ResponseCache.make_key('judge', 'model', '1', 'doc', 'code2')
+    assert ResponseCache.make_key('k', 'm', 'v', 'ab', 'c') != ResponseCache.make_key('k', 'm', 'v', 'a', 'bc')
+
+def test_expired_entries_miss_and_are_evicted(cache_path):
+    """Tests that entries older than the TTL are misses and are removed by evict."""
+    with ResponseCache(cache_path, ttl_seconds=-1) as cache:
+        cache.put('key', 'value')
+        assert cache.get('key') is None
+        assert cache.stats['expired'] == 1
+        assert cache.evict() == 1
+        assert len(cache) == 0
+
+def test_evict_keeps_most_recently_used(cache_path):
+    """Tests that evict trims to max_entries, dropping the least recently used entries."""
+    with ResponseCache(cache_path, max_entries=2) as cache:
+        for key in ('a', 'b', 'c'):
+            cache.put(key, key)
+        cache.get('a')
+        assert cache.evict() == 1
+        assert cache.get('b') is None
+        assert cache.get('a') == 'a'
+        assert cache.get('c') == 'c'
+
+def test_refiner_skips_cached_calls(cache_path):
+    """Tests that a second refinement run is served entirely from the cache."""
+    calls = []
+
+    async def judge(docstring, code):
+        calls.append('judge')
+        return {'score': 1}
+
+    async def generator(code):
+        calls.append('generator')
+        return 'generated'
+
+    records = [{'prompt': 'doc', 'completion': 'def f(): pass'}]
+    for _ in range(2):
+        with ResponseCache(cache_path) as cache:
+            refiner = AsyncRefiner(judge, generator, cache=cache, judge_model='m', generator_model='m', prompt_version='1')
+            assert refiner.run(records) == [{'prompt': 'generated', 'completion': 'def f(): pass'}]
+    assert calls == ['judge', 'generator']
+    assert refiner.stats['cache_hits'] == 2
+
+def test_malformed_responses_are_not_cached(cache_path):
+    """Tests that a fallback verdict for a malformed response is used but not cached, so the next run asks again."""
+    calls = []
+
+    async def judge(docstring, code):
+        calls.append('judge')
+        if len(calls) == 1:
+            raise MalformedLLMResponse('not JSON', {'score': 3})
+        return {'score': 5}
+
+    async def generator(code):
+        return 'generated'
+
+    records = [{'prompt': 'doc', 'completion': 'def f(): pass'}]
+    for _ in range(3):
+        with ResponseCache(cache_path) as cache:
+            refiner = AsyncRefiner(judge, generator, cache=cache, judge_model='m', generator_model='m', prompt_version='1')
+            assert refiner.run(records) == records
+    assert calls == ['judge', 'judge']
+    assert refiner.stats['cache_hits'] == 1
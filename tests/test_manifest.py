@@ -0,0 +1,68 @@
+import pytest
+import os
+import sys
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.manifest import ExtractionManifest, records_to_jsonl
+
+RECORDS = [{'prompt': 'Doc.', 'completion': 'def f():\n    """Doc."""'}]
+
+@pytest.fixture
+def source_file(tmp_path):
+    """Returns the path of a small source file."""
+    path = tmp_path / "module.py"
+    path.write_text('def f():\n    """Doc."""\n')
+    return str(path)
+
+@pytest.fixture
+def manifest_path(tmp_path):
+    """Returns the path of a fresh manifest database."""
+    return str(tmp_path / "manifest.sqlite")
+
+def test_new_file_is_extracted_then_carried_forward(source_file, manifest_path):
+    """Tests that a stored file is reported unchanged on the next run and its records are returned."""
+    with ExtractionManifest(manifest_path, 'single_pass') as manifest:
+        unchanged, state = manifest.classify(source_file)
+        assert unchanged is False
+        manifest.put(state, RECORDS)
+
+    with ExtractionManifest(manifest_path, 'single_pass') as manifest:
+        unchanged, _ = manifest.classify(source_file)
+        assert unchanged is True
+        assert manifest.get_records(source_file) == (1, records_to_jsonl(RECORDS))
+        assert manifest.stats['unchanged'] == 1
+
+def test_touched_file_is_unchanged_but_edited_file_is_not(source_file, manifest_path):
+    """Tests that an mtime-only change is detected by hash, while a content change forces re-extraction."""
+    with ExtractionManifest(manifest_path, 'single_pass') as manifest:
+        manifest.put(manifest.classify(source_file)[1], RECORDS)
+
+    stat = os.stat(source_file)
+    os.utime(source_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    with ExtractionManifest(manifest_path, 'single_pass') as manifest:
+        assert manifest.classify(source_file)[0] is True
+        assert manifest.stats['touched'] == 1
+
+    with open(source_file, 'a') as f:
+        f.write("x = 1\n")
+    with ExtractionManifest(manifest_path, 'single_pass') as manifest:
+        assert manifest.classify(source_file)[0] is False
+        assert manifest.stats['changed'] == 1
+
+def test_prune_removes_deleted_files(source_file, manifest_path):
+    """Tests that entries for files missing from the current run are removed."""
+    with ExtractionManifest(manifest_path, 'single_pass') as manifest:
+        manifest.put(manifest.classify(source_file)[1], RECORDS)
+        assert manifest.prune(set()) == 1
+        assert manifest.get_records(source_file) == (0, "")
+
+def test_extractor_change_resets_manifest(source_file, manifest_path):
+    """Tests that switching extractor discards previously stored records."""
+    with ExtractionManifest(manifest_path, 'single_pass') as manifest:
+        manifest.put(manifest.classify(source_file)[1], RECORDS)
+
+    with ExtractionManifest(manifest_path, 'legacy') as manifest:
+        assert manifest.classify(source_file)[0] is False
+        assert manifest.stats['new'] == 1
@@ -0,0 +1,127 @@
+import pytest
+import sys
+import os
+import json
+import threading
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.metrics import Histogram, StageMetrics, current_metrics, stage_metrics, stage_timer, timed
+from data_pipeline.refinement import AsyncRefiner
+
+def test_histogram_percentiles():
+    """Tests that percentiles fall in the right bucket and never exceed the observed maximum."""
+    histogram = Histogram()
+    for _ in range(90):
+        histogram.observe(0.01)
+    for _ in range(10):
+        histogram.observe(1.5)
+    summary = histogram.to_dict()
+    assert summary['count'] == 100
+    assert summary['min'] == 0.01 and summary['max'] == 1.5
+    assert 0.01 <= summary['p50'] <= 0.016
+    assert summary['p99'] == 1.5
+    assert sum(summary['buckets'].values()) == 100
+
+def test_stage_writes_metrics_file_and_summary_line(tmp_path, capsys):
+    """Tests that a stage writes its JSON file and prints the same summary as its last line."""
+    with StageMetrics('extract', metrics_dir=str(tmp_path)) as metrics:
+        assert current_metrics() is metrics
+        metrics.incr('records', 3)
+        with metrics.timer('parse'):
+            pass
+    assert current_metrics() is None
+
+    with open(tmp_path / 'extract.json') as f:
+        saved = json.load(f)
+    assert saved['counters'] == {'records': 3, 'failed': 0}
+    assert saved['timers']['parse']['calls'] == 1
+    assert saved['peak_rss_mb'] > 0
+    last_line = capsys.readouterr().out.strip().splitlines()[-1]
+    assert json.loads(last_line)['counters'] == saved['counters']
+
+def test_failed_stage_is_recorded(tmp_path):
+    """Tests that a stage ending in an exception still writes its metrics, marked as failed."""
+    with pytest.raises(ValueError):
+        with StageMetrics('process', metrics_dir=str(tmp_path)):
+            raise ValueError("boom")
+    with open(tmp_path / 'process.json') as f:
+        assert json.load(f)['counters']['failed'] == 1
+
+def test_timed_functions_and_generators(capsys):
+    """Tests that decorated functions and generators are timed inside a stage and run normally outside one."""
+    @timed('square')
+    def square(x):
+        return x * x
+
+    @timed('count')
+    def count(n):
+        yield from range(n)
+
+    assert square(3) == 9 and list(count(3)) == [0, 1, 2]
+    with stage_timer('outside'):
+        pass
+
+    with StageMetrics('stage') as metrics:
+        square(2)
+        square(4)
+        assert list(count(5)) == [0, 1, 2, 3, 4]
+        with stage_timer('block'):
+            pass
+    assert metrics.timers['square']['calls'] == 2
+    assert metrics.timers['count']['calls'] == 1
+    assert metrics.timers['block']['calls'] == 1
+
+def test_progress_is_rate_limited(capsys):
+    """Tests that progress lines are printed at most once per interval."""
+    metrics = StageMetrics('extract', progress_interval=3600)
+    for done in range(1000):
+        metrics.progress(done)
+    assert capsys.readouterr().out == ''
+
+    metrics = StageMetrics('extract', progress_interval=0)
+    metrics.progress(10, total=20, unit='files')
+    assert '[extract] 10/20 files (50%)' in capsys.readouterr().out
+
+def test_collectors_are_isolated_per_thread():
+    """Tests that stages running on different threads each record into their own collector."""
+    seen = {}
+
+    def run(name):
+        with StageMetrics(name, reset_rss=False) as metrics:
+            metrics.incr(name)
+            seen[name] = current_metrics().counters
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen['a'] == {'a': 1, 'failed': 0}
+    assert seen['b'] == {'b': 1, 'failed': 0}
+
+def test_llm_call_latencies_are_recorded():
+    """Tests that the refiner records a latency histogram per kind of LLM call."""
+    async def judge(docstring, code):
+        return {'score': 1 if 'bad' in docstring else 5}
+
+    async def generator(code):
+        return 'new docstring'
+
+    records = [{'prompt': 'bad', 'completion': 'def f(): pass'}, {'prompt': 'good', 'completion': 'def g(): pass'}]
+    with StageMetrics('refine') as metrics:
+        refined = AsyncRefiner(judge, generator, concurrency=2).run(records)
+    assert refined[0]['prompt'] == 'new docstring'
+    assert metrics.histograms['llm.judge'].count == 2
+    assert metrics.histograms['llm.generator'].count == 1
+
+def test_stage_metrics_from_config(tmp_path):
+    """Tests that the collector is configured from the 'metrics' section of the config."""
+    config = {'metrics': {'metrics_dir': str(tmp_path), 'progress_interval_seconds': 5, 'profile': True}}
+    with stage_metrics('tokenize', config) as metrics:
+        sum(range(1000))
+    assert metrics.progress_interval == 5
+    assert os.path.exists(tmp_path / 'tokenize.json')
+    assert os.path.exists(tmp_path / 'tokenize.prof')
+    assert os.path.exists(tmp_path / 'tokenize.prof.txt')
@@ -0,0 +1,63 @@
+import sys
+import os
+import numpy as np
+import pyarrow as pa
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.columnar import ShardedWriter, read_manifest
+from data_pipeline.ordering import BatchPaddingMeter, external_shuffle, length_bucketed, row_lengths, spill_buckets
+
+def make_tables(num_rows=1000, batch=137, seed=0):
+    """Splits rows with an id and a random token length into input tables."""
+    lengths = np.random.default_rng(seed).integers(1, 500, size=num_rows)
+    table = pa.table({'id': np.arange(num_rows), 'length': lengths})
+    return [table.slice(start, batch) for start in range(0, num_rows, batch)]
+
+def ids(tables):
+    """Concatenates the id column of a table stream."""
+    return np.concatenate([table.column('id').to_numpy() for table in tables])
+
+def test_shuffle_order_does_not_depend_on_memory_budget(tmp_path):
+    """Tests that the shuffle is a seeded permutation, identical in memory and spilled to any number of buckets."""
+    in_memory = ids(external_shuffle(make_tables(), seed=3))
+    stats = {}
+    spilled = ids(external_shuffle(make_tables(batch=50), seed=3, num_buckets=7, spill_dir=str(tmp_path / 'spill'), stats=stats))
+    assert sorted(in_memory) == list(range(1000)) and not np.array_equal(in_memory, np.arange(1000))
+    assert np.array_equal(in_memory, spilled)
+    assert stats['rows'] == 1000 and stats['buckets'] == 7 and stats['spilled_bytes'] > 0
+    assert not os.path.exists(tmp_path / 'spill')
+    assert not np.array_equal(in_memory, ids(external_shuffle(make_tables(), seed=4)))
+
+def test_spill_buckets_fit_the_budget():
+    """Tests that buckets are added as the data outgrows memory."""
+    assert spill_buckets(100, 1000) == 1
+    assert spill_buckets(10_000, 1000) == 13
+
+def test_length_bucketed_batches_reduce_padding():
+    """Tests that every row is kept, batches are full except the last, and padding drops."""
+    shuffled = list(external_shuffle(make_tables(), seed=1))
+    batches = list(length_bucketed(shuffled, batch_size=16, pool_batches=8, seed=1))
+    assert sorted(ids(batches)) == list(range(1000))
+    assert all(batch.num_rows == 16 for batch in batches[:-1]) and batches[-1].num_rows == 1000 % 16
+
+    before, after = BatchPaddingMeter(16), BatchPaddingMeter(16)
+    for table in shuffled:
+        before.add(row_lengths(table))
+    for batch in batches:
+        after.add(row_lengths(batch))
+    assert after.ratio < before.ratio / 3
+
+def test_sharded_writer_indexes_shards(tmp_path):
+    """Tests the first-row and length index in the manifest."""
+    path = str(tmp_path / 'ordered')
+    with ShardedWriter(path, 'arrow', rows_per_shard=400, length_column='length') as writer:
+        writer.metadata = {'ordering': {'mode': 'shuffle'}}
+        for table in make_tables():
+            writer.write_table(table)
+    manifest = read_manifest(path)
+    assert [shard['first_row'] for shard in manifest['shards']] == [0, 400, 800]
+    assert sum(shard['total_length'] for shard in manifest['shards']) == int(sum(t.column('length').to_numpy().sum() for t in make_tables()))
+    assert all(shard['min_length'] <= shard['max_length'] for shard in manifest['shards'])
+    assert manifest['ordering'] == {'mode': 'shuffle'}
@@ -9,7 +9,14 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
 from data_pipeline.processing import (
     is_valid_python_code,
     validate_code,
-    transform_to_alpaca_format
+    transform_to_alpaca_format,
+    find_invalid_code,
+    syntax_error_reason,
+    ValidationMemo,
+    to_alpaca_frame,
+    process_in_batches,
+    LengthBudget,
+    LengthEstimator,
 )
 
 @pytest.fixture
@@ -67,4 +74,104 @@ def test_transform_to_alpaca_format(sample_dataframe):
         'input': '',
         'output': valid_df.iloc[0]['completion']
     }
-    assert transformed_data[0] == expected_record 
\ No newline at end of file
+    assert transformed_data[0] == expected_record 
+
+def test_syntax_error_reason():
+    """Tests that the rejection reason names the error and its line, and null bytes are rejected rather than raising."""
+    assert syntax_error_reason("x = 1") is None
+    assert syntax_error_reason("x = 1\ndef f(:\n    pass").startswith("SyntaxError: ")
+    assert syntax_error_reason("x = 1\ndef f(:\n    pass").endswith("(line 2)")
+    assert syntax_error_reason("x = '\0'\0") is not None
+
+def test_find_invalid_code_parallel_matches_serial():
+    """Tests that the process pool returns the same reasons, in order, as the serial path."""
+    completions = [f"def f{i}():\n    return {i}" if i % 4 else f"def f{i}(:" for i in range(64)]
+    serial = find_invalid_code(completions)
+    assert find_invalid_code(completions, num_workers=2, chunk_size=8) == serial
+    assert [reason is None for reason in serial] == [bool(i % 4) for i in range(64)]
+
+def test_validation_memo_is_reused_across_runs(tmp_path, sample_dataframe):
+    """Tests that a second run takes every result from the memo."""
+    memo_path = str(tmp_path / "memo.sqlite")
+    with ValidationMemo(memo_path) as memo:
+        first = find_invalid_code(sample_dataframe['completion'].tolist(), memo=memo)
+        assert memo.hits == 0
+    with ValidationMemo(memo_path) as memo:
+        assert find_invalid_code(sample_dataframe['completion'].tolist(), memo=memo) == first
+        assert memo.hits == 2
+
+def test_validate_code_records_rejection_reasons(tmp_path, sample_dataframe):
+    """Tests that rejected rows are written with their reason."""
+    rejected_path = tmp_path / "rejected.jsonl"
+    validate_code(sample_dataframe, rejected_path=str(rejected_path))
+    rejected = pd.read_json(rejected_path, lines=True)
+    assert rejected['prompt'].tolist() == ['Create a broken function.']
+    assert rejected['rejection_reason'][0].startswith("SyntaxError")
+
+def test_to_alpaca_frame_matches_record_transform(sample_dataframe):
+    """Tests that the column-wise transform produces the same records as transform_to_alpaca_format."""
+    frame = to_alpaca_frame(sample_dataframe)
+    assert list(frame.columns) == ['instruction', 'input', 'output']
+    assert frame.to_dict('records') == transform_to_alpaca_format(sample_dataframe)
+
+def test_process_in_batches_matches_in_memory_path(tmp_path):
+    """Tests that the streaming path writes the same output as validating and transforming in memory."""
+    df = pd.DataFrame({
+        'prompt': [f'Prompt {i}' for i in range(10)],
+        'completion': [f'def f{i}():\n    return {i}' if i % 3 else f'def f{i}(:' for i in range(10)],
+    })
+    input_path = tmp_path / 'input.jsonl'
+    output_path = tmp_path / 'output.jsonl'
+    rejected_path = tmp_path / 'rejected.jsonl'
+    df.to_json(input_path, orient='records', lines=True)
+
+    counts = process_in_batches(str(input_path), str(output_path), batch_size=3, rejected_path=str(rejected_path))
+
+    assert counts == {'read': 10, 'written': 6, 'rejected': 4, 'over_budget': 0}
+    expected = transform_to_alpaca_format(validate_code(df))
+    assert pd.read_json(output_path, lines=True).to_dict('records') == expected
+    assert len(pd.read_json(rejected_path, lines=True)) == 4
+
+class WordTokenizer:
+    """A stand-in tokenizer with one token per whitespace-separated word, plus BOS."""
+
+    def __call__(self, texts):
+        return {'input_ids': [[0] + [1] * len(text.split()) for text in texts]}
+
+def budget_dataframe():
+    """Returns valid records whose formatted examples are 7 + n tokens long for n = 0..39 words."""
+    return pd.DataFrame({
+        'prompt': ['Write it.'] * 40,
+        'completion': [f"def f():\n    return {' + '.join(['x'] * (n // 2 + 1))}" for n in range(0, 80, 2)],
+    })
+
+def test_length_budget_routes_records_over_budget():
+    """Tests that the calibrated estimate plus exact borderline counts route exactly the records over the budget."""
+    df = budget_dataframe()
+    tokenizer = WordTokenizer()
+    exact = [len(ids) for ids in tokenizer(('### Instruction:\n' + df['prompt'] + '\n\n### Response:\n' + df['completion']).tolist())['input_ids']]
+    budget = LengthBudget(40, LengthEstimator(tokenizer), calibration_samples=10)
+    fit_df, over_df = budget.split(df)
+    assert sorted(over_df.index) == [i for i, count in enumerate(exact) if count > 40]
+    assert len(fit_df) + len(over_df) == len(df)
+    assert over_df['token_count'].dropna().gt(40).all() and (over_df['estimated_tokens'] > 0).all()
+    assert 0 < budget.stats['checked'] < len(df)
+    assert budget.estimator.error_summary()['samples'] >= 10
+
+def test_length_budget_without_tokenizer_uses_the_estimate(tmp_path):
+    """Tests the uncalibrated estimate and that the streaming path writes over-budget records to the overflow file."""
+    df = budget_dataframe()
+    input_path, output_path, overflow_path = tmp_path / 'input.jsonl', tmp_path / 'output.jsonl', tmp_path / 'overflow.jsonl'
+    df.to_json(input_path, orient='records', lines=True)
+    budget = LengthBudget(40)
+    counts = process_in_batches(str(input_path), str(output_path), batch_size=7, length_budget=budget, overflow_path=str(overflow_path))
+    overflow = pd.read_json(overflow_path, lines=True)
+    assert counts['over_budget'] == len(overflow) > 0 and counts['written'] == len(df) - len(overflow)
+    assert (overflow['estimated_tokens'] > 40).all() and overflow['token_count'].isna().all()
+    assert budget.stats['checked'] == 0
+
+def test_length_budget_needs_a_cached_tokenizer(tmp_path):
+    """Tests that the configured budget is off by default and does not route records without a tokenizer to calibrate it."""
+    assert LengthBudget.from_config({'processing': {}}) is None
+    config = {'processing': {'length_budget': {'enabled': True, 'tokenizer_name': str(tmp_path / 'no-tokenizer')}}}
+    assert LengthBudget.from_config(config) is None
@@ -0,0 +1,87 @@
+import pytest
+import asyncio
+import time
+import sys
+import os
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.refinement import AsyncRefiner, TokenBucket, TransientLLMError
+
+@pytest.fixture
+def records():
+    """Returns records where every third docstring is judged low quality."""
+    return [{'prompt': f'doc {i}', 'completion': f'def f{i}(): pass  # {"bad" if i % 3 == 0 else "ok"}'} for i in range(30)]
+
+async def judge(docstring, code):
+    """A fake judge whose latency varies per record so calls finish out of order."""
+    await asyncio.sleep(0.001 * (hash(code) % 7))
+    return {'score': 1 if 'bad' in code else 5}
+
+async def generator(code):
+    """A fake generator."""
+    await asyncio.sleep(0.001)
+    return 'generated'
+
+def test_results_keep_input_order(records):
+    """Tests that results come back in input order and low scores are regenerated."""
+    refiner = AsyncRefiner(judge, generator, concurrency=8)
+    refined = refiner.run(records)
+    assert [r['completion'] for r in refined] == [r['completion'] for r in records]
+    assert [r['prompt'] for r in refined] == ['generated' if i % 3 == 0 else f'doc {i}' for i in range(30)]
+    assert refiner.stats['judge_calls'] == 30
+    assert refiner.stats['generator_calls'] == 10
+
+def test_concurrency_limit_is_respected(records):
+    """Tests that no more than `concurrency` calls are ever in flight."""
+    in_flight = 0
+    peak = 0
+
+    async def tracking_judge(docstring, code):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.005)
+        in_flight -= 1
+        return {'score': 5}
+
+    AsyncRefiner(tracking_judge, generator, concurrency=4).run(records)
+    assert peak == 4
+
+def test_transient_errors_are_retried(records):
+    """Tests that transient failures are retried and counted."""
+    failures = {}
+
+    async def flaky_judge(docstring, code):
+        if failures.setdefault(code, 0) < 2:
+            failures[code] += 1
+            raise TransientLLMError('429')
+        return {'score': 5}
+
+    refiner = AsyncRefiner(flaky_judge, generator, concurrency=8, backoff_base=0.001, seed=0)
+    refined = refiner.run(records[:5])
+    assert len(refined) == 5
+    assert refiner.stats['retries'] == 10
+
+def test_retries_are_bounded():
+    """Tests that a call failing more than max_retries times raises."""
+    async def failing_judge(docstring, code):
+        raise TransientLLMError('503')
+
+    refiner = AsyncRefiner(failing_judge, generator, max_retries=2, backoff_base=0.001)
+    with pytest.raises(TransientLLMError):
+        refiner.run([{'prompt': 'doc', 'completion': 'code'}])
+    assert refiner.stats['retries'] == 2
+
+def test_token_bucket_paces_requests():
+    """Tests that acquiring beyond the bucket's capacity waits for the refill."""
+    async def acquire_all():
+        bucket = TokenBucket(rate_per_minute=6000, capacity=10)
+        start = time.monotonic()
+        for _ in range(20):
+            await bucket.acquire(1)
+        return time.monotonic() - start
+
+    # 10 tokens are available up front; the other 10 refill at 100/s.
+    assert asyncio.run(acquire_all()) >= 0.09
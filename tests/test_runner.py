@@ -0,0 +1,93 @@
+import pytest
+import asyncio
+import json
+import time
+import sys
+import os
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.runner import start_stage, rebatch, StageQueue, TeeWriter
+from data_pipeline.refinement import AsyncRefiner
+
+def test_stages_stream_in_order():
+    """Tests that batches flow through chained stages in order."""
+    def produce(out):
+        for i in range(5):
+            out.write_records([{'n': i}])
+
+    def double(upstream):
+        return lambda out: [out.write_records([{'n': r['n'] * 2} for r in batch]) for batch in upstream]
+
+    first = start_stage('first', produce, maxsize=2)
+    second = start_stage('second', double(first), maxsize=2)
+    assert [batch[0]['n'] for batch in second] == [0, 2, 4, 6, 8]
+
+def test_bounded_queue_applies_backpressure():
+    """Tests that a producer cannot run more than the queue depth ahead of its consumer."""
+    produced = []
+    def produce(out):
+        for i in range(10):
+            out.put(i)
+            produced.append(i)
+
+    stage = start_stage('fast', produce, maxsize=2)
+    time.sleep(0.3)
+    assert len(produced) == 2
+    assert list(stage) == list(range(10))
+
+def test_errors_reach_the_consumer():
+    """Tests that a failing producer ends the stream with its error."""
+    def produce(out):
+        out.put(1)
+        raise ValueError("boom")
+
+    stage = start_stage('broken', produce)
+    with pytest.raises(RuntimeError, match="boom"):
+        list(stage)
+
+def test_async_iteration_and_refiner_pairs():
+    """Tests that the refiner consumes a stage queue asynchronously and keeps the record order."""
+    def produce(out):
+        for i in range(3):
+            out.write_records([{'prompt': f'doc {i}', 'completion': f'def f{i}(): pass'}])
+
+    async def judge(docstring, code):
+        return {'score': 1 if 'f1' in code else 5}
+
+    async def generator(code):
+        return 'generated'
+
+    stage = start_stage('records', produce)
+
+    async def pairs():
+        async for batch in stage:
+            for record in batch:
+                yield record, None
+
+    async def collect():
+        return [r async for r in AsyncRefiner(judge, generator).iter_refined_pairs(pairs())]
+
+    refined = asyncio.run(collect())
+    assert [r['prompt'] for r in refined] == ['doc 0', 'generated', 'doc 2']
+
+def test_tee_writer_and_rebatch():
+    """Tests that the tee copies batches to the intermediate writer and rebatch regroups records."""
+    class ListWriter:
+        def __init__(self):
+            self.records = []
+
+        def write_records(self, records):
+            self.records.extend(records)
+
+        def write_jsonl(self, text):
+            self.records.extend(json.loads(line) for line in text.splitlines())
+
+    stage, writer = StageQueue('tee'), ListWriter()
+    tee = TeeWriter(stage, writer)
+    tee.write_records([{'n': 0}, {'n': 1}, {'n': 2}])
+    tee.write_jsonl('{"n": 3}\n{"n": 4}\n')
+    stage.close()
+    assert [r['n'] for r in writer.records] == [0, 1, 2, 3, 4]
+    assert [len(batch) for batch in rebatch(stage, 2)] == [2, 2, 1]
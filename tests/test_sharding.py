@@ -0,0 +1,76 @@
+import pytest
+import sys
+import os
+import threading
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.sharding import balanced_partition, build_plan, load_plan, shard_config, shard_files, shard_path, write_plan
+
+def test_balanced_partition_is_contiguous_and_balanced():
+    """Tests that shards are consecutive, non-empty ranges with about equal bytes."""
+    sizes = [10, 30, 20, 20, 5, 15, 40, 10, 25, 25]
+    starts = balanced_partition(sizes, 4)
+    assert starts[0] == 0 and starts == sorted(set(starts)) and len(starts) == 4
+    ends = starts[1:] + [len(sizes)]
+    totals = [sum(sizes[start:end]) for start, end in zip(starts, ends)]
+    assert max(totals) - min(totals) <= max(sizes)
+
+def test_balanced_partition_keeps_every_shard_non_empty():
+    """Tests that a dominant file does not leave shards empty and that there are never more shards than files."""
+    assert balanced_partition([1, 1, 1, 100], 3) == [0, 2, 3]
+    assert balanced_partition([100, 1, 1, 1], 3) == [0, 1, 2]
+    assert balanced_partition([5, 5], 8) == [0, 1]
+
+def test_shard_config_rewrites_stage_outputs():
+    """Tests that outputs and metrics move to per-shard paths while shared caches stay put."""
+    config = {
+        'data': {'extracted_path': 'data/intermediate/extracted_pairs.jsonl', 'tokenized_path': 'data/tokenized',
+                 'raw_repo_path': 'data/raw_code_repo'},
+        'refinement': {'cache_path': 'data/cache/llm_responses.sqlite'},
+        'metrics': {'metrics_dir': 'data/metrics'},
+    }
+    sharded = shard_config(config, 2, 8)
+    assert sharded['data']['extracted_path'] == 'data/intermediate/extracted_pairs.shard-00002-of-00008.jsonl'
+    assert sharded['data']['tokenized_path'] == shard_path('data/tokenized', 2, 8) == 'data/tokenized.shard-00002-of-00008'
+    assert sharded['data']['raw_repo_path'] == 'data/raw_code_repo'
+    assert sharded['refinement']['cache_path'] == 'data/cache/llm_responses.sqlite'
+    assert sharded['metrics']['metrics_dir'] == os.path.join('data/metrics', 'shard-00002-of-00008')
+    assert config['data']['extracted_path'] == 'data/intermediate/extracted_pairs.jsonl'
+    with pytest.raises(ValueError):
+        shard_config(config, 8, 8)
+
+def test_plan_round_trip(tmp_path):
+    """Tests that a written plan covers every file once, in order, and is only reused for the same repo and shard count."""
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    files = []
+    for i, size in enumerate([300, 100, 100, 100, 200, 50, 50]):
+        path = repo / f'mod_{i}.py'
+        path.write_text('x' * size)
+        files.append(str(path))
+    plan_path = str(tmp_path / 'plan.json')
+    write_plan(plan_path, build_plan(str(repo), files, 3))
+
+    plan = load_plan(plan_path, str(repo), 3)
+    assert plan['num_shards'] == 3 and plan['total_bytes'] == 900
+    assert [path for index in range(3) for path in shard_files(plan, index, 3)] == files
+    assert load_plan(plan_path, str(repo), 4) is None
+    assert load_plan(plan_path, str(tmp_path / 'other'), 3) is None
+    assert load_plan(plan_path, str(repo), 3, files) == plan
+    assert load_plan(plan_path, str(repo), 3, files + [str(repo / 'mod_7.py')]) is None
+    with pytest.raises(ValueError):
+        shard_files(plan, 0, 4)
+
+def test_concurrent_plan_writes_do_not_collide(tmp_path):
+    """Tests that writers of the same plan use their own temporary files and leave none behind."""
+    plan_path = str(tmp_path / 'plan.json')
+    plans = [{'version': 1, 'writer': i, 'padding': 'x' * 100000} for i in range(8)]
+    threads = [threading.Thread(target=write_plan, args=(plan_path, plan)) for plan in plans]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert load_plan(plan_path) in plans
+    assert os.listdir(tmp_path) == ['plan.json']
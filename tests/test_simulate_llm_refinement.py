@@ -0,0 +1,45 @@
+import pytest
+import sys
+import os
+import asyncio
+
+# Add the src directory to the Python path to allow for package imports, and the
+# scripts directory for the refinement entry point
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+
+import simulate_llm_refinement as refinement
+from data_pipeline.fake_llm_server import FakeLLM, FakeLLMServer, LatencyModel
+
+@pytest.fixture
+def real_llm(monkeypatch):
+    """Switches refinement to the real OpenAI client for one test and back afterwards."""
+    pytest.importorskip("openai")
+    for name in ('USE_REAL_LLM', 'REAL_TRANSIENT_ERRORS', 'openai', 'httpx', '_async_client'):
+        monkeypatch.setattr(refinement, name, getattr(refinement, name))
+    refinement.enable_real_llm(api_key='fake-key')
+    return refinement
+
+def test_pooled_client_against_the_fake_server(real_llm):
+    """Tests that a session's pooled client refines records over the fake API with at most `concurrency` connections."""
+    latency = LatencyModel(distribution='constant', seconds=0.05)
+    records = [{'prompt': f'Returns {i}.', 'completion': f'def f{i}():\n    return {i}'} for i in range(12)]
+    with FakeLLMServer(FakeLLM(latency, latency, bad_docstring_rate=0.5)) as server:
+        config = {'concurrency': 3, 'api_base_url': server.url, 'request_timeout_seconds': 5.0}
+        client = real_llm.build_async_client(config)
+        assert client.max_retries == 0 and str(client.base_url).startswith(server.url)
+        asyncio.run(client.close())
+
+        refiner = real_llm.build_refiner(config)
+
+        async def refine_all():
+            async with real_llm.llm_client_session(config):
+                return [record async for record in refiner.iter_refined(records)]
+
+        refined = asyncio.run(refine_all())
+        stats = server.snapshot()
+    assert [record['completion'] for record in refined] == [record['completion'] for record in records]
+    assert stats['requests.judge'] == len(records)
+    assert stats['requests.generator'] == refiner.stats['regenerated'] > 0
+    assert 1 <= stats['connections'] <= 3
+    assert real_llm._async_client is None
@@ -0,0 +1,95 @@
+import pytest
+import sys
+import os
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+datasets = pytest.importorskip("datasets")
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+from data_pipeline.tokenization import (
+    format_prompts,
+    tokenize_dataset,
+    column_sum,
+    ThroughputReport,
+    make_packing_tokenizer,
+    pack_lengths,
+    pack_dataset,
+)
+
+@pytest.fixture
+def tokenizer():
+    """Returns a small whitespace word-level fast tokenizer, built locally so no download is needed."""
+    words = "### Instruction: Response: add two numbers def add(a, b): return a + b subtract sub".split()
+    vocab = {"[PAD]": 0, "[UNK]": 1, "</s>": 2}
+    for word in words:
+        vocab.setdefault(word, len(vocab))
+    model = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="[UNK]"))
+    model.pre_tokenizer = tokenizers.pre_tokenizers.WhitespaceSplit()
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=model, pad_token="[PAD]", unk_token="[UNK]", eos_token="</s>")
+
+@pytest.fixture
+def dataset():
+    """Returns a small Alpaca-format dataset."""
+    return datasets.Dataset.from_dict({
+        'instruction': ['add two numbers', 'subtract'],
+        'input': ['', ''],
+        'output': ['def add(a, b): return a + b', 'def sub(a, b): return a - b'],
+    })
+
+def test_format_prompts():
+    """Tests the prompt template."""
+    assert format_prompts(['Do it.'], ['pass']) == ["### Instruction:\nDo it.\n\n### Response:\npass"]
+
+def test_tokenize_dataset_stores_lengths(tokenizer, dataset):
+    """Tests that batched tokenization pads to max_length and stores the number of real tokens."""
+    tokenized = tokenize_dataset(dataset, tokenizer, max_length=16, batch_size=1)
+    assert all(len(ids) == 16 for ids in tokenized['input_ids'])
+    assert tokenized['length'] == [sum(mask) for mask in tokenized['attention_mask']]
+    assert tokenized['length'][0] == len(format_prompts(['add two numbers'], ['def add(a, b): return a + b'])[0].split())
+    assert column_sum(tokenized, 'length') == sum(tokenized['length'])
+
+def test_multiprocess_tokenization_matches_single_process(tokenizer, dataset):
+    """Tests that spreading batches over processes gives the same result."""
+    single = tokenize_dataset(dataset, tokenizer, max_length=16, batch_size=1)
+    multi = tokenize_dataset(dataset, tokenizer, max_length=16, batch_size=1, num_proc=2)
+    assert multi['input_ids'] == single['input_ids']
+    assert multi['length'] == single['length']
+
+def test_throughput_report():
+    """Tests that the report carries records/sec and tokens/sec."""
+    report = ThroughputReport("test").finish(records=10, tokens=100)
+    assert report['records'] == 10
+    assert report['tokens_per_sec'] == pytest.approx(10 * report['records_per_sec'])
+
+@pytest.mark.parametrize("strategy", ["first_fit", "best_fit"])
+def test_pack_lengths_respects_capacity(strategy):
+    """Tests that every example is packed exactly once and no bin overflows."""
+    lengths = [7, 3, 5, 5, 2, 8, 1, 4, 6, 9]
+    bins = pack_lengths(lengths, seq_len=10, strategy=strategy)
+    assert sorted(i for b in bins for i in b) == list(range(len(lengths)))
+    assert all(sum(lengths[i] for i in b) <= 10 for b in bins)
+    # 50 tokens into bins of 10: both decreasing heuristics reach the optimum here.
+    assert len(bins) == 5
+
+def test_pack_lengths_rejects_oversized_examples():
+    """Tests that an example longer than the sequence length is an error."""
+    with pytest.raises(ValueError):
+        pack_lengths([11], seq_len=10)
+
+def test_pack_dataset(tokenizer, dataset):
+    """Tests that packed sequences carry EOS separators, document boundaries and restarting position ids."""
+    tokenized = dataset.map(make_packing_tokenizer(tokenizer, 32), batched=True, remove_columns=dataset.column_names)
+    packed, stats = pack_dataset(tokenized, seq_len=32, pad_token_id=tokenizer.pad_token_id)
+
+    assert stats['sequences'] == len(packed) == 1
+    assert stats['padding_ratio_after'] < stats['padding_ratio_before']
+    row = packed[0]
+    first, second = row['document_lengths']
+    assert len(row['input_ids']) == 32
+    assert row['input_ids'][first - 1] == tokenizer.eos_token_id
+    assert row['input_ids'][first + second - 1] == tokenizer.eos_token_id
+    assert row['position_ids'][:first + 1] == list(range(first)) + [0]
+    assert sum(row['attention_mask']) == row['length'] == first + second
@@ -0,0 +1,63 @@
+import pytest
+import sys
+import os
+
+# Add the src directory to the Python path to allow for package imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from data_pipeline.triage import DocstringTriage, GOOD, BAD, UNCERTAIN
+
+def make_code(docstring, signature='def scale(values, factor):', body='return [v * factor for v in values]'):
+    """Builds a function whose docstring is `docstring`, preceded by a context header."""
+    return f'import math\n\n{signature}\n    """{docstring}"""\n    {body}\n'
+
+@pytest.fixture
+def triage():
+    """Returns a triage with the default thresholds."""
+    return DocstringTriage()
+
+def test_complete_docstring_is_good(triage):
+    """Tests that a docstring covering every parameter and the return value is confidently good."""
+    docstring = 'Multiplies every entry of values by factor and returns the scaled entries as a new list, leaving the input untouched.'
+    assert triage.classify(docstring, make_code(docstring)) == GOOD
+
+def test_one_word_docstring_is_bad(triage):
+    """Tests that a docstring below the minimum word count is confidently bad."""
+    assert triage.classify('Scale.', make_code('Scale.')) == BAD
+
+def test_docstring_missing_signature_is_bad(triage):
+    """Tests that a short docstring mentioning no parameters or return value is confidently bad."""
+    docstring = 'Does the scaling thing.'
+    assert triage.classify(docstring, make_code(docstring)) == BAD
+
+def test_partial_docstring_is_uncertain(triage):
+    """Tests that a docstring between the thresholds is left to the judge."""
+    docstring = 'Scales the values by the given factor.'
+    assert triage.classify(docstring, make_code(docstring)) == UNCERTAIN
+
+def test_records_without_a_matching_function_are_uncertain(triage):
+    """Tests that chunks and unparsable code always go to the judge."""
+    assert triage.classify('This is a code chunk.', 'for x in y:\n    pass') == UNCERTAIN
+    assert triage.classify('Doc string here.', 'def broken(:') == UNCERTAIN
+
+def test_signals_ignore_self_and_functions_without_return(triage):
+    """Tests that self is not counted as a parameter and a missing return value needs no mention."""
+    docstring = 'Logs the message.'
+    code = make_code(docstring, signature='def log(self, message):', body='print(message)')
+    score, signals = triage.score(docstring, code)
+    assert signals == {'words': 3, 'param_coverage': 1.0, 'return_covered': True}
+
+def test_judgements_and_stats(triage):
+    """Tests that confident verdicts become judge-style scores and avoided calls are counted."""
+    good = 'Multiplies every entry of values by factor and returns the scaled entries as a new list, leaving the input untouched.'
+    assert triage.judgement(good, make_code(good))['score'] == 5
+    assert triage.judgement('Scale.', make_code('Scale.'))['score'] == 1
+    assert triage.judgement('This is a code chunk.', 'for x in y:\n    pass') is None
+    assert triage.judge_calls_avoided == 2
+    assert triage.stats == {GOOD: 1, BAD: 1, UNCERTAIN: 1}
+
+def test_thresholds_are_configurable():
+    """Tests that widening the thresholds sends everything to the judge."""
+    triage = DocstringTriage(min_words=0, good_threshold=1.1, bad_threshold=-0.1)
+    docstring = 'Scale.'
+    assert triage.classify(docstring, make_code(docstring)) == UNCERTAIN